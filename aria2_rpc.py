@@ -0,0 +1,162 @@
+import os
+import time
+import uuid
+import socket
+import logging
+import threading
+import subprocess
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+# aria2cのRPC呼び出し・ダウンロードの失敗
+class Aria2Error(Exception):
+    pass
+
+
+# aria2cに渡す分割ダウンロードのオプション
+def aria2c_split_options(connections=16, split=16, min_split_size='1M'):
+    """接続数・分割数・最小分割サイズをaria2cのオプションに変換する"""
+    return {
+        'max-connection-per-server': str(min(int(connections), 16)),
+        'split': str(int(split)),
+        'min-split-size': str(min_split_size)
+    }
+
+
+def _free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class Aria2Daemon:
+    """複数のジョブで共有する常駐aria2c（JSON-RPCで制御）"""
+
+    def __init__(self, aria2c_path, options=None, max_concurrent=16):
+        self.aria2c_path = aria2c_path
+        self.options = dict(options or {})
+        self.max_concurrent = max_concurrent
+        self.port = None
+        self.secret = uuid.uuid4().hex
+        self.process = None
+        self._session = requests.Session()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        """aria2cを起動する（既に起動していれば何もしない）"""
+        with self._lock:
+            if self.running:
+                return
+            self.port = _free_port()
+            cmd = [
+                self.aria2c_path,
+                '--enable-rpc',
+                '--rpc-listen-all=false',
+                f'--rpc-listen-port={self.port}',
+                f'--rpc-secret={self.secret}',
+                f'--max-concurrent-downloads={self.max_concurrent}',
+                '--continue=true',
+                '--auto-file-renaming=false',
+                '--allow-overwrite=true',
+                '--file-allocation=none',
+                '--console-log-level=warn',
+                '--summary-interval=0'
+            ] + [f'--{key}={value}' for key, value in self.options.items()]
+            self.process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+            # RPCが応答するまで待つ
+            deadline = time.time() + 10
+            while time.time() < deadline:
+                try:
+                    self._call('aria2.getVersion')
+                    logger.info(f"常駐aria2cを起動しました: ポート {self.port}")
+                    return
+                except Exception:
+                    time.sleep(0.1)
+            self.process.kill()
+            self.process = None
+            raise Aria2Error("常駐aria2cの起動に失敗しました")
+
+    def stop(self):
+        """aria2cを終了する"""
+        with self._lock:
+            if not self.running:
+                return
+            try:
+                self._call('aria2.shutdown')
+                self.process.wait(timeout=5)
+            except Exception:
+                self.process.kill()
+            self.process = None
+            logger.info("常駐aria2cを終了しました")
+
+    def call(self, method, *params):
+        """RPCメソッドを呼び出す（必要ならaria2cを起動する）"""
+        if not self.running:
+            self.start()
+        return self._call(method, *params)
+
+    def _call(self, method, *params):
+        payload = {
+            'jsonrpc': '2.0',
+            'id': uuid.uuid4().hex,
+            'method': method,
+            'params': [f'token:{self.secret}'] + list(params)
+        }
+        response = self._session.post(f'http://127.0.0.1:{self.port}/jsonrpc', json=payload, timeout=10)
+        data = response.json()
+        if 'error' in data:
+            raise Aria2Error(f"{method}: {data['error'].get('message')}")
+        return data['result']
+
+    def add_uri(self, url, output_path, options=None):
+        """ダウンロードを追加してGIDを返す"""
+        opts = dict(options or {})
+        opts['dir'] = os.path.dirname(os.path.abspath(output_path))
+        opts['out'] = os.path.basename(output_path)
+        return self.call('aria2.addUri', [url], opts)
+
+    def change_option(self, gid, options):
+        """実行中のダウンロードのオプション（速度制限など）を変更する"""
+        return self.call('aria2.changeOption', gid, options)
+
+    def wait(self, gids, poll_interval=0.5, on_progress=None):
+        """すべてのダウンロードが終わるまで待ち、合計バイト数を返す"""
+        remaining = set(gids)
+        downloaded = dict.fromkeys(gids, 0)
+        while remaining:
+            speed = 0
+            for gid in list(remaining):
+                status = self.call('aria2.tellStatus', gid,
+                                   ['status', 'completedLength', 'downloadSpeed', 'errorMessage'])
+                downloaded[gid] = int(status['completedLength'])
+                speed += int(status['downloadSpeed'])
+                if status['status'] == 'complete':
+                    remaining.discard(gid)
+                elif status['status'] in ('error', 'removed'):
+                    # 1つでも失敗したら残りのダウンロードも取り消す
+                    for other in remaining - {gid}:
+                        try:
+                            self.call('aria2.remove', other)
+                        except Aria2Error:
+                            pass
+                    raise Aria2Error(f"aria2cのダウンロードに失敗しました: {status.get('errorMessage') or status['status']}")
+            if on_progress:
+                on_progress({"downloaded_bytes": sum(downloaded.values()), "speed": speed})
+            if remaining:
+                time.sleep(poll_interval)
+        return sum(downloaded.values())
+
+    def download_files(self, targets, options=None, on_start=None):
+        """(URL, 出力パス)のリストを同時にダウンロードする（on_startには追加したGIDのリストを渡す）"""
+        gids = [self.add_uri(url, path, options) for url, path in targets]
+        if on_start is not None:
+            on_start(gids)
+        return self.wait(gids)
@@ -67,6 +67,115 @@ function sanitizeFilename(filename) {
         .trim(); // 先頭と末尾の空白を削除
 }
 
+// ジョブの状態から結果を取り出す（完了していなければnull）
+function jobOutcome(job) {
+    if (job.state === 'finished') {
+        return job.result;
+    }
+    if (job.state === 'failed' || job.state === 'cancelled') {
+        return { status: 'error', message: job.error || 'ダウンロードに失敗しました' };
+    }
+    return null;
+}
+
+// ダウンロードジョブの完了を待つ（Server-Sent Eventsで進捗を受信）
+async function waitForJob(jobId, onProgress = null) {
+    try {
+        const response = await fetch(`${SERVER_URL}/jobs/${jobId}/events`, {
+            headers: {
+                'Accept': 'text/event-stream',
+                'Cache-Control': 'no-cache'
+            }
+        });
+        if (!response.ok || !response.body) {
+            throw new Error(`Event stream unavailable: ${response.status}`);
+        }
+        
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) {
+                break;
+            }
+            buffer += decoder.decode(value, { stream: true });
+            
+            // イベントは空行区切り
+            let separator;
+            while ((separator = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, separator);
+                buffer = buffer.slice(separator + 2);
+                
+                const dataLines = rawEvent.split('\n')
+                    .filter(line => line.startsWith('data:'))
+                    .map(line => line.slice(5).trim());
+                if (dataLines.length === 0) {
+                    continue; // keep-alive
+                }
+                
+                const job = JSON.parse(dataLines.join('\n'));
+                if (onProgress && job.progress) {
+                    onProgress(job.progress);
+                }
+                const outcome = jobOutcome(job);
+                if (outcome) {
+                    reader.cancel();
+                    return outcome;
+                }
+            }
+        }
+    } catch (error) {
+        console.warn('Job event stream failed, falling back to polling:', error.message);
+    }
+    
+    return pollJob(jobId);
+}
+
+// ジョブの状態を定期的に確認して完了を待つ（イベントストリームが使えない場合）
+async function pollJob(jobId, interval = 1000) {
+    while (true) {
+        const response = await fetch(`${SERVER_URL}/jobs/${jobId}`, {
+            method: 'GET',
+            headers: {
+                'Cache-Control': 'no-cache'
+            }
+        });
+        const data = await response.json();
+        if (data.status === 'error') {
+            throw new Error(data.message || 'ジョブの状態を取得できませんでした');
+        }
+        
+        const outcome = jobOutcome(data.job);
+        if (outcome) {
+            return outcome;
+        }
+        
+        await new Promise(resolve => setTimeout(resolve, interval));
+    }
+}
+
+// 視聴中の動画の先読みをサーバーに依頼（失敗しても無視する）
+async function requestPrefetch(endpoint, url) {
+    if (!serverRunning) {
+        return false;
+    }
+    try {
+        const response = await fetch(`${SERVER_URL}${endpoint}`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ url: url })
+        });
+        return response.ok;
+    } catch (error) {
+        console.log('Prefetch request failed:', error.message);
+        return false;
+    }
+}
+
 // サーバーへの動画ダウンロードリクエスト
 async function requestDownload(url, resolution, format, retryCount = 0) {
     const MAX_RETRIES = 3;
@@ -93,9 +202,17 @@ async function requestDownload(url, resolution, format, retryCount = 0) {
             })
         });
         
-        const data = await response.json();
+        let data = await response.json();
         console.log('Server response:', data);
         
+        // ジョブとして受け付けられた場合は完了まで待つ
+        if (data.job_id && data.state) {
+            data = await waitForJob(data.job_id, progress => {
+                console.log('Download progress:', progress);
+            });
+            console.log('Job result:', data);
+        }
+        
         // エラー応答の処理
         if (data.status === 'error') {
             throw new Error(data.message || 'ダウンロードに失敗しました');
@@ -191,6 +308,14 @@ chrome.runtime.onMessage.addListener((message, sender, sendResponse) => {
         return true; // 非同期レスポンスを示す
     }
     
+    if (message.action === 'prefetch' || message.action === 'cancel_prefetch') {
+        const endpoint = message.action === 'prefetch' ? '/prefetch' : '/prefetch/cancel';
+        requestPrefetch(endpoint, message.url)
+            .then(ok => sendResponse({ success: ok }));
+        
+        return true; // 非同期レスポンスを示す
+    }
+    
     if (message.action === 'check_server') {
         checkServerStatus()
             .then(isRunning => {
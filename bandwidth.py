@@ -0,0 +1,344 @@
+import time
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# 優先度のレーン
+LANE_INTERACTIVE = 'interactive'  # ユーザーが完了を待っている転送
+LANE_BULK = 'bulk'  # 一括ダウンロードなど急がない転送
+LANES = (LANE_INTERACTIVE, LANE_BULK)
+
+# 割り当ての下限（制限中でも転送が止まらないようにする）
+MIN_RATE = 16 * 1024
+
+# バケットに貯められる量（秒数分）
+BURST_SECONDS = 0.5
+
+# 時間帯の切り替わりを確認する間隔（秒）
+WINDOW_CHECK_INTERVAL = 30
+
+# 起動後に割り当てを変更できない転送（yt-dlpの--limit-rate）を再起動する条件
+RESTART_RATE_CHANGE = 0.2  # 起動時の割り当てからこの割合以上変わったら再起動する
+RESTART_MIN_INTERVAL = 5  # 再起動の最短間隔（秒）
+
+
+# 時間帯の解析
+def parse_window(text):
+    """'HH:MM-HH:MM'を(開始分, 終了分)に変換する（日付をまたぐ指定も可）"""
+    minutes = []
+    for part in text.split('-'):
+        hour, minute = part.strip().split(':')
+        if not (0 <= int(hour) <= 24 and 0 <= int(minute) < 60):
+            raise ValueError(text)
+        minutes.append(int(hour) * 60 + int(minute))
+    start, end = minutes
+    return start, end
+
+
+def rate_changed(old, new, threshold=RESTART_RATE_CHANGE):
+    """割り当てが再起動するほど変わったか（制限なしと制限ありの切り替えを含む）"""
+    if old == new:
+        return False
+    if not old or not new:
+        return True
+    return abs(new - old) >= old * threshold
+
+
+def in_windows(windows, now=None):
+    """現在時刻がいずれかの時間帯に含まれるか"""
+    now = now or datetime.now()
+    minute = now.hour * 60 + now.minute
+    for start, end in windows:
+        if start <= end and start <= minute < end or start > end and (minute >= start or minute < end):
+            return True
+    return False
+
+
+class TokenBucket:
+    """バイト数単位のトークンバケット（rateが0なら制限しない）"""
+
+    def __init__(self, rate=0):
+        self._lock = threading.Lock()
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self.rate = 0
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill_locked()
+            self.rate = max(0, int(rate))
+            self._tokens = min(self._tokens, self.rate * BURST_SECONDS)
+
+    def consume(self, nbytes):
+        """nbytes分のトークンを使う（足りない分は貯まるまで待つ）"""
+        with self._lock:
+            if self.rate <= 0:
+                return
+            self._refill_locked()
+            # 不足分は先払いにして、同時に呼ばれても合計が制限を超えないようにする
+            self._tokens -= nbytes
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+    def _refill_locked(self):
+        now = time.monotonic()
+        if self.rate > 0:
+            self._tokens = min(self.rate * BURST_SECONDS, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+
+class BandwidthAllocation:
+    """1件の転送に割り当てられた帯域（スケジューラーが転送の増減に応じて更新する）"""
+
+    def __init__(self, scheduler, lane, name):
+        self.scheduler = scheduler
+        self.lane = lane
+        self.name = name
+        self.rate = 0  # バイト/秒（0は無制限）
+        self.fixed_rate = None  # 外部プロセスに起動時に渡した割り当て（割り当ての変更に追従しない転送のみ）
+        self._bucket = TokenBucket()
+        self._listeners = []
+
+    def on_change(self, callback):
+        """割り当てが変わったときに呼ぶ関数を登録する（callback(rate)）"""
+        self._listeners.append(callback)
+
+    def throttle(self, nbytes):
+        """プロセス内の転送で読み取ったバイト数を渡し、割り当てを超えないように待つ"""
+        self._bucket.consume(nbytes)
+
+    def close(self):
+        self.scheduler.release(self)
+
+    def _set_rate(self, rate):
+        if rate == self.rate:
+            return False
+        self.rate = rate
+        self._bucket.set_rate(rate)
+        return True
+
+    def _notify(self):
+        for callback in self._listeners:
+            try:
+                callback(self.rate)
+            except Exception as e:
+                logger.warning(f"帯域の割り当ての反映に失敗しました: {self.name}: {e}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def to_dict(self):
+        return {"name": self.name, "lane": self.lane, "rate": self.rate, "fixed_rate": self.fixed_rate}
+
+
+class FixedRateFollower:
+    """起動後に割り当てを変更できない外部プロセスを割り当ての変化に追従させる
+
+    起動時の割り当ては他の転送が実際に使っている分を除いた残りまでにし（全体の上限を超えない）、
+    割り当てが起動時の値からrate_changed()の分だけ変わったら、最短間隔を空けてrestart()を呼ぶ。
+    呼び出し元はプロセスを終了させ、start_rate()の割り当てで続きから起動し直す。
+    """
+
+    def __init__(self, allocation, restart, min_interval=RESTART_MIN_INTERVAL):
+        self.allocation = allocation
+        self.min_interval = min_interval
+        self.requested = False  # restart()を呼んだ（プロセスの終了は再起動のため）
+        self._restart = restart
+        self._lock = threading.Lock()
+        self._started = 0.0
+        self._timer = None
+        self._closed = False
+        allocation.on_change(lambda rate: self._check())
+
+    def start_rate(self):
+        """これから起動するプロセスに渡す割り当てを決めて記録する"""
+        rate = self.allocation.scheduler.admit(self.allocation)
+        with self._lock:
+            self.allocation.fixed_rate = rate
+            self.requested = False
+            self._started = time.monotonic()
+        # 残りが足りずに割り当てより低く起動した場合は、他の転送が下がった後に引き上げる
+        self._check()
+        return rate
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self.allocation.fixed_rate = None
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def _check(self):
+        with self._lock:
+            if self._closed or self.requested or self.allocation.fixed_rate is None:
+                return
+            if not rate_changed(self.allocation.fixed_rate, self.allocation.rate):
+                return
+            wait = self.min_interval - (time.monotonic() - self._started)
+            if wait > 0:
+                if self._timer is None:
+                    self._timer = threading.Timer(wait, self._on_timer)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+            self.requested = True
+            previous = self.allocation.fixed_rate
+            # 同時に起動し直す他の転送の割り当て（admit）が再起動後の値で計算されるよう先に更新する
+            self.allocation.fixed_rate = self.allocation.rate
+        logger.info(f"帯域の割り当てが変わったため転送を再起動します: {self.allocation.name} "
+                    f"({previous} -> {self.allocation.rate} B/s)")
+        self._restart()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+        self._check()
+
+
+class BandwidthScheduler:
+    """全体の帯域の上限を実行中の転送に配分する
+
+    interactiveのレーンはbulkのinteractive_weight倍の帯域を受け取る。
+    bulkのレーンは時間帯（bulk_windows）の外ではbulk_limitに制限され、
+    時間帯の中ではinteractiveと同じ重みで配分される。
+    """
+
+    def __init__(self, limit=0, bulk_limit=0, interactive_weight=4, bulk_windows=None):
+        self._lock = threading.Lock()
+        self._allocations = []
+        self._off_peak = False
+        self._watcher = None
+        self.limit = 0
+        self.bulk_limit = 0
+        self.interactive_weight = 1
+        self.bulk_windows = []
+        self.configure(limit, bulk_limit, interactive_weight, bulk_windows)
+
+    def configure(self, limit=None, bulk_limit=None, interactive_weight=None, bulk_windows=None):
+        with self._lock:
+            if limit is not None:
+                self.limit = max(0, int(limit))
+            if bulk_limit is not None:
+                self.bulk_limit = max(0, int(bulk_limit))
+            if interactive_weight is not None:
+                self.interactive_weight = max(1, float(interactive_weight))
+            if bulk_windows is not None:
+                windows = []
+                for text in bulk_windows:
+                    try:
+                        windows.append(parse_window(text))
+                    except (ValueError, IndexError):
+                        logger.warning(f"時間帯の指定が正しくありません（HH:MM-HH:MM）: {text}")
+                self.bulk_windows = windows
+            changed = self._apportion_locked()
+        self._notify(changed)
+
+    def allocate(self, lane=LANE_INTERACTIVE, name=None):
+        """転送を登録して帯域の割り当てを返す（終了時にclose()する）"""
+        if lane not in LANES:
+            lane = LANE_INTERACTIVE
+        allocation = BandwidthAllocation(self, lane, name)
+        with self._lock:
+            self._allocations.append(allocation)
+            changed = self._apportion_locked()
+            self._ensure_watcher_locked()
+        self._notify([a for a in changed if a is not allocation])
+        return allocation
+
+    def admit(self, allocation):
+        """起動後に変更できない転送の割り当てを返す（他の転送が実際に使っている分を除いた残りまで）"""
+        with self._lock:
+            if self.limit <= 0 or allocation.rate <= 0:
+                return allocation.rate
+            used = sum(
+                a.fixed_rate if a.fixed_rate is not None else a.rate
+                for a in self._allocations if a is not allocation
+            )
+            return max(MIN_RATE, min(allocation.rate, self.limit - used))
+
+    def set_lane(self, name, lane):
+        """登録済みの転送の区分を変更する（合流したリクエストで優先度が上がった場合など）"""
+        with self._lock:
+            allocations = [a for a in self._allocations if a.name == name and a.lane != lane]
+            if not allocations:
+                return
+            for allocation in allocations:
+                allocation.lane = lane
+            changed = self._apportion_locked()
+        self._notify(changed)
+
+    def release(self, allocation):
+        with self._lock:
+            if allocation not in self._allocations:
+                return
+            self._allocations.remove(allocation)
+            changed = self._apportion_locked()
+        self._notify(changed)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "bulk_limit": self.bulk_limit,
+                "off_peak": self._off_peak,
+                "allocations": [allocation.to_dict() for allocation in self._allocations]
+            }
+
+    def _apportion_locked(self):
+        """各転送の割り当てを計算し直し、変わった割り当てを返す"""
+        self._off_peak = in_windows(self.bulk_windows)
+        interactive = [a for a in self._allocations if a.lane == LANE_INTERACTIVE]
+        bulk = [a for a in self._allocations if a.lane == LANE_BULK]
+        bulk_weight = self.interactive_weight if self._off_peak else 1
+        bulk_cap = 0 if self._off_peak else self.bulk_limit
+
+        if self.limit <= 0:
+            interactive_rate = 0
+            bulk_rate = bulk_cap / len(bulk) if bulk and bulk_cap else 0
+        else:
+            total_weight = self.interactive_weight * len(interactive) + bulk_weight * len(bulk)
+            bulk_share = self.limit * bulk_weight * len(bulk) / total_weight if total_weight else 0
+            if bulk_cap:
+                bulk_share = min(bulk_share, bulk_cap)
+            # bulkが使わない分はinteractiveに回す
+            interactive_rate = (self.limit - bulk_share) / len(interactive) if interactive else 0
+            bulk_rate = bulk_share / len(bulk) if bulk else 0
+
+        changed = []
+        for allocation in self._allocations:
+            rate = interactive_rate if allocation.lane == LANE_INTERACTIVE else bulk_rate
+            rate = max(MIN_RATE, int(rate)) if rate > 0 else 0
+            if allocation._set_rate(rate):
+                changed.append(allocation)
+        return changed
+
+    def _notify(self, allocations):
+        for allocation in allocations:
+            allocation._notify()
+
+    def _ensure_watcher_locked(self):
+        if self.bulk_windows and (self._watcher is None or not self._watcher.is_alive()):
+            self._watcher = threading.Thread(target=self._watch_windows, name='bandwidth-windows', daemon=True)
+            self._watcher.start()
+
+    def _watch_windows(self):
+        """時間帯の切り替わりで割り当てを計算し直す（転送がなくなったら終了）"""
+        while True:
+            time.sleep(WINDOW_CHECK_INTERVAL)
+            with self._lock:
+                if not self._allocations or not self.bulk_windows:
+                    self._watcher = None
+                    return
+                if in_windows(self.bulk_windows) == self._off_peak:
+                    continue
+                changed = self._apportion_locked()
+            logger.info("時間帯が切り替わったため帯域の割り当てを更新しました")
+            self._notify(changed)
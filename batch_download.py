@@ -0,0 +1,122 @@
+import time
+import uuid
+import logging
+import threading
+
+from metadata_cache import canonical_video_key
+from extractor_output import iter_json_lines, info_template
+
+logger = logging.getLogger(__name__)
+
+BATCH_EXPANDING = 'expanding'
+BATCH_SCHEDULED = 'scheduled'
+BATCH_FAILED = 'failed'
+
+# 展開したエントリーから読み取る項目
+PLAYLIST_ENTRY_FIELDS = ('id', 'url', 'webpage_url', 'title', 'ie_key')
+
+
+# 単一の動画URLかどうか
+def is_single_video_url(url):
+    """展開せずにそのままダウンロードできるURLか（YouTubeの動画ID付きURL）を判定する"""
+    return canonical_video_key(url).startswith('youtube:')
+
+
+# 再生リスト・チャンネルを1件ずつ展開
+def iter_playlist_entries(ytdlp_path, url):
+    """--flat-playlistで取得したエントリーを1行ずつ読み取り、(動画URL, タイトル)を返す"""
+    cmd = [ytdlp_path, '--flat-playlist', '-O', info_template(PLAYLIST_ENTRY_FIELDS), '--no-warnings', url]
+    for entry in iter_json_lines(cmd):
+        entry_url = entry.get('webpage_url') or entry.get('url')
+        if entry.get('ie_key') == 'Youtube' and entry.get('id'):
+            entry_url = f"https://www.youtube.com/watch?v={entry['id']}"
+        if entry_url:
+            yield entry_url, entry.get('title')
+
+
+class Batch:
+    """複数URL・再生リストのダウンロード要求"""
+
+    def __init__(self, sources, params):
+        self.id = uuid.uuid4().hex
+        self.sources = sources
+        self.params = params
+        self.state = BATCH_EXPANDING
+        self.created_at = time.time()
+        self.job_ids = []
+        self.seen = set()
+        self.duplicates = 0
+        self.errors = []
+
+    def to_dict(self, job_queue, include_jobs=False):
+        jobs = [job_queue.get(job_id) for job_id in self.job_ids]
+        counts = {}
+        for job in jobs:
+            if job is not None:
+                counts[job.state] = counts.get(job.state, 0) + 1
+        data = {
+            "batch_id": self.id,
+            "state": self.state,
+            "sources": self.sources,
+            "created_at": self.created_at,
+            "total": len(self.job_ids),
+            "duplicates": self.duplicates,
+            "jobs_by_state": counts,
+            "errors": self.errors
+        }
+        if include_jobs:
+            data["jobs"] = [job.to_dict() for job in jobs if job is not None]
+        return data
+
+
+class BatchManager:
+    """バッチを展開しながらジョブキューに投入する"""
+
+    def __init__(self, job_queue, ytdlp_path, history_size=50, on_spawn=None):
+        self.job_queue = job_queue
+        self.ytdlp_path = ytdlp_path
+        self.on_spawn = on_spawn  # yt-dlpを起動するたびに呼ぶ関数（メトリクス用）
+        self.history_size = history_size
+        self._batches = {}
+        self._lock = threading.Lock()
+
+    def create(self, sources, params):
+        """バッチを作成し、展開をバックグラウンドで開始する"""
+        batch = Batch(sources, params)
+        with self._lock:
+            self._batches[batch.id] = batch
+            for old_id in list(self._batches)[:max(0, len(self._batches) - self.history_size)]:
+                del self._batches[old_id]
+        threading.Thread(target=self._expand, args=(batch,), name=f"batch-{batch.id[:8]}", daemon=True).start()
+        return batch
+
+    def get(self, batch_id):
+        with self._lock:
+            return self._batches.get(batch_id)
+
+    def _schedule(self, batch, url):
+        # 同じ動画IDは1回だけダウンロードする
+        key = canonical_video_key(url)
+        if key in batch.seen:
+            batch.duplicates += 1
+            return
+        batch.seen.add(key)
+        job = self.job_queue.submit('download', dict(batch.params, url=url, batch_id=batch.id))
+        batch.job_ids.append(job.id)
+
+    def _expand(self, batch):
+        for source in batch.sources:
+            try:
+                if is_single_video_url(source):
+                    self._schedule(batch, source)
+                    continue
+                if self.on_spawn is not None:
+                    self.on_spawn('yt-dlp')
+                # 再生リストは全件の取得を待たずに、読み取ったエントリーから順に投入する
+                for entry_url, _ in iter_playlist_entries(self.ytdlp_path, source):
+                    self._schedule(batch, entry_url)
+            except Exception as e:
+                logger.error(f"バッチの展開に失敗しました: {source}: {e}")
+                batch.errors.append({"source": source, "message": str(e)})
+        batch.state = BATCH_FAILED if batch.errors and not batch.job_ids else BATCH_SCHEDULED
+        logger.info(f"バッチの展開が完了しました: {batch.id} ({len(batch.job_ids)}件, 重複{batch.duplicates}件)")
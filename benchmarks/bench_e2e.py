@@ -0,0 +1,438 @@
+"""server.pyとnative_host.pyのエンドツーエンドのベンチマーク（ネットワークに接続せずに実行できる）
+
+yt-dlpの代わりにfake_ytdlp.py（記録済みの出力と設定可能な遅延）を使い、
+ストリームはローカルのメディアサーバー（Range対応）から取得する。
+
+使い方:
+    python benchmarks/bench_e2e.py --requests 40 --concurrency 1,8 --output result.json
+    python benchmarks/bench_e2e.py --baseline result.json   # 以前の結果との比較
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_http import percentile
+from media_server import MediaServer, generate_media
+
+TARGETS = ('server', 'native_host')
+STARTUP_TIMEOUT = 30
+REQUEST_TIMEOUT = 120
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def video_id(prefix, index):
+    """YouTubeの動画IDの形式（11文字）の連番"""
+    return f"{prefix}{index:0{11 - len(prefix)}d}"
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# yt-dlpの代用品の実行ファイル
+def write_stub(work_dir):
+    """fake_ytdlp.pyを呼び出す実行ファイルを作成してパスを返す"""
+    path = os.path.join(work_dir, 'yt-dlp')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(BENCH_DIR, "fake_ytdlp.py")}" "$@"\n')
+    os.chmod(path, 0o755)
+    return path
+
+
+class RssMonitor:
+    """プロセスとその子プロセス（yt-dlp・ffmpeg）の合計RSSの最大値を記録する（Linuxの/procを使用）"""
+
+    def __init__(self, pid, interval=0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak_tree_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._page_kb = os.sysconf('SC_PAGE_SIZE') // 1024 if hasattr(os, 'sysconf') else 4
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def peak_process_kb(self):
+        """プロセス自身のRSSの最大値（VmHWM）"""
+        try:
+            with open(f'/proc/{self.pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return None
+
+    def _tree_rss_kb(self):
+        children = {}
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+                children.setdefault(int(fields[1]), []).append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+        total = 0
+        stack = [self.pid]
+        while stack:
+            pid = stack.pop()
+            try:
+                with open(f'/proc/{pid}/statm') as f:
+                    total += int(f.read().split()[1]) * self._page_kb
+            except (OSError, IndexError, ValueError):
+                continue
+            stack.extend(children.get(pid, []))
+        return total
+
+    def _run(self):
+        if not os.path.isdir('/proc'):
+            return
+        while not self._stop.is_set():
+            self.peak_tree_kb = max(self.peak_tree_kb, self._tree_rss_kb())
+            self._stop.wait(self.interval)
+
+
+# 計測対象のプロセス
+def start_target(target, work_dir, env, port):
+    """server.pyまたはnative_host.pyを起動し、/pingに応答するまで待つ"""
+    if target == 'server':
+        cmd = [sys.executable, os.path.join(REPO_DIR, 'server.py'), '--port', str(port), '--threads', '16']
+    else:
+        cmd = [sys.executable, os.path.join(REPO_DIR, 'native_host', 'native_host.py')]
+        env = dict(env, YTDL_NATIVE_HOST_PORT=str(port))
+    log = open(os.path.join(work_dir, f'{target}.out.log'), 'w', encoding='utf-8')
+    process = subprocess.Popen(cmd, cwd=work_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.time() + STARTUP_TIMEOUT
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{target}が起動しませんでした（{log.name}を確認してください）")
+        try:
+            status, _ = request_json('127.0.0.1', port, 'GET', '/ping', None, timeout=1)
+            if status == 200:
+                return process, log
+        except OSError:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{target}が{STARTUP_TIMEOUT}秒以内に応答しませんでした")
+
+
+def stop_target(process, log):
+    process.terminate()
+    try:
+        process.wait(15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+    log.close()
+
+
+def request_json(host, port, method, path, body, timeout=REQUEST_TIMEOUT, connection=None):
+    own = connection is None
+    connection = connection or http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        payload = json.dumps(body).encode('utf-8') if body is not None else None
+        connection.request(method, path, body=payload, headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        data = response.read()
+        try:
+            return response.status, json.loads(data) if data else None
+        except ValueError:
+            return response.status, None
+    finally:
+        if own:
+            connection.close()
+
+
+def is_success(status, data):
+    if status not in (200, 202) or not isinstance(data, dict):
+        return False
+    return data.get('status') != 'error' and data.get('success') is not False
+
+
+# 負荷の生成
+def run_load(port, method, path, make_body, requests, concurrency):
+    """concurrency本の接続でrequests件のリクエストを送り、レイテンシとスループットを返す"""
+    latencies = []
+    errors = []
+    counter = iter(range(requests))
+    counter_lock = threading.Lock()
+
+    def client():
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=REQUEST_TIMEOUT)
+        while True:
+            with counter_lock:
+                index = next(counter, None)
+            if index is None:
+                break
+            started = time.perf_counter()
+            try:
+                status, data = request_json(None, None, method, path, make_body(index), connection=connection)
+                latencies.append(time.perf_counter() - started)
+                if not is_success(status, data):
+                    errors.append(status)
+            except (OSError, http.client.HTTPException) as e:
+                errors.append(type(e).__name__)
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=REQUEST_TIMEOUT)
+        connection.close()
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": len(errors),
+        "elapsed_s": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50) * 1000,
+            "p90": percentile(latencies, 0.90) * 1000,
+            "p99": percentile(latencies, 0.99) * 1000,
+            "max": (latencies[-1] if latencies else 0.0) * 1000,
+            "mean": (sum(latencies) / len(latencies) if latencies else 0.0) * 1000
+        }
+    }
+
+
+def youtube_url(vid):
+    return f"https://www.youtube.com/watch?v={vid}"
+
+
+def scenarios(target, media_url, merge_available, resolution):
+    """(名前, メソッド, パス, リクエスト本文を作る関数(prefix, index), 事前に1回送るか)のリスト"""
+    if target == 'native_host':
+        return [
+            ('resolve_cold', 'POST', '/', lambda p, i: {
+                "url": youtube_url(video_id(p, i)), "resolution": resolution, "format": "mp4"}, False),
+            ('resolve_warm', 'POST', '/', lambda p, i: {
+                "url": youtube_url(video_id(p, 0)), "resolution": resolution, "format": "mp4"}, True)
+        ]
+    items = [
+        ('info_cold', 'POST', '/info', lambda p, i: {"url": youtube_url(video_id(p, i))}, False),
+        ('info_warm', 'POST', '/info', lambda p, i: {"url": youtube_url(video_id(p, 0))}, True),
+        ('formats', 'POST', '/formats', lambda p, i: {"url": youtube_url(video_id(p, i))}, False),
+        ('download', 'POST', '/download', lambda p, i: {
+            "url": youtube_url(video_id(p, i)), "resolution": resolution, "format": "mp4",
+            "wait": True, "force": True}, False)
+    ]
+    if merge_available:
+        # 音声の変換（後処理プール）は実際のメディアがある場合のみ計測する
+        items.append(('download_mp3', 'POST', '/download', lambda p, i: {
+            "url": youtube_url(video_id(p, i)), "resolution": "best", "format": "mp3",
+            "wait": True, "force": True}, False))
+        items.append(('merge', 'POST', '/merge', lambda p, i: {
+            "video_url": f"{media_url}/video.mp4", "audio_url": f"{media_url}/audio.m4a",
+            "title": f"merge-{p}-{i}", "format": "mp4"}, False))
+    return items
+
+
+def bench_target(target, args, work_dir, env, media_url, merge_available):
+    port = free_port()
+    process, log = start_target(target, work_dir, env, port)
+    monitor = RssMonitor(process.pid).start()
+    results = {}
+    try:
+        for concurrency in args.concurrency:
+            for index, (name, method, path, make_body, warmup) in enumerate(
+                    scenarios(target, media_url, merge_available, args.resolution)):
+                # 動画IDが計測ごとに重複しないようにする（キャッシュに当たらないようにする）
+                prefix = f"b{index}c{concurrency}x"
+                body = lambda i, make_body=make_body, prefix=prefix: make_body(prefix, i)
+                if warmup:
+                    request_json('127.0.0.1', port, method, path, body(0))
+                key = f"{name}@c{concurrency}"
+                results[key] = run_load(port, method, path, body, args.requests, concurrency)
+                if not args.json:
+                    print_result(target, key, results[key])
+    finally:
+        monitor.stop()
+        peak_process = monitor.peak_process_kb()
+        stop_target(process, log)
+    return {
+        "endpoints": results,
+        "peak_rss_kb": peak_process,
+        "peak_tree_rss_kb": monitor.peak_tree_kb
+    }
+
+
+def print_result(target, key, result):
+    latency = result['latency_ms']
+    print(
+        f"{target:<12} {key:<18} {result['throughput_rps']:>8.1f} req/s  "
+        f"p50 {latency['p50']:>8.1f}ms  p90 {latency['p90']:>8.1f}ms  p99 {latency['p99']:>8.1f}ms  "
+        f"errors {result['errors']}",
+        flush=True
+    )
+
+
+# 以前の結果との比較
+def compare(current, baseline):
+    """エンドポイントごとのp50・p99・スループットの変化率を表示する"""
+    print(f"\n比較: {baseline['meta'].get('commit') or '不明'} -> {current['meta'].get('commit') or '不明'}")
+    for target, result in current['results'].items():
+        base = baseline['results'].get(target)
+        if not base:
+            continue
+        for key, endpoint in result['endpoints'].items():
+            base_endpoint = base['endpoints'].get(key)
+            if not base_endpoint:
+                continue
+            changes = []
+            for label, now, before in (
+                ('p50', endpoint['latency_ms']['p50'], base_endpoint['latency_ms']['p50']),
+                ('p99', endpoint['latency_ms']['p99'], base_endpoint['latency_ms']['p99']),
+                ('rps', endpoint['throughput_rps'], base_endpoint['throughput_rps'])
+            ):
+                changes.append(f"{label} {(now - before) / before * 100:+6.1f}%" if before else f"{label}    n/a")
+            print(f"{target:<12} {key:<18} " + '  '.join(changes))
+        for label in ('peak_rss_kb', 'peak_tree_rss_kb'):
+            if result.get(label) and base.get(label):
+                print(f"{target:<12} {label:<18} {result[label]} KiB (前回 {base[label]} KiB)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='server.py・native_host.pyのエンドツーエンドのベンチマーク')
+    parser.add_argument('--targets', default=','.join(TARGETS), help='計測対象（カンマ区切り: server, native_host）')
+    parser.add_argument('--requests', type=int, default=20, help='計測ごとのリクエスト数')
+    parser.add_argument('--concurrency', default='1,8', help='同時接続数（カンマ区切りで複数指定可）')
+    parser.add_argument('--resolution', default='720p', help='ダウンロード・解決で指定する解像度')
+    parser.add_argument('--info-delay', type=float, default=0.3, help='yt-dlpの情報取得にかかる秒数')
+    parser.add_argument('--download-delay', type=float, default=0.0, help='yt-dlpのダウンロード開始までの秒数')
+    parser.add_argument('--media-seconds', type=int, default=10, help='合成メディアの長さ（秒）')
+    parser.add_argument('--ffmpeg', default=None, help='ffmpegのパス（既定: PATHから検索）')
+    parser.add_argument('--output', default=None, help='結果のJSONを保存するパス')
+    parser.add_argument('--baseline', default=None, help='比較する以前の結果のJSON')
+    parser.add_argument('--json', action='store_true', help='結果のJSONを標準出力に出力する')
+    parser.add_argument('--keep', action='store_true', help='作業ディレクトリを削除しない')
+    args = parser.parse_args(argv)
+    args.concurrency = [int(c) for c in args.concurrency.split(',') if c.strip()]
+    targets = [t.strip() for t in args.targets.split(',') if t.strip()]
+    for target in targets:
+        if target not in TARGETS:
+            parser.error(f"未対応の計測対象です: {target}")
+
+    work_dir = tempfile.mkdtemp(prefix='ytdl-bench-')
+    media_server = None
+    try:
+        ffmpeg = args.ffmpeg or shutil.which('ffmpeg')
+        merge_available = generate_media(os.path.join(work_dir, 'media'), args.media_seconds, ffmpeg=ffmpeg)
+        if not merge_available:
+            print("ffmpegが見つからないため/mergeは計測しません", file=sys.stderr)
+        media_server = MediaServer(os.path.join(work_dir, 'media')).start()
+
+        home = os.path.join(work_dir, 'home')
+        os.makedirs(home)
+        config_file = os.path.join(work_dir, 'config.json')
+        with open(config_file, 'w', encoding='utf-8') as f:
+            json.dump({
+                "download_path": home,
+                "auto_update": False,
+                "use_aria2c": False,
+                "extractor_engine": "subprocess",  # ライブラリ版のyt-dlpではなく代用品の実行ファイルを使う
+                "prefetch_enabled": False,
+                "metadata_cache_disk": False,
+                "media_library": False,
+                "job_journal": False,
+                "postprocess_pool": merge_available  # 乱数のデータはffmpegで処理できない
+            }, f)
+
+        path = os.environ.get('PATH', '')
+        if ffmpeg:
+            path = os.path.dirname(os.path.abspath(ffmpeg)) + os.pathsep + path
+        env = dict(
+            os.environ,
+            PATH=path,
+            HOME=home,
+            YTDL_YTDLP_PATH=write_stub(work_dir),
+            YTDL_CONFIG_FILE=config_file,
+            YTDL_CACHE_DIR=os.path.join(work_dir, 'cache'),
+            BENCH_MEDIA_URL=media_server.url,
+            BENCH_INFO_DELAY=str(args.info_delay),
+            BENCH_DOWNLOAD_DELAY=str(args.download_delay),
+            PYTHONIOENCODING='utf-8'
+        )
+
+        report = {
+            "meta": {
+                "commit": git_commit(),
+                "time": datetime.now().isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpus": os.cpu_count(),
+                "merge_measured": merge_available,
+                "params": {
+                    "requests": args.requests,
+                    "concurrency": args.concurrency,
+                    "resolution": args.resolution,
+                    "info_delay": args.info_delay,
+                    "download_delay": args.download_delay,
+                    "media_seconds": args.media_seconds
+                }
+            },
+            "results": {}
+        }
+        for target in targets:
+            report["results"][target] = bench_target(target, args, work_dir, env, media_server.url, merge_available)
+    finally:
+        if media_server is not None:
+            media_server.stop()
+        if args.keep:
+            print(f"作業ディレクトリ: {work_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        for target, result in report["results"].items():
+            print(f"{target:<12} peak RSS {result['peak_rss_kb']} KiB (子プロセスを含む {result['peak_tree_rss_kb']} KiB)")
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
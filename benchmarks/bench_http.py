@@ -0,0 +1,195 @@
+"""軽量エンドポイント（/ping, /status, /config）の同時負荷ベンチマーク
+
+使い方:
+    python server.py --threads 16 &
+    python benchmarks/bench_http.py --concurrency 32 --duration 10
+
+    # 待機中のkeep-alive接続とジョブのイベントストリーム（SSE）を開いたまま計測する
+    python benchmarks/bench_http.py --idle-connections 32 --event-streams 8 --event-job <job_id>
+"""
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+import http.client
+from urllib.parse import urlparse
+
+
+def percentile(sorted_values, ratio):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(ratio * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_client(host, port, path, deadline, keepalive, latencies, errors):
+    connection = None
+    while time.perf_counter() < deadline:
+        try:
+            if connection is None:
+                connection = http.client.HTTPConnection(host, port, timeout=10)
+            started = time.perf_counter()
+            connection.request('GET', path, headers={} if keepalive else {'Connection': 'close'})
+            response = connection.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - started)
+            if response.status != 200:
+                errors.append(response.status)
+            if not keepalive or response.will_close:
+                connection.close()
+                connection = None
+        except Exception as e:
+            errors.append(type(e).__name__)
+            if connection is not None:
+                connection.close()
+            connection = None
+    if connection is not None:
+        connection.close()
+
+
+class HeldConnections:
+    """計測中に開いたままにする接続（待機中のkeep-alive接続・イベントストリーム）"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.statuses = {}  # イベントストリームの応答ステータス -> 件数
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._connections = []  # 待機中のkeep-alive接続
+        self._sockets = []  # 読み取り中のイベントストリーム
+        self._threads = []
+
+    def open_idle(self, count):
+        """1回リクエストした後は何も送らないkeep-alive接続を開く"""
+        for _ in range(count):
+            connection = http.client.HTTPConnection(self.host, self.port, timeout=10)
+            connection.request('GET', '/ping')
+            connection.getresponse().read()
+            self._connections.append(connection)
+
+    def open_event_streams(self, count, job_id):
+        for _ in range(count):
+            thread = threading.Thread(target=self._read_events, args=(job_id,), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _read_events(self, job_id):
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=10)
+        try:
+            # 切断まで続く応答ではgetresponse()後にconnection.sockが外されるため、ソケットを自分で持つ
+            connection.connect()
+            sock = connection.sock
+            connection.request('GET', f'/jobs/{job_id}/events', headers={'Accept': 'text/event-stream'})
+            response = connection.getresponse()
+            with self._lock:
+                self.statuses[response.status] = self.statuses.get(response.status, 0) + 1
+                if response.status == 200:
+                    # 読み取りを待っている間はclose()でソケットを閉じて終わらせる
+                    sock.settimeout(None)
+                    self._sockets.append(sock)
+            if response.status != 200:
+                response.read()
+                return
+            while not self._stop.is_set() and response.readline():
+                pass
+        except Exception as e:
+            if not self._stop.is_set():
+                with self._lock:
+                    self.statuses[type(e).__name__] = self.statuses.get(type(e).__name__, 0) + 1
+        finally:
+            connection.close()
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            sockets = list(self._sockets)
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        for thread in self._threads:
+            thread.join()
+        for connection in self._connections:
+            connection.close()
+
+
+def bench_endpoint(base_url, path, concurrency, duration, keepalive):
+    parsed = urlparse(base_url)
+    latencies = []
+    errors = []
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(target=run_client, args=(parsed.hostname, parsed.port or 80, path, deadline,
+                                                 keepalive, latencies, errors))
+        for _ in range(concurrency)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "endpoint": path,
+        "concurrency": concurrency,
+        "keepalive": keepalive,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_ms": {
+            "p50": percentile(latencies, 0.50) * 1000,
+            "p90": percentile(latencies, 0.90) * 1000,
+            "p99": percentile(latencies, 0.99) * 1000,
+            "max": (latencies[-1] if latencies else 0.0) * 1000
+        }
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='サーバーの軽量エンドポイントの負荷ベンチマーク')
+    parser.add_argument('--url', default='http://127.0.0.1:8745', help='サーバーのURL')
+    parser.add_argument('--endpoints', default='/ping,/status,/config', help='計測するパス（カンマ区切り）')
+    parser.add_argument('--concurrency', type=int, default=16, help='同時接続数')
+    parser.add_argument('--duration', type=float, default=5.0, help='エンドポイントごとの計測秒数')
+    parser.add_argument('--no-keepalive', action='store_true', help='リクエストごとに接続し直す')
+    parser.add_argument('--json', action='store_true', help='結果をJSONで出力する')
+    parser.add_argument('--idle-connections', type=int, default=0, help='計測中に開いたままにする待機中のkeep-alive接続の数')
+    parser.add_argument('--event-streams', type=int, default=0, help='計測中に開いたままにするイベントストリームの数')
+    parser.add_argument('--event-job', help='イベントストリームを購読するジョブID（/downloadで投入したもの）')
+    args = parser.parse_args(argv)
+    if args.event_streams and not args.event_job:
+        parser.error('--event-streamsには--event-jobが必要です')
+
+    parsed = urlparse(args.url)
+    held = HeldConnections(parsed.hostname, parsed.port or 80)
+    held.open_idle(args.idle_connections)
+    held.open_event_streams(args.event_streams, args.event_job)
+    results = []
+    try:
+        for path in [p.strip() for p in args.endpoints.split(',') if p.strip()]:
+            result = bench_endpoint(args.url, path, args.concurrency, args.duration, not args.no_keepalive)
+            results.append(result)
+            if not args.json:
+                latency = result["latency_ms"]
+                print(
+                    f"{path:<10} {result['rps']:>9.1f} req/s  "
+                    f"p50 {latency['p50']:.2f}ms  p90 {latency['p90']:.2f}ms  p99 {latency['p99']:.2f}ms  "
+                    f"errors {result['errors']}"
+                )
+    finally:
+        held.close()
+    if args.event_streams and not args.json:
+        print(f"イベントストリームの応答: {held.statuses}")
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
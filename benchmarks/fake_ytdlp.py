@@ -0,0 +1,261 @@
+"""ベンチマーク用のyt-dlpの代用品（記録済みの出力を返し、ダウンロードはローカルのメディアサーバーから行う）
+
+環境変数:
+    BENCH_MEDIA_URL       メディアサーバーのURL（例: http://127.0.0.1:8900）
+    BENCH_INFO_DELAY      -J / -O / -F / --get-url / --flat-playlist の応答までの秒数（既定: 0.3）
+    BENCH_DOWNLOAD_DELAY  ダウンロード開始までの秒数（既定: 0）
+"""
+import os
+import re
+import sys
+import json
+import time
+import urllib.request
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+VIDEO_ID_RE = re.compile(r'(?:v=|youtu\.be/|shorts/)([A-Za-z0-9_-]{11})')
+URL_ARG_RE = re.compile(r'^https?://')
+FIELDS_TEMPLATE_RE = re.compile(r'^%\(\.\{([^}]*)\}\)j$')
+EXPIRY_SECONDS = 6 * 3600
+
+# 値を取るオプション（URLの判定で読み飛ばす）
+OPTIONS_WITH_VALUE = {
+    '-f', '-o', '-O', '-r', '--limit-rate', '--progress-template', '--print', '--merge-output-format',
+    '--ffmpeg-location', '--downloader', '--downloader-args', '--audio-format', '--audio-quality',
+    '--load-info-json'
+}
+
+
+def option(args, *names):
+    for name in names:
+        if name in args:
+            index = args.index(name)
+            if index + 1 < len(args):
+                return args[index + 1]
+    return None
+
+
+def target_url(args):
+    skip = False
+    for arg in args:
+        if skip:
+            skip = False
+            continue
+        if arg in OPTIONS_WITH_VALUE:
+            skip = True
+            continue
+        if URL_ARG_RE.match(arg):
+            return arg
+    return None
+
+
+def print_fields(args):
+    """-O '%(.{id,title,...})j'で指定された項目（指定がなければNone）"""
+    match = FIELDS_TEMPLATE_RE.match(option(args, '-O', '--print') or '')
+    return [field for field in match.group(1).split(',') if field] if match else None
+
+
+def dump(info, fields):
+    if fields is not None:
+        info = {key: info[key] for key in fields if key in info}
+    print(json.dumps(info), flush=True)
+
+
+def load_text(name, video_id):
+    with open(os.path.join(FIXTURE_DIR, name), 'r', encoding='utf-8') as f:
+        text = f.read()
+    media_url = os.environ.get('BENCH_MEDIA_URL', 'http://127.0.0.1:8900').rstrip('/')
+    return (text.replace('@MEDIA_URL@', media_url)
+                .replace('@VIDEO_ID@', video_id)
+                .replace('@EXPIRE@', str(int(time.time()) + EXPIRY_SECONDS)))
+
+
+def load_info(args):
+    path = option(args, '--load-info-json')
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    url = target_url(args) or ''
+    match = VIDEO_ID_RE.search(url)
+    return json.loads(load_text('video_info.json', match.group(1) if match else 'benchbenchb'))
+
+
+# フォーマット指定（yt-dlpの書式のうちサーバーとネイティブホストが使う範囲）の解釈
+def _matches(fmt, filters):
+    for key, op, value in filters:
+        actual = fmt.get(key)
+        if op == '=' and str(actual) != value:
+            return False
+        if op == '<=' and (actual is None or float(actual) > float(value)):
+            return False
+    return True
+
+
+def _select_one(formats, spec):
+    match = re.match(r'^([\w-]+)((?:\[[^\]]+\])*)$', spec)
+    if not match:
+        return None
+    name, filter_text = match.groups()
+    filters = re.findall(r'\[(\w+)(<=|=)([^\]]+)\]', filter_text)
+    if name not in ('best', 'bestvideo', 'bestaudio'):
+        return next((f for f in formats if f['format_id'] == name and _matches(f, filters)), None)
+    candidates = []
+    for fmt in formats:
+        has_video = fmt.get('vcodec', 'none') != 'none'
+        has_audio = fmt.get('acodec', 'none') != 'none'
+        if name == 'bestvideo' and not (has_video and not has_audio) or \
+           name == 'bestaudio' and not (has_audio and not has_video) or \
+           name == 'best' and not (has_video and has_audio):
+            continue
+        if _matches(fmt, filters):
+            candidates.append(fmt)
+    return max(candidates, key=lambda f: (f.get('height') or 0, f.get('tbr') or 0), default=None)
+
+
+def select_formats(formats, spec):
+    for alternative in (spec or 'bestvideo+bestaudio/best').split('/'):
+        selected = [_select_one(formats, part) for part in alternative.split('+')]
+        if selected and all(selected):
+            return selected
+    return []
+
+
+def postprocess_enabled(args):
+    """--progress-templateで後処理の進捗行が要求されているか"""
+    return any(arg.startswith('postprocess:') for arg in args)
+
+
+def run_postprocessor(args, name):
+    if postprocess_enabled(args):
+        print(f"__postprocess__ started {name}", flush=True)
+    time.sleep(0.05)
+    if postprocess_enabled(args):
+        print(f"__postprocess__ finished {name}", flush=True)
+
+
+def sleep_env(name, default):
+    delay = float(os.environ.get(name, default))
+    if delay > 0:
+        time.sleep(delay)
+
+
+def output_templates(args):
+    """-oの指定（種類: テンプレート。'thumbnail:...'のような種類の指定がなければdefault）"""
+    templates = {}
+    for index, arg in enumerate(args[:-1]):
+        if arg == '-o':
+            kind, sep, template = args[index + 1].partition(':')
+            if not sep or not re.match(r'^[a-z_]+$', kind):
+                kind, template = 'default', args[index + 1]
+            templates[kind] = template
+    return templates
+
+
+def expand_template(template, fields):
+    """出力テンプレートの%(name)sを展開する（サーバーが使う範囲のみ）"""
+    expanded = re.sub(r'%\((\w+)\)s', lambda m: str(fields.get(m.group(1), 'NA')), template)
+    return expanded.replace('%%', '%')
+
+
+def write_thumbnail(args, info, output):
+    template = output_templates(args).get('thumbnail')
+    base = os.path.splitext(expand_template(template, dict(info, ext='jpg')) if template else output)[0]
+    path = base + '.jpg'
+    if os.path.exists(path):
+        return
+    with urllib.request.urlopen(info['thumbnail']) as response, open(path, 'wb') as out:
+        out.write(response.read())
+
+
+def download(args, info, selected):
+    """選択したフォーマットをメディアサーバーから取得して出力パスに保存する"""
+    sleep_env('BENCH_DOWNLOAD_DELAY', 0)
+    template = option(args, '--progress-template')
+    output_template = output_templates(args).get('default')
+    output = expand_template(output_template, dict(info, **selected[0])) if output_template \
+        else f"{info['id']}.{selected[0]['ext']}"
+    merge_ext = option(args, '--merge-output-format')
+    if merge_ext and len(selected) > 1:
+        output = os.path.splitext(output)[0] + '.' + merge_ext
+    with open(output, 'wb') as out:
+        for fmt in selected:
+            downloaded = 0
+            with urllib.request.urlopen(fmt['url']) as response:
+                total = int(response.headers.get('Content-Length') or 0)
+                while True:
+                    chunk = response.read(256 * 1024)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+                    downloaded += len(chunk)
+                    if template:
+                        print(f"__progress__ downloading {downloaded} {total} NA NA NA {fmt['format_id']}", flush=True)
+            if template:
+                print(f"__progress__ finished {downloaded} {total} NA NA NA {fmt['format_id']}", flush=True)
+    if len(selected) > 1:
+        run_postprocessor(args, 'FFmpegMerger')
+    if '--write-thumbnail' in args or '--embed-thumbnail' in args:
+        write_thumbnail(args, info, output)
+    if '--embed-thumbnail' in args:
+        run_postprocessor(args, 'EmbedThumbnail')
+    if '--print' in args:
+        print(f"__filepath__ {os.path.abspath(output)}", flush=True)
+
+
+def main(args):
+    if '--version' in args:
+        print('2024.12.23')
+        return 0
+    if '-U' in args:
+        print('yt-dlp is up to date (2024.12.23)')
+        return 0
+
+    if '--flat-playlist' in args:
+        sleep_env('BENCH_INFO_DELAY', 0.3)
+        for index in range(int(os.environ.get('BENCH_PLAYLIST_SIZE', 5))):
+            video_id = f"bench{index:06d}"
+            dump({"_type": "url", "ie_key": "Youtube", "id": video_id,
+                  "url": f"https://www.youtube.com/watch?v={video_id}", "title": video_id}, print_fields(args))
+        return 0
+
+    info = load_info(args)
+    # 'a,b'の指定はフォーマットごとに個別のファイルとして保存する
+    groups = [select_formats(info['formats'], spec) for spec in (option(args, '-f') or '').split(',')]
+    selected = groups[0]
+
+    if '-F' in args or '--list-formats' in args:
+        sleep_env('BENCH_INFO_DELAY', 0.3)
+        sys.stdout.write(load_text('formats.txt', info['id']))
+        return 0
+    if '--get-url' in args or '-g' in args:
+        sleep_env('BENCH_INFO_DELAY', 0.3)
+        if not selected:
+            sys.stderr.write('ERROR: Requested format is not available\n')
+            return 1
+        for fmt in selected:
+            print(fmt['url'])
+        return 0
+    fields = print_fields(args)
+    if '-J' in args or '-j' in args or '--dump-json' in args or fields is not None:
+        sleep_env('BENCH_INFO_DELAY', 0.3)
+        if '-f' in args:
+            if not selected:
+                sys.stderr.write('ERROR: Requested format is not available\n')
+                return 1
+            if len(selected) > 1:
+                info['requested_formats'] = selected
+            else:
+                info.update(selected[0])
+        dump(info, fields)
+        return 0
+
+    if not all(groups):
+        sys.stderr.write('ERROR: Requested format is not available\n')
+        return 1
+    for selected in groups:
+        download(args, info, selected)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
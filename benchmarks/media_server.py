@@ -0,0 +1,167 @@
+"""ベンチマーク用のローカルメディアサーバー（合成した映像・音声ファイルをRange対応で配信する）"""
+import os
+import re
+import shutil
+import logging
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+logger = logging.getLogger(__name__)
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+COPY_CHUNK_SIZE = 256 * 1024
+
+CONTENT_TYPES = {
+    '.mp4': 'video/mp4',
+    '.m4a': 'audio/mp4',
+    '.webm': 'video/webm',
+    '.jpg': 'image/jpeg'
+}
+
+
+# 合成メディアの生成
+def generate_media(media_dir, seconds=10, video_bitrate='4M', ffmpeg=None):
+    """ffmpegのテストパターンから映像（H.264）・音声（AAC）・サムネイル（JPEG）を生成する
+
+    ffmpegがない場合は同じ大きさの乱数ファイルを作成する（/mergeの計測はできない）。
+    戻り値は実際のメディアを生成できたかどうか。
+    """
+    os.makedirs(media_dir, exist_ok=True)
+    ffmpeg = ffmpeg or shutil.which('ffmpeg')
+    targets = {
+        'video.mp4': ['-f', 'lavfi', '-i', f'testsrc2=size=1280x720:rate=30:duration={seconds}',
+                      '-c:v', 'libx264', '-preset', 'ultrafast', '-b:v', video_bitrate, '-pix_fmt', 'yuv420p'],
+        'audio.m4a': ['-f', 'lavfi', '-i', f'sine=frequency=440:duration={seconds}',
+                      '-c:a', 'aac', '-b:a', '128k'],
+        'thumbnail.jpg': ['-f', 'lavfi', '-i', 'testsrc2=size=480x360', '-frames:v', '1']
+    }
+    generated = ffmpeg is not None
+    for name, args in targets.items():
+        path = os.path.join(media_dir, name)
+        if os.path.exists(path):
+            continue
+        if generated:
+            result = subprocess.run([ffmpeg, '-v', 'error', '-y'] + args + [path], capture_output=True, text=True)
+            if result.returncode == 0:
+                continue
+            logger.warning(f"ffmpegでの生成に失敗しました: {name}: {result.stderr.strip()}")
+            generated = False
+        # ffmpegがない場合の代わりのデータ（おおよそ同じ転送量になる大きさ）
+        if name.startswith('thumbnail'):
+            size = 32 * 1024
+        else:
+            size = seconds * (4 * 1024 * 1024 // 8 if name.startswith('video') else 16 * 1024)
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+
+    # WebM形式は中身を問わないため既存ファイルを流用する
+    for name, source in (('video.webm', 'video.mp4'), ('audio.webm', 'audio.m4a')):
+        path = os.path.join(media_dir, name)
+        if not os.path.exists(path):
+            shutil.copyfile(os.path.join(media_dir, source), path)
+    return generated
+
+
+class MediaRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    def _serve(self, send_body):
+        name = os.path.basename(self.path.split('?', 1)[0])
+        path = os.path.join(self.server.media_dir, name)
+        if not name or not os.path.isfile(path):
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        status = 200
+        range_header = self.headers.get('Range')
+        if range_header:
+            match = RANGE_RE.match(range_header.strip())
+            if not match or match.group(1) == '' and match.group(2) == '':
+                self.send_error(416)
+                return
+            if match.group(1) == '':
+                start = max(0, size - int(match.group(2)))
+            else:
+                start = int(match.group(1))
+                if match.group(2):
+                    end = min(end, int(match.group(2)))
+            if start > end:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Type', CONTENT_TYPES.get(os.path.splitext(name)[1], 'application/octet-stream'))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        if status == 206:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.end_headers()
+        if not send_body:
+            return
+        with open(path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            try:
+                while remaining > 0:
+                    chunk = f.read(min(COPY_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MediaServer:
+    """バックグラウンドのスレッドで配信するメディアサーバー"""
+
+    def __init__(self, media_dir, host='127.0.0.1', port=0):
+        self.httpd = ThreadingHTTPServer((host, port), MediaRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.media_dir = media_dir
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name='media-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='ベンチマーク用のメディアサーバー')
+    parser.add_argument('media_dir', help='配信するディレクトリ（合成メディアがなければ生成する）')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--seconds', type=int, default=10, help='生成するメディアの長さ（秒）')
+    args = parser.parse_args()
+    generate_media(args.media_dir, args.seconds)
+    server = MediaServer(args.media_dir, port=args.port)
+    print(f"配信中: {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
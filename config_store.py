@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class ConfigStore:
+    """設定ファイルをメモリ上に保持し、変更検出とアトミックな書き込みを行う"""
+
+    def __init__(self, path, defaults=None, create_if_missing=False, check_interval=1.0):
+        self.path = path
+        self.defaults = dict(defaults or {})
+        self.create_if_missing = create_if_missing
+        self.check_interval = check_interval  # ファイルの更新確認の最小間隔（秒）
+        self._config = None
+        self._signature = None
+        self._checked_at = 0
+        self._lock = threading.RLock()
+
+    def get(self):
+        """現在の設定のコピーを返す（ファイルが外部で更新されていれば読み直す）"""
+        with self._lock:
+            now = time.time()
+            if self._config is None or now - self._checked_at >= self.check_interval:
+                self._checked_at = now
+                signature = self._file_signature()
+                if self._config is None or signature != self._signature:
+                    self._load(signature)
+            return dict(self._config)
+
+    def save(self, config):
+        """設定全体を書き込む"""
+        with self._lock:
+            return self._write(dict(config))
+
+    def update(self, changes):
+        """現在の設定に変更を反映して書き込み、更新後の設定を返す（失敗時はNone）"""
+        with self._lock:
+            config = self.get()
+            config.update(changes)
+            if not self._write(config):
+                return None
+            return dict(config)
+
+    def reload(self):
+        """次回のget()で必ずファイルを読み直す"""
+        with self._lock:
+            self._config = None
+
+    def _file_signature(self):
+        try:
+            stat = os.stat(self.path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def _load(self, signature):
+        config = dict(self.defaults)
+        if signature is None:
+            # 設定ファイルがない場合はデフォルト設定を保存する
+            if self.create_if_missing and self._write(config):
+                return
+        else:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    config.update(json.load(f))
+            except Exception as e:
+                logger.error(f"設定ファイルの読み込み中にエラーが発生しました: {e}")
+                if self._config is not None:
+                    # 読み込めない場合は直前の設定を使い続ける
+                    return
+        self._config = config
+        self._signature = signature
+
+    def _write(self, config):
+        directory = os.path.dirname(self.path) or '.'
+        temp_path = None
+        try:
+            os.makedirs(directory, exist_ok=True)
+            # 同じディレクトリの一時ファイルに書き込んでから置き換える
+            fd, temp_path = tempfile.mkstemp(prefix='.config-', suffix='.tmp', dir=directory)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(config, f, ensure_ascii=False, indent=4)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+            temp_path = None
+            self._config = config
+            self._signature = self._file_signature()
+            self._checked_at = time.time()
+            return True
+        except Exception as e:
+            logger.error(f"設定ファイルの保存中にエラーが発生しました: {e}")
+            return False
+        finally:
+            if temp_path and os.path.exists(temp_path):
+                os.remove(temp_path)
@@ -161,14 +161,38 @@ function initButtonObserver() {
   });
 }
 
+// 視聴中の動画の情報をサーバーに先読みさせる
+let prefetchedUrl = null;
+
+function requestPrefetch() {
+  prefetchedUrl = window.location.href;
+  chrome.runtime.sendMessage({ action: 'prefetch', url: prefetchedUrl }, () => {
+    // サーバーが起動していない場合などは何もしない
+    void chrome.runtime.lastError;
+  });
+}
+
+// 別のページに移動する場合は先読みを取り消す
+function cancelPrefetch() {
+  if (!prefetchedUrl) {
+    return;
+  }
+  chrome.runtime.sendMessage({ action: 'cancel_prefetch', url: prefetchedUrl }, () => {
+    void chrome.runtime.lastError;
+  });
+  prefetchedUrl = null;
+}
+
 // 初期化
 function init() {
   if (window.location.pathname === '/watch') {
     addDownloadButton();
     initButtonObserver();
+    requestPrefetch();
   }
 }
 
 // ページ読み込み時とURLの変更時に実行
 init();
+window.addEventListener('yt-navigate-start', cancelPrefetch);
 window.addEventListener('yt-navigate-finish', init);
@@ -0,0 +1,184 @@
+import time
+import threading
+import subprocess
+from collections import deque
+
+# yt-dlpの進捗出力テンプレート（--newlineと組み合わせて1行ずつ読み取る）
+PROGRESS_PREFIX = '__progress__'
+PROGRESS_TEMPLATE = (
+    'download:' + PROGRESS_PREFIX +
+    ' %(progress.status)s'
+    ' %(progress.downloaded_bytes)s'
+    ' %(progress.total_bytes)s'
+    ' %(progress.total_bytes_estimate)s'
+    ' %(progress.speed)s'
+    ' %(progress.eta)s'
+    ' %(info.format_id)s'
+)
+
+# 後処理（結合・サムネイル埋め込みなど）の開始・終了（処理ごとの所要時間の計測に使う）
+POSTPROCESS_PREFIX = '__postprocess__'
+POSTPROCESS_TEMPLATE = 'postprocess:' + POSTPROCESS_PREFIX + ' %(progress.status)s %(progress.postprocessor)s'
+
+# 後処理・移動が済んだ最終的な保存先（--printで出力させる）
+FILEPATH_PREFIX = '__filepath__'
+FILEPATH_TEMPLATE = 'after_move:' + FILEPATH_PREFIX + ' %(filepath)s'
+
+# 進捗行以外に保持する出力の行数
+OUTPUT_TAIL_LINES = 200
+
+
+def _to_number(value):
+    if value in (None, '', 'NA', 'None'):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+# 進捗行の解析
+def parse_progress_line(line):
+    """PROGRESS_TEMPLATEで出力された1行を辞書に変換する（進捗行でなければNone）"""
+    line = line.strip()
+    if not line.startswith(PROGRESS_PREFIX):
+        return None
+    parts = line.split()
+    if len(parts) < 8:
+        return None
+    total = _to_number(parts[3]) or _to_number(parts[4])
+    return {
+        "status": parts[1],
+        "downloaded_bytes": _to_number(parts[2]) or 0,
+        "total_bytes": total,
+        "speed": _to_number(parts[5]),
+        "eta": _to_number(parts[6]),
+        "format_id": parts[7]
+    }
+
+
+# 後処理の進捗行の解析
+def parse_postprocess_line(line):
+    """POSTPROCESS_TEMPLATEで出力された1行を(状態, 後処理名)に変換する（該当しなければNone）"""
+    parts = line.strip().split()
+    if len(parts) < 3 or parts[0] != POSTPROCESS_PREFIX:
+        return None
+    return parts[1], parts[2]
+
+
+class PostprocessTimer:
+    """後処理の開始行から終了行までの時間を測る"""
+
+    def __init__(self, on_finished):
+        self.on_finished = on_finished
+        self._started = {}
+
+    def update(self, status, name):
+        now = time.perf_counter()
+        if status == 'started':
+            self._started[name] = now
+        elif status == 'finished' and name in self._started:
+            self.on_finished(name, now - self._started.pop(name))
+
+
+# 保存先の取得
+def parse_output_paths(output):
+    """FILEPATH_TEMPLATEで出力された保存先を出力順に返す（フォーマットを個別に保存した場合は複数）"""
+    return [
+        line[len(FILEPATH_PREFIX) + 1:] for line in output.splitlines()
+        if line.startswith(FILEPATH_PREFIX + ' ') and line[len(FILEPATH_PREFIX) + 1:]
+    ]
+
+
+def parse_output_path(output):
+    """FILEPATH_TEMPLATEで出力された最終的な保存先を返す（出力されていなければNone）"""
+    paths = parse_output_paths(output)
+    return paths[-1] if paths else None
+
+
+class ProgressTracker:
+    """複数ストリーム（映像・音声）の進捗を合算してジョブ全体の進捗にする"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.completed_bytes = 0  # 完了したストリームの合計
+        self.completed_total = 0
+        self.current_format = None
+        self.current = None
+
+    def update(self, progress):
+        """進捗を反映し、ジョブ全体の進捗を返す"""
+        if self.current_format is not None and progress['format_id'] != self.current_format:
+            # 前のストリームが完了せずに切り替わった場合も合算する
+            self._complete_current()
+        self.current_format = progress['format_id']
+        self.current = progress
+        if progress['status'] == 'finished':
+            self._complete_current()
+        return self.snapshot()
+
+    def _complete_current(self):
+        if self.current is not None:
+            self.completed_bytes += self.current['downloaded_bytes']
+            self.completed_total += self.current['total_bytes'] or self.current['downloaded_bytes']
+        self.current = None
+        self.current_format = None
+
+    def snapshot(self):
+        current = self.current or {}
+        downloaded = self.completed_bytes + current.get('downloaded_bytes', 0)
+        total = self.completed_total + (current.get('total_bytes') or 0) if current else self.completed_total
+        elapsed = max(time.time() - self.started_at, 1e-6)
+        return {
+            "downloaded_bytes": downloaded,
+            "total_bytes": total or None,
+            "percent": round(downloaded * 100.0 / total, 1) if total else None,
+            "speed": current.get('speed'),
+            "eta": current.get('eta'),
+            "average_speed": downloaded / elapsed,
+            "elapsed": elapsed
+        }
+
+
+# 進捗を読み取りながらyt-dlpを実行
+def run_with_progress(cmd, on_progress, on_start=None, on_postprocess=None):
+    """yt-dlpを実行し、進捗行を解析してon_progressに渡す（on_startには起動したプロセスを渡す）
+
+    on_postprocessを指定した場合は後処理が終わるたびに(後処理名, 所要秒数)を渡す。
+
+    戻り値は(リターンコード, 進捗以外の標準出力, 標準エラー出力, 最終的な進捗)。
+    """
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        encoding='utf-8',
+        errors='replace',
+        bufsize=1
+    )
+    if on_start is not None:
+        on_start(process)
+
+    # 標準エラー出力は別スレッドで読み取ってパイプの詰まりを防ぐ
+    stderr_lines = deque(maxlen=OUTPUT_TAIL_LINES)
+    stderr_thread = threading.Thread(target=lambda: stderr_lines.extend(process.stderr), daemon=True)
+    stderr_thread.start()
+
+    stdout_lines = deque(maxlen=OUTPUT_TAIL_LINES)
+    tracker = ProgressTracker()
+    postprocess = PostprocessTimer(on_postprocess) if on_postprocess is not None else None
+    for line in process.stdout:
+        progress = parse_progress_line(line)
+        if progress is None:
+            step = parse_postprocess_line(line)
+            if step is None:
+                stdout_lines.append(line)
+            elif postprocess is not None:
+                postprocess.update(*step)
+            continue
+        on_progress(tracker.update(progress))
+
+    returncode = process.wait()
+    stderr_thread.join()
+    return returncode, ''.join(stdout_lines), ''.join(stderr_lines), tracker.snapshot()
@@ -0,0 +1,93 @@
+import json
+import threading
+import subprocess
+from collections import deque
+
+# 標準エラー出力を保持する行数（エラーメッセージには末尾だけを使う）
+STDERR_TAIL_LINES = 50
+
+# server.pyが保持する動画情報の項目（/info・/formats・先読み・--load-info-jsonでのダウンロードに使う）
+INFO_FIELDS = (
+    'id', 'title', 'fulltitle', 'description', 'thumbnail', 'thumbnails', 'duration', 'chapters',
+    'upload_date', 'release_date', 'timestamp', 'uploader', 'uploader_id', 'uploader_url',
+    'channel', 'channel_id', 'channel_url', 'view_count', 'like_count', 'age_limit', 'tags', 'categories',
+    'artist', 'album', 'track', 'live_status', 'is_live', 'was_live',
+    'webpage_url', 'original_url', 'webpage_url_basename', 'webpage_url_domain', 'extractor', 'extractor_key',
+    'formats'
+)
+
+# ネイティブホストがストリームURLの解決に使う項目（-fで選択した結果）
+STREAM_FIELDS = ('id', 'title', 'ext', 'format_id', 'url', 'requested_formats')
+
+
+# 抽出結果のエラー（終了コードと標準エラー出力の末尾を保持する）
+class ExtractorOutputError(Exception):
+    def __init__(self, message, returncode=None):
+        super().__init__(message)
+        self.returncode = returncode
+
+
+# 出力する項目の指定
+def info_template(fields):
+    """yt-dlpの--printで指定した項目だけをJSONの1行として出力させるテンプレート"""
+    return '%(.{' + ','.join(fields) + '})j'
+
+
+def is_storyboard(fmt):
+    """ストーリーボード（サムネイル画像の連番）のフォーマットか（フラグメントの一覧が大きく、ダウンロードには使わない）"""
+    return fmt.get('ext') == 'mhtml' or fmt.get('format_note') == 'storyboard'
+
+
+def project_info(info, fields=INFO_FIELDS):
+    """動画情報から指定した項目だけを残す（ライブラリで取得した結果にも同じ絞り込みを行う）"""
+    projected = {key: info[key] for key in fields if key in info}
+    if projected.get('formats'):
+        projected['formats'] = [fmt for fmt in projected['formats'] if not is_storyboard(fmt)]
+    return projected
+
+
+# 外部プロセスの出力の読み取り
+def iter_json_lines(cmd, stderr_lines=STDERR_TAIL_LINES, on_start=None):
+    """外部プロセスの標準出力を1行ずつJSONとして読み取る（出力全体を1つの文字列として保持しない）
+
+    JSONでない行は読み飛ばす。プロセスが失敗した場合は、すべての行を返した後に
+    標準エラー出力の末尾をメッセージとしたExtractorOutputErrorを送出する。
+    """
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if on_start is not None:
+        on_start(process)
+    stderr_tail = deque(maxlen=stderr_lines)
+    stderr_thread = threading.Thread(
+        target=lambda: stderr_tail.extend(line.decode('utf-8', errors='replace') for line in process.stderr),
+        daemon=True
+    )
+    stderr_thread.start()
+    try:
+        for line in process.stdout:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+    finally:
+        # 途中で読み取りをやめた場合はプロセスを終了させる
+        if process.poll() is None:
+            process.kill()
+        returncode = process.wait()
+        stderr_thread.join()
+    if returncode != 0:
+        message = ''.join(stderr_tail).strip() or f"yt-dlpが終了コード{returncode}で終了しました"
+        raise ExtractorOutputError(message, returncode)
+
+
+def read_json(cmd, fields=None, stderr_lines=STDERR_TAIL_LINES):
+    """1件分のJSONを出力するコマンドを実行し、fieldsを指定した場合はその項目だけを残して返す"""
+    result = None
+    for info in iter_json_lines(cmd, stderr_lines):
+        if result is None:
+            result = project_info(info, fields) if fields else info
+    if result is None:
+        raise ExtractorOutputError("yt-dlpが動画情報を出力しませんでした", 0)
+    return result
@@ -0,0 +1,122 @@
+import bisect
+from collections import OrderedDict
+
+# コーデックの優先順位（AV1 > VP9 > H.264）
+CODEC_RANK = {'av01': 3, 'vp9': 2, 'avc1': 1, 'unknown': 0}
+
+# コンテナに再エンコードせずに格納できる音声コーデック（acodecの先頭）
+CONTAINER_AUDIO_CODECS = {
+    'mp4': ('mp4a', 'aac', 'mp3', 'ac-3', 'ec-3'),
+    'webm': ('opus', 'vorbis')
+}
+
+# vcodec文字列からコーデック系列を判定
+def get_codec_family(vcodec):
+    """vcodec（例: avc1.640028, vp09.00.40.08）をav01/vp9/avc1に分類する"""
+    vcodec = (vcodec or '').lower()
+    if vcodec.startswith('av01'):
+        return 'av01'
+    if vcodec.startswith(('vp9', 'vp09')):
+        return 'vp9'
+    if vcodec.startswith(('avc1', 'h264')):
+        return 'avc1'
+    return 'unknown'
+
+
+class FormatEntry:
+    """yt-dlpのformats配列の1要素を型付きで保持するレコード"""
+    __slots__ = ('format_id', 'ext', 'width', 'height', 'fps', 'vcodec', 'acodec',
+                 'codec', 'codec_rank', 'tbr', 'filesize', 'protocol', 'url', 'note')
+
+    def __init__(self, fmt):
+        self.format_id = str(fmt.get('format_id', ''))
+        self.ext = fmt.get('ext') or ''
+        self.width = int(fmt.get('width') or 0)
+        self.height = int(fmt.get('height') or 0)
+        self.fps = fmt.get('fps')
+        self.vcodec = fmt.get('vcodec') or 'none'
+        self.acodec = fmt.get('acodec') or 'none'
+        self.codec = get_codec_family(self.vcodec)
+        self.codec_rank = CODEC_RANK[self.codec]
+        self.tbr = float(fmt.get('tbr') or fmt.get('vbr') or fmt.get('abr') or 0)
+        self.filesize = fmt.get('filesize') or fmt.get('filesize_approx')
+        self.protocol = fmt.get('protocol') or ''
+        self.url = fmt.get('url')
+        self.note = fmt.get('format') or fmt.get('format_note') or ''
+
+    @property
+    def has_video(self):
+        return self.vcodec != 'none' and self.height > 0
+
+    @property
+    def video_only(self):
+        return self.has_video and self.acodec == 'none'
+
+    @property
+    def audio_only(self):
+        return self.vcodec == 'none' and self.acodec != 'none'
+
+    def sort_key(self):
+        return (self.height, self.codec_rank, self.tbr)
+
+    def to_dict(self):
+        return {
+            "format_id": self.format_id,
+            "ext": self.ext,
+            "codec": self.codec,
+            "width": self.width,
+            "height": self.height,
+            "fps": self.fps,
+            "tbr": self.tbr,
+            "filesize": self.filesize,
+            "protocol": self.protocol,
+            "info": self.note
+        }
+
+
+class FormatIndex:
+    """formats配列から一度だけ構築する検索用インデックス"""
+    __slots__ = ('video_only', 'audio_only', 'resolutions', '_by_ext')
+
+    def __init__(self, formats):
+        entries = [FormatEntry(fmt) for fmt in formats or []]
+
+        # 映像のみのフォーマットは(高さ, コーデック優先度, ビットレート)の昇順
+        self.video_only = sorted((e for e in entries if e.video_only), key=FormatEntry.sort_key)
+        self.audio_only = sorted((e for e in entries if e.audio_only), key=lambda e: e.tbr)
+        self.resolutions = sorted({e.height for e in entries if e.has_video}, reverse=True)
+
+        # 拡張子ごとの(エントリ, 高さ)リスト。None は全拡張子
+        self._by_ext = {None: (self.video_only, [e.height for e in self.video_only])}
+        for ext in {e.ext for e in self.video_only}:
+            subset = [e for e in self.video_only if e.ext == ext]
+            self._by_ext[ext] = (subset, [e.height for e in subset])
+
+    def select(self, target_height, ext=None):
+        """target_height以下で最大の解像度の映像フォーマットを返す（同じ高さならコーデック優先度・ビットレート順）"""
+        entries, heights = self._by_ext.get(ext, ((), ()))
+        position = bisect.bisect_right(heights, target_height)
+        if position == 0:
+            return None
+        return entries[position - 1]
+
+    def best_audio(self, ext=None, container=None):
+        """最もビットレートの高い音声のみのフォーマットを返す
+
+        containerを指定した場合はそのコンテナに格納できるコーデックの音声に限る。
+        """
+        codecs = CONTAINER_AUDIO_CODECS.get(container, ()) if container else None
+        for entry in reversed(self.audio_only):
+            if ext is not None and entry.ext != ext:
+                continue
+            if codecs is not None and not entry.acodec.lower().startswith(codecs):
+                continue
+            return entry
+        return None
+
+    def group_by_height(self):
+        """映像のみのフォーマットを解像度の降順でグループ化する"""
+        groups = OrderedDict()
+        for entry in reversed(self.video_only):
+            groups.setdefault(entry.height, []).append(entry)
+        return groups
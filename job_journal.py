@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# 完了したジョブ（再開の対象外）
+TERMINAL_EVENTS = ('finished', 'failed', 'cancelled')
+
+
+class JobJournal:
+    """ジョブの投入・開始・チェックポイント・完了を追記していくJSONLのジャーナル
+
+    各イベントはジョブの状態を変える前に書き込んでfsyncするため、
+    サーバーが異常終了しても完了していないジョブを次回起動時に復元できる。
+    """
+
+    def __init__(self, path, compact_threshold=1000):
+        self.path = path
+        self.compact_threshold = compact_threshold  # 追記した行数がこれを超えたら完了したジョブを削除する
+        self._live = {}  # job_id -> 完了していないジョブの記録
+        self._lines = 0
+        self._file = None
+        self._lock = threading.Lock()
+
+    def open(self):
+        """ジャーナルを読み込み、完了していないジョブの記録を古い順に返す"""
+        with self._lock:
+            self._live = self._replay()
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._compact_locked()
+            return [dict(record, checkpoint=dict(record['checkpoint'])) for record in self._live.values()]
+
+    def append(self, event, job_id, **fields):
+        """イベントを書き込む（ジャーナルが開かれていなければ何もしない）"""
+        record = dict(fields, event=event, job_id=job_id, time=time.time())
+        with self._lock:
+            if self._file is None:
+                return
+            self._apply(self._live, record)
+            self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._lines += 1
+            if self._lines > self.compact_threshold:
+                self._compact_locked()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    @staticmethod
+    def _apply(live, record):
+        event = record.get('event')
+        job_id = record.get('job_id')
+        if event == 'queued':
+            live[job_id] = {
+                "job_id": job_id,
+                "kind": record.get('kind'),
+                "params": record.get('params') or {},
+                "created_at": record.get('created_at') or record['time'],
+                "state": 'queued',
+                "checkpoint": dict(record.get('checkpoint') or {})
+            }
+        elif job_id in live:
+            if event in TERMINAL_EVENTS:
+                del live[job_id]
+            elif event == 'checkpoint':
+                live[job_id]['checkpoint'].update(record.get('data') or {})
+            elif event == 'params':
+                live[job_id]['params'].update(record.get('params') or {})
+            else:
+                live[job_id]['state'] = event
+
+    def _replay(self):
+        live = {}
+        if not os.path.exists(self.path):
+            return live
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 書き込み途中で終了した最後の行は読み飛ばす
+                    logger.warning("ジャーナルの壊れた行を読み飛ばしました")
+                    continue
+                self._apply(live, record)
+        return live
+
+    def _compact_locked(self):
+        """完了していないジョブだけを書き出したファイルに置き換える"""
+        if self._file is not None:
+            self._file.close()
+        temp_path = self.path + '.tmp'
+        now = time.time()
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for record in self._live.values():
+                f.write(json.dumps({
+                    "event": 'queued',
+                    "job_id": record['job_id'],
+                    "kind": record['kind'],
+                    "params": record['params'],
+                    "created_at": record['created_at'],
+                    "checkpoint": record['checkpoint'],
+                    "time": now
+                }, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._lines = len(self._live)
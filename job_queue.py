@@ -0,0 +1,482 @@
+import time
+import uuid
+import logging
+import threading
+import traceback
+import contextvars
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+# ジョブの状態
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_FINISHED = 'finished'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+JOB_INTERRUPTED = 'interrupted'  # サーバーの終了で中断された（次回起動時に再開する）
+
+ACTIVE_STATES = (JOB_QUEUED, JOB_RUNNING)
+
+
+# ジョブ処理中の想定内エラー（メッセージはそのままクライアントに返す）
+class JobError(Exception):
+    pass
+
+
+# ホスト単位の同時実行数制限に使うホスト名
+def job_host(params):
+    """ジョブのURLからホスト名を取得する（www.は除く）"""
+    host = (urlparse(params.get('url') or '').hostname or '').lower()
+    return host[4:] if host.startswith('www.') else host
+
+
+class Job:
+    """キューに投入された1件の処理"""
+
+    def __init__(self, kind, params, job_id=None):
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.host = job_host(params)
+        self.state = JOB_QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self.progress = None
+        self.dedupe_key = None
+        self.after = None  # 完了を待ってから実行する同じキーのジョブ（再実行の指定で合流しなかった場合）
+        self.attached = 0  # 同じジョブに合流したリクエストの数
+        self.checkpoint_data = {}  # 中断後の再開に必要な情報（ジャーナルに記録される）
+        self.resumed = False  # 前回の起動時から引き継いだジョブ
+        self.interrupted = False
+        # 投入したリクエストのコンテキスト（トレースなど）をワーカー上でも引き継ぐ
+        self.context = contextvars.copy_context()
+        self.done = threading.Event()
+        self._journal = None
+        self._process = None
+        self._process_lock = threading.Lock()
+        self._changed = threading.Condition()
+        self._version = 0
+        self._watch_closed = False
+
+    @property
+    def active(self):
+        return self.state in ACTIVE_STATES
+
+    def wait(self, timeout=None):
+        """ジョブの完了を待つ"""
+        return self.done.wait(timeout)
+
+    def notify(self):
+        """状態・進捗の変化を購読者に知らせる"""
+        with self._changed:
+            self._version += 1
+            self._changed.notify_all()
+
+    def close_watchers(self):
+        """watch()の購読を終わらせる（サーバーの終了時に、待機中のジョブのSSEが応答を続けないようにする）"""
+        with self._changed:
+            self._watch_closed = True
+            self._changed.notify_all()
+
+    def update_progress(self, progress):
+        self.progress = progress
+        self.notify()
+
+    def checkpoint(self, **data):
+        """再開に必要な情報を記録する（コマンド・保存先など）"""
+        self.checkpoint_data.update(data)
+        if self._journal is not None:
+            try:
+                self._journal.append('checkpoint', self.id, data=data)
+            except OSError as e:
+                logger.error(f"ジャーナルへの書き込みに失敗しました: {self.id}: {e}")
+
+    def attach_process(self, process):
+        """ジョブが実行中の子プロセスを登録する（中断時に終了させる）"""
+        with self._process_lock:
+            self._process = process
+            if self.interrupted:
+                process.terminate()
+
+    def interrupt(self):
+        """実行中の子プロセスを終了させて、ジョブを再開可能な状態で止める"""
+        with self._process_lock:
+            self.interrupted = True
+            if self._process is not None and self._process.poll() is None:
+                self._process.terminate()
+
+    def watch(self, min_interval=0.25, keepalive=15):
+        """状態・進捗の変化を間引きながら返すジェネレーター（SSE用）
+
+        min_interval秒の間に届いた更新は最新の1件にまとめる。
+        keepalive秒間変化がなければNoneを返す。
+        """
+        last_version = None
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: self._version != last_version or self._watch_closed, keepalive)
+                if self._watch_closed:
+                    return
+                changed = self._version != last_version
+                last_version = self._version
+            if not changed:
+                yield None
+                continue
+            snapshot = self.to_dict()
+            yield snapshot
+            if snapshot['state'] not in ACTIVE_STATES:
+                return
+            time.sleep(min_interval)
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "host": self.host,
+            "state": self.state,
+            "params": self.params,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+            "progress": self.progress,
+            "attached": self.attached,
+            "resumed": self.resumed
+        }
+
+
+class JobQueue:
+    """ワーカースレッド数（全体の同時実行数）とホストごとの同時実行数を制限したジョブキュー"""
+
+    def __init__(self, workers=2, host_limit=None, history_size=200):
+        self.workers = workers
+        self.journal = None
+        self.host_limit = host_limit
+        self.history_size = history_size
+        self._handlers = {}
+        self._dedupe_keys = {}
+        self._on_duplicate = {}
+        self._rerun_duplicate = {}
+        self._active_by_key = {}  # 重複排除キー -> 実行中・待機中のJob
+        self._deduplicated = 0
+        self._pending = deque()
+        self._jobs = OrderedDict()  # job_id -> Job（投入順）
+        self._running_by_host = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._threads = []
+        self._worker_serial = 0  # ワーカースレッドの通し番号（スレッド名に使う）
+        self._stopping = False
+
+    def register(self, kind, handler, dedupe_key=None, on_duplicate=None, rerun_duplicate=None):
+        """ジョブ種別ごとの処理関数を登録する（handler(job) -> 結果のdict、または結果のdictを返すFuture）
+
+        dedupe_key(params)がキーを返す場合、同じキーのジョブが実行中・待機中なら
+        新しいジョブを作らずにそのジョブを返す。その際にon_duplicate(既存のJob, 新しいparams)を
+        呼ぶ（優先度の引き上げなど）。
+        rerun_duplicate(params)がTrueを返すジョブ（再ダウンロードの指定など）は合流せず、
+        同じキーのジョブが完了してから実行する（同じキーのジョブを同時には実行しない）。
+        """
+        self._handlers[kind] = handler
+        self._dedupe_keys[kind] = dedupe_key
+        self._on_duplicate[kind] = on_duplicate
+        self._rerun_duplicate[kind] = rerun_duplicate
+
+    def start(self, workers=None, host_limit=None):
+        """ワーカースレッドを起動する（起動済みの場合はワーカー数を変更する）
+
+        ワーカー数を減らした場合、超えた分のワーカーは手が空いた順に終了する（実行中のジョブは最後まで続ける）。
+        """
+        with self._lock:
+            if workers is not None:
+                self.workers = max(1, int(workers))
+            if host_limit is not None:
+                self.host_limit = max(1, int(host_limit))
+            self._stopping = False
+            while len(self._threads) < self.workers:
+                self._worker_serial += 1
+                thread = threading.Thread(
+                    target=self._worker,
+                    name=f"job-worker-{self._worker_serial}",
+                    daemon=True
+                )
+                self._threads.append(thread)
+                thread.start()
+            retiring = len(self._threads) - self.workers
+            if retiring > 0:
+                # 待機中のワーカーを起こして終了させる
+                self._wakeup.notify_all()
+        if retiring > 0:
+            logger.info(f"ジョブワーカーを{retiring}件減らします（実行中のジョブは完了まで続けます）")
+        logger.info(f"ジョブワーカーを起動しました: {self.workers}件 (ホストごとの上限: {self.host_limit or '無制限'})")
+
+    def submit(self, kind, params):
+        """ジョブを投入してJobを返す（同じ内容のジョブが実行中ならそのJobを返す）"""
+        if kind not in self._handlers:
+            raise ValueError(f"未登録のジョブ種別です: {kind}")
+        if not self._threads:
+            self.start()
+        job = Job(kind, params)
+        with self._lock:
+            existing = self._enqueue_locked(job)
+        if existing is not None:
+            on_duplicate = self._on_duplicate.get(kind)
+            if on_duplicate is not None:
+                on_duplicate(existing, params)
+            return existing
+        logger.info(f"ジョブを投入しました: {job.id} ({kind})")
+        return job
+
+    def update_params(self, job, **changes):
+        """実行中・待機中のジョブのパラメーターを変更してジャーナルに記録する（次回起動時にも引き継ぐ）"""
+        with self._lock:
+            if not job.active:
+                return False
+            self._journal_append('params', job, params=changes)
+            job.params.update(changes)
+        job.notify()
+        return True
+
+    def attach_journal(self, journal):
+        """ジャーナルを開き、前回の起動時に完了しなかったジョブを待機中として復元する"""
+        records = journal.open()
+        restored = []
+        with self._lock:
+            self.journal = journal
+            for record in records:
+                if record['kind'] not in self._handlers:
+                    logger.warning(f"未登録のジョブ種別のため復元しません: {record['job_id']} ({record['kind']})")
+                    continue
+                job = Job(record['kind'], record['params'], job_id=record['job_id'])
+                job.created_at = record['created_at']
+                job.checkpoint_data = record['checkpoint']
+                job.resumed = True
+                if self._enqueue_locked(job, journaled=True) is None:
+                    restored.append(job)
+        for job in restored:
+            logger.info(f"前回中断したジョブを再開します: {job.id} ({job.kind})")
+        return restored
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list_jobs(self, include_finished=False):
+        """ジョブの一覧を返す（既定では実行中・待機中のみ）"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        if include_finished:
+            return jobs
+        return [job for job in jobs if job.active]
+
+    def cancel(self, job_id):
+        """待機中のジョブを取り消す（実行中のジョブは取り消せない）"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.state != JOB_QUEUED:
+                return False
+            self._journal_append('cancelled', job)
+            job.state = JOB_CANCELLED
+            job.finished_at = time.time()
+            self._release_key_locked(job)
+            self._wakeup.notify_all()
+        job.done.set()
+        job.notify()
+        return True
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+            running_by_host = {host: count for host, count in self._running_by_host.items() if count}
+        return {
+            "workers": self.workers,
+            "host_limit": self.host_limit,
+            "queued": sum(1 for job in jobs if job.state == JOB_QUEUED),
+            "running": sum(1 for job in jobs if job.state == JOB_RUNNING),
+            "running_by_host": running_by_host,
+            "deduplicated": self._deduplicated,
+            "journaled": self.journal is not None
+        }
+
+    def shutdown(self, timeout=None, grace=5):
+        """ワーカーを停止する
+
+        実行中のジョブはtimeoutまで完了を待ち、終わらなければ中断する。
+        中断したジョブと待機中のジョブはジャーナルに残り、次回起動時に再開される。
+        """
+        with self._lock:
+            self._stopping = True
+            self._wakeup.notify_all()
+            threads = list(self._threads)
+        deadline = None if timeout is None else time.time() + timeout
+        for thread in threads:
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            thread.join(remaining)
+        # ワーカーを離れて後処理などの完了を待っているジョブも同じ期限まで待つ
+        for job in self.list_jobs():
+            if job.state == JOB_RUNNING:
+                job.wait(None if deadline is None else max(0, deadline - time.time()))
+        
+        running = [job for job in self.list_jobs() if job.state == JOB_RUNNING]
+        if running:
+            logger.info(f"実行中のジョブを中断します（次回起動時に再開）: {len(running)}件")
+            for job in running:
+                job.interrupt()
+            # 子プロセスの終了とジャーナルへの記録を待つ
+            deadline = time.time() + grace
+            for thread in threads:
+                thread.join(max(0, deadline - time.time()))
+        with self._lock:
+            self._threads = []
+        for job in self.list_jobs():
+            job.close_watchers()
+        if self.journal is not None:
+            self.journal.close()
+
+    def _enqueue_locked(self, job, journaled=False):
+        """ジョブを待機列に加える（同じ内容のジョブが実行中ならそのJobを返す）"""
+        dedupe_key = self._dedupe_keys[job.kind](job.params) if self._dedupe_keys.get(job.kind) else None
+        existing = self._active_by_key.get(dedupe_key) if dedupe_key is not None else None
+        rerun = self._rerun_duplicate.get(job.kind)
+        if existing is not None and existing.active and rerun is not None and rerun(job.params):
+            # 同じ出力を同時に書き込まないよう、実行中・待機中のジョブの完了を待ってから実行する
+            job.after = existing
+            logger.info(f"同じジョブの完了後に実行します: {existing.id} ({dedupe_key})")
+        elif existing is not None and existing.active:
+            existing.attached += 1
+            self._deduplicated += 1
+            logger.info(f"実行中の同じジョブに合流しました: {existing.id} ({dedupe_key})")
+            if journaled:
+                self._journal_append('cancelled', job)
+            return existing
+        if not journaled:
+            # 待機列に加える前に書き込む（ここで異常終了しても次回起動時に投入し直せる）
+            self._journal_append('queued', job, kind=job.kind, params=job.params, created_at=job.created_at)
+        job._journal = self.journal
+        if dedupe_key is not None:
+            job.dedupe_key = dedupe_key
+            self._active_by_key[dedupe_key] = job
+        self._jobs[job.id] = job
+        self._trim_history_locked()
+        self._pending.append(job)
+        self._wakeup.notify()
+        return None
+
+    def _journal_append(self, event, job, **fields):
+        if self.journal is None:
+            return
+        try:
+            self.journal.append(event, job.id, **fields)
+        except OSError as e:
+            logger.error(f"ジャーナルへの書き込みに失敗しました: {job.id}: {e}")
+
+    def _release_key_locked(self, job):
+        if job.dedupe_key is not None and self._active_by_key.get(job.dedupe_key) is job:
+            del self._active_by_key[job.dedupe_key]
+
+    def _trim_history_locked(self):
+        finished = [job_id for job_id, job in self._jobs.items() if not job.active]
+        for job_id in finished[:max(0, len(finished) - self.history_size)]:
+            del self._jobs[job_id]
+
+    def _next_runnable_locked(self):
+        """ホストの同時実行数に空きがある最も古い待機中のジョブを取り出す"""
+        for job in list(self._pending):
+            if job.state != JOB_QUEUED:
+                self._pending.remove(job)
+                continue
+            if self.host_limit and self._running_by_host.get(job.host, 0) >= self.host_limit:
+                continue
+            if job.after is not None and job.after.active:
+                continue
+            self._pending.remove(job)
+            return job
+        return None
+
+    def _retire_locked(self):
+        """このワーカーを終了させるか（ワーカー数を減らした場合と、停止後に再起動する前の古いワーカー）"""
+        thread = threading.current_thread()
+        if thread not in self._threads:
+            return True
+        if len(self._threads) > self.workers:
+            self._threads.remove(thread)
+            logger.info(f"ジョブワーカーを終了しました: {thread.name}")
+            return True
+        return False
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                job = None
+                while not self._stopping:
+                    if self._retire_locked():
+                        return
+                    job = self._next_runnable_locked()
+                    if job is not None:
+                        break
+                    self._wakeup.wait()
+                if job is None:
+                    return
+                self._journal_append('running', job)
+                job.state = JOB_RUNNING
+                job.started_at = time.time()
+                self._running_by_host[job.host] = self._running_by_host.get(job.host, 0) + 1
+            job.notify()
+            try:
+                self._run(job)
+            finally:
+                with self._lock:
+                    self._running_by_host[job.host] -= 1
+                    self._wakeup.notify_all()
+
+    def _run(self, job):
+        handler = self._handlers[job.kind]
+        self._settle(job, lambda: job.context.run(handler, job))
+
+    def _settle(self, job, produce):
+        """produce()の戻り値をジョブの結果にする
+
+        Futureが返された場合（後処理を別のプールに渡したダウンロードなど）は
+        ワーカーをすぐに空け、Futureが完了したときにジョブを完了させる。
+        """
+        try:
+            result = produce()
+            if isinstance(result, Future):
+                result.add_done_callback(lambda future: self._settle(job, future.result))
+                return
+            self._journal_append('finished', job)
+            job.result = result
+            job.state = JOB_FINISHED
+            logger.info(f"ジョブが完了しました: {job.id}")
+        except Exception as e:
+            if job.interrupted:
+                # ジャーナルには完了を記録せず、次回起動時に再開させる
+                self._journal_append('interrupted', job)
+                job.error = "サーバーの終了により中断されました"
+                job.state = JOB_INTERRUPTED
+                logger.info(f"ジョブを中断しました: {job.id}")
+            elif isinstance(e, JobError):
+                self._journal_append('failed', job)
+                job.error = str(e)
+                job.state = JOB_FAILED
+                logger.error(f"ジョブが失敗しました: {job.id}: {e}")
+            else:
+                self._journal_append('failed', job)
+                job.error = f"{type(e).__name__}: {e}"
+                job.state = JOB_FAILED
+                logger.error(f"ジョブの実行中にエラーが発生しました: {job.id}: {e}")
+                logger.error(traceback.format_exc())
+        job.finished_at = time.time()
+        with self._lock:
+            self._release_key_locked(job)
+            # 完了を待っていた同じキーのジョブを実行できるようにする
+            self._wakeup.notify_all()
+        job.done.set()
+        job.notify()
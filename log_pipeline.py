@@ -0,0 +1,185 @@
+import os
+import sys
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
+
+# 既定の設定
+DEFAULT_LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024  # ログファイルを切り替える大きさ
+DEFAULT_BACKUP_COUNT = 5  # 残す古いログファイルの数
+DEFAULT_ROTATE_INTERVAL = 86400  # ログファイルを切り替える間隔（秒、0で時間では切り替えない）
+DEFAULT_MAX_MESSAGE_CHARS = 4000  # 1件のメッセージの上限（超えた分は省略する）
+DEFAULT_QUEUE_SIZE = 10000  # 書き込み待ちの上限（あふれたログは破棄して件数を記録する）
+
+# 外部プロセスの出力をログに残す行数
+OUTPUT_SUMMARY_LINES = 20
+
+
+# 外部プロセスの出力の要約
+def summarize_output(text, max_lines=OUTPUT_SUMMARY_LINES):
+    """出力の末尾max_lines行だけを返す（省略した行数を先頭に付ける）"""
+    lines = (text or '').rstrip('\n').splitlines()
+    if len(lines) <= max_lines:
+        return '\n'.join(lines)
+    return f"（先頭の{len(lines) - max_lines}行を省略）\n" + '\n'.join(lines[-max_lines:])
+
+
+def parse_level(value, default=logging.INFO):
+    """'INFO'などのレベル名・数値をloggingのレベルに変換する（不正な値はdefault）"""
+    if isinstance(value, int):
+        return value
+    level = logging.getLevelName(str(value).upper())
+    return level if isinstance(level, int) else default
+
+
+class RotatingLogFileHandler(logging.handlers.RotatingFileHandler):
+    """大きさ、または一定時間の経過でファイルを切り替えるハンドラー"""
+
+    def __init__(self, filename, max_bytes=DEFAULT_MAX_BYTES, backup_count=DEFAULT_BACKUP_COUNT,
+                 rotate_interval=DEFAULT_ROTATE_INTERVAL, encoding='utf-8'):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding=encoding, delay=True)
+        self.rotate_interval = rotate_interval
+        self.rollover_at = self._next_rollover()
+
+    def _next_rollover(self):
+        return time.time() + self.rotate_interval if self.rotate_interval else None
+
+    def shouldRollover(self, record):
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return 1
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = self._next_rollover()
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """呼び出したスレッドでは書き込まずに待ち行列に入れるハンドラー
+
+    長いメッセージは待ち行列に入れる前に省略し、待ち行列があふれた場合は
+    待たずに破棄して、空きができたときに破棄した件数を警告として出力する。
+    """
+
+    def __init__(self, log_queue, max_message_chars=DEFAULT_MAX_MESSAGE_CHARS):
+        super().__init__(log_queue)
+        self.max_message_chars = max_message_chars
+        self.dropped = 0  # 破棄した件数の累計
+        self._unreported = 0
+
+    def prepare(self, record):
+        record = super().prepare(record)
+        limit = self.max_message_chars
+        if limit and len(record.msg) > limit:
+            record.msg = f"{record.msg[:limit]}…（{len(record.msg) - limit}文字を省略）"
+        return record
+
+    def enqueue(self, record):
+        if self._unreported:
+            notice = logging.makeLogRecord({
+                "name": __name__,
+                "levelno": logging.WARNING,
+                "levelname": 'WARNING',
+                "msg": f"ログの書き込みが追いつかないため{self._unreported}件を破棄しました"
+            })
+            self.filter(notice)
+            try:
+                self.queue.put_nowait(self.prepare(notice))
+                self._unreported = 0
+            except queue.Full:
+                pass
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            self._unreported += 1
+
+
+class LogPipeline:
+    """ルートロガーの出力を待ち行列に入れ、バックグラウンドのスレッドでファイルと標準出力に書き込む"""
+
+    def __init__(self, log_file, log_format=DEFAULT_LOG_FORMAT, level=logging.INFO, console=True, filters=(),
+                 queue_size=DEFAULT_QUEUE_SIZE, max_bytes=DEFAULT_MAX_BYTES, backup_count=DEFAULT_BACKUP_COUNT,
+                 rotate_interval=DEFAULT_ROTATE_INTERVAL, max_message_chars=DEFAULT_MAX_MESSAGE_CHARS):
+        self.level = parse_level(level)
+        self.module_levels = {}
+        formatter = logging.Formatter(log_format)
+        self.file_handler = RotatingLogFileHandler(log_file, max_bytes, backup_count, rotate_interval)
+        self.file_handler.setFormatter(formatter)
+        handlers = [self.file_handler]
+        if console:
+            console_handler = logging.StreamHandler(stream=sys.stdout)
+            console_handler.setFormatter(formatter)
+            handlers.append(console_handler)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.queue_handler = BoundedQueueHandler(self.queue, max_message_chars)
+        # リクエストIDなど呼び出し元のスレッドの情報は待ち行列に入れる前に付ける
+        for log_filter in filters:
+            self.queue_handler.addFilter(log_filter)
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self._started = False
+
+    def start(self):
+        """ルートロガーのハンドラーを置き換えて書き込みスレッドを開始する"""
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(self.queue_handler)
+        root.setLevel(self.level)
+        self.listener.start()
+        self._started = True
+        atexit.register(self.stop)
+        return self
+
+    def configure(self, level=None, module_levels=None, max_bytes=None, backup_count=None,
+                  rotate_interval=None, max_message_chars=None):
+        """レベル・モジュールごとのレベル・切り替えの条件を変更する（再起動せずに反映される）"""
+        if level is not None:
+            self.level = parse_level(level)
+            logging.getLogger().setLevel(self.level)
+        if module_levels is not None:
+            # 指定がなくなったモジュールはルートのレベルに戻す
+            for name in set(self.module_levels) - set(module_levels):
+                logging.getLogger(name).setLevel(logging.NOTSET)
+            self.module_levels = {}
+            for name, value in module_levels.items():
+                module_level = parse_level(value, None)
+                if module_level is None:
+                    logging.getLogger(__name__).warning(f"ログレベルの指定が正しくありません: {name}={value}")
+                    continue
+                logging.getLogger(name).setLevel(module_level)
+                self.module_levels[name] = module_level
+        if max_bytes is not None:
+            self.file_handler.maxBytes = max_bytes
+        if backup_count is not None:
+            self.file_handler.backupCount = backup_count
+        if rotate_interval is not None and rotate_interval != self.file_handler.rotate_interval:
+            self.file_handler.rotate_interval = rotate_interval
+            self.file_handler.rollover_at = self.file_handler._next_rollover()
+        if max_message_chars is not None:
+            self.queue_handler.max_message_chars = max_message_chars
+
+    def stop(self):
+        """待ち行列に残っているログを書き込んでから終了する"""
+        if not self._started:
+            return
+        self._started = False
+        self.listener.stop()
+        # 終了処理中のログは直接書き込む
+        root = logging.getLogger()
+        root.removeHandler(self.queue_handler)
+        for handler in self.listener.handlers:
+            for log_filter in self.queue_handler.filters:
+                handler.addFilter(log_filter)
+            root.addHandler(handler)
+            handler.flush()
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "dropped": self.queue_handler.dropped,
+            "file": os.path.abspath(self.file_handler.baseFilename)
+        }
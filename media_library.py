@@ -0,0 +1,114 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    video_key TEXT NOT NULL,
+    format TEXT NOT NULL,
+    resolution TEXT NOT NULL,
+    codec TEXT,
+    format_id TEXT,
+    title TEXT,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    downloaded_at REAL NOT NULL,
+    PRIMARY KEY (video_key, format, resolution)
+)
+"""
+
+
+class MediaLibrary:
+    """ダウンロード済みのファイルを動画・フォーマット・解像度ごとに記録するSQLiteのインデックス"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._stale = 0
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        # 複数のワーカースレッドから使うため、接続は1つにしてロックで直列化する
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+
+    def lookup(self, video_key, format_type, resolution):
+        """記録済みのファイルを返す（ファイルが消えた・書き換えられた場合は記録を削除してNone）"""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT * FROM media WHERE video_key = ? AND format = ? AND resolution = ?',
+                (video_key, format_type, resolution)
+            ).fetchone()
+            if row is None:
+                self._misses += 1
+                return None
+            entry = dict(row)
+            # ファイルの中身は読まず、サイズと更新時刻だけで同じファイルか確認する
+            try:
+                st = os.stat(entry['path'])
+                unchanged = st.st_size == entry['size'] and abs(st.st_mtime - entry['mtime']) < 1e-3
+            except OSError:
+                unchanged = False
+            if not unchanged:
+                logger.info(f"ライブラリのファイルが見つからないか変更されています: {entry['path']}")
+                self._conn.execute(
+                    'DELETE FROM media WHERE video_key = ? AND format = ? AND resolution = ?',
+                    (video_key, format_type, resolution)
+                )
+                self._conn.commit()
+                self._stale += 1
+                self._misses += 1
+                return None
+            self._hits += 1
+            return entry
+
+    def record(self, video_key, format_type, resolution, path, codec=None, format_id=None, title=None):
+        """ダウンロードが完了したファイルを記録する"""
+        st = os.stat(path)
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO media '
+                '(video_key, format, resolution, codec, format_id, title, path, size, mtime, downloaded_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (video_key, format_type, resolution, codec, format_id, title, path,
+                 st.st_size, st.st_mtime, time.time())
+            )
+            self._conn.commit()
+
+    def remove(self, video_key, format_type=None, resolution=None):
+        """記録を削除する（フォーマット・解像度を省略した場合はその動画の記録をすべて削除）"""
+        query = 'DELETE FROM media WHERE video_key = ?'
+        params = [video_key]
+        if format_type is not None:
+            query += ' AND format = ?'
+            params.append(format_type)
+        if resolution is not None:
+            query += ' AND resolution = ?'
+            params.append(resolution)
+        with self._lock:
+            count = self._conn.execute(query, params).rowcount
+            self._conn.commit()
+            return count
+
+    def stats(self):
+        with self._lock:
+            entries, total_bytes = self._conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM media').fetchone()
+            return {
+                "entries": entries,
+                "total_bytes": total_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "stale": self._stale
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,211 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger(__name__)
+
+# YouTubeの動画IDは11文字の英数字・ハイフン・アンダースコア
+_YOUTUBE_ID_RE = re.compile(r'^[A-Za-z0-9_-]{11}$')
+_YOUTUBE_PATH_RE = re.compile(r'^/(?:shorts|embed|live|v)/([^/?#]+)')
+_YOUTUBE_HOSTS = ('youtube.com', 'music.youtube.com', 'youtube-nocookie.com')
+
+# URLから正規化されたキャッシュキーを生成
+def canonical_video_key(url):
+    """URLを動画単位のキーに正規化する（YouTubeの場合は動画IDを使用）"""
+    url = (url or '').strip()
+    parsed = urlparse(url)
+    host = (parsed.hostname or '').lower()
+    for prefix in ('www.', 'm.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+
+    video_id = None
+    if host in _YOUTUBE_HOSTS:
+        if parsed.path == '/watch':
+            video_id = parse_qs(parsed.query).get('v', [None])[0]
+        else:
+            match = _YOUTUBE_PATH_RE.match(parsed.path)
+            if match:
+                video_id = match.group(1)
+    elif host == 'youtu.be':
+        video_id = parsed.path.lstrip('/').split('/')[0]
+
+    if video_id and _YOUTUBE_ID_RE.match(video_id):
+        return f"youtube:{video_id}"
+    return f"url:{url}"
+
+
+class MetadataCache:
+    """yt-dlpの-J結果を保持するキャッシュ（TTL・LRU・任意のディスク層付き）"""
+
+    def __init__(self, max_entries=128, ttl=1800, disk_dir=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = None
+        self._entries = OrderedDict()  # key -> (有効期限, 動画情報, 派生データ)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.configure(max_entries, ttl, disk_dir)
+
+    def configure(self, max_entries, ttl, disk_dir=None):
+        """キャッシュサイズ・TTL・ディスク層の設定を反映する"""
+        with self._lock:
+            self.max_entries = max(1, int(max_entries))
+            self.ttl = max(0, int(ttl))
+            self.disk_dir = disk_dir
+            self._evict_locked()
+        if disk_dir:
+            try:
+                os.makedirs(disk_dir, exist_ok=True)
+                self._prune_disk()
+            except Exception as e:
+                logger.error(f"メタデータキャッシュディレクトリの準備に失敗しました: {e}")
+                self.disk_dir = None
+
+    def get(self, key):
+        """キャッシュから動画情報を取得する（期限切れ・未登録ならNone）"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, info, _ = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return info
+                del self._entries[key]
+
+        entry = self._read_disk(key, now)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries[key] = entry + ({},)
+            self._entries.move_to_end(key)
+            self._evict_locked()
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, info):
+        """動画情報をキャッシュに登録する"""
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._entries[key] = (expires_at, info, {})
+            self._entries.move_to_end(key)
+            self._evict_locked()
+        self._write_disk(key, expires_at, info)
+
+    def get_derived(self, key, name, factory):
+        """動画情報から派生したデータ（フォーマットインデックス等）をエントリごとに一度だけ生成する
+
+        生成はロックの外で行う（他の動画のget・putを待たせない）。同時に生成した場合は
+        先に登録された方を使う。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                derived = None
+            else:
+                derived = entry[2]
+                if name in derived:
+                    return derived[name]
+        value = factory()
+        if derived is None:
+            return value
+        with self._lock:
+            return derived.setdefault(name, value)
+
+    def invalidate(self, key):
+        """指定したキーのキャッシュを破棄する"""
+        with self._lock:
+            self._entries.pop(key, None)
+        path = self._disk_path(key)
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        """キャッシュの統計情報を返す"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk": bool(self.disk_dir)
+            }
+
+    def _evict_locked(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_path(self, key):
+        if not self.disk_dir:
+            return None
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.disk_dir, f"{digest}.json")
+
+    def _read_disk(self, key, now):
+        path = self._disk_path(key)
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('key') != key or data.get('expires_at', 0) <= now:
+                os.remove(path)
+                return None
+            return data['expires_at'], data['info']
+        except Exception as e:
+            logger.warning(f"メタデータキャッシュの読み込みに失敗しました: {path}: {e}")
+            return None
+
+    def _write_disk(self, key, expires_at, info):
+        path = self._disk_path(key)
+        if not path:
+            return
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({"key": key, "expires_at": expires_at, "info": info}, f, ensure_ascii=False)
+            os.replace(temp_path, path)
+        except Exception as e:
+            logger.warning(f"メタデータキャッシュの書き込みに失敗しました: {path}: {e}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def _prune_disk(self):
+        """期限切れのディスクキャッシュを削除し、件数を上限以内に収める"""
+        now = time.time()
+        files = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                mtime = os.path.getmtime(path)
+                if mtime + self.ttl <= now:
+                    os.remove(path)
+                else:
+                    files.append((mtime, path))
+            except OSError:
+                continue
+        # ディスク層はメモリ層の4倍まで保持する
+        files.sort()
+        for _, path in files[:max(0, len(files) - self.max_entries * 4)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
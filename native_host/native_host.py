@@ -1,67 +1,100 @@
-import sys, json, subprocess, os, traceback, logging
+import sys, json, os, traceback, logging
 from typing import Dict, Any
 from http.server import HTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
 import socket
 import time
+import threading
 import re
 from urllib.parse import parse_qs, urlparse
 
-# デバッグログの設定
+# 親ディレクトリ（インストールディレクトリ）の共通モジュールを読み込めるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from toolchain import ToolchainRegistry
+from config_store import ConfigStore
+from ytdlp_engine import ExtractorPool, ExtractionFailed, EngineUnavailable
+from stream_url_cache import StreamUrlCache
+from metadata_cache import canonical_video_key
+from singleflight import SingleFlight
+from metrics import MetricsRegistry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from log_pipeline import LogPipeline
+from extractor_output import STREAM_FIELDS, ExtractorOutputError, info_template, read_json
+
+# ログの設定（server.pyと同じく書き込みはバックグラウンドのスレッドで行い、ファイルは大きさ・時間で切り替える）
 log_file = os.path.join(os.path.dirname(__file__), 'native_host.log')
-logger = logging.getLogger()
-logger.setLevel(logging.DEBUG)
+log_pipeline = LogPipeline(log_file, log_format='%(asctime)s - %(levelname)s - %(message)s').start()
+
+# ベンチマークなどでは実行ファイル・設定・ポートを環境変数で差し替える
+YTDLP_PATH = os.environ.get('YTDL_YTDLP_PATH') or \
+    os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'yt-dlp.exe'))
+CONFIG_FILE = os.environ.get('YTDL_CONFIG_FILE') or \
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config', 'config.json')
+PORT_OVERRIDE = os.environ.get('YTDL_NATIVE_HOST_PORT')
 
-# 既存のハンドラーをクリア
-for handler in logger.handlers[:]:
-    logger.removeHandler(handler)
+# メトリクス（GET /metricsでPrometheusのテキスト形式で公開する）
+metrics = MetricsRegistry()
+http_requests = metrics.counter(
+    'ytdl_http_requests_total', 'エンドポイントごとのリクエスト数', ('endpoint', 'method', 'status')
+)
+http_latency = metrics.histogram(
+    'ytdl_http_request_duration_seconds', 'エンドポイントごとの応答時間（秒）', ('endpoint', 'method')
+)
+stage_duration = metrics.histogram(
+    'ytdl_stage_duration_seconds', '処理段階ごとの所要時間（秒）', ('stage',)
+)
+subprocess_spawns = metrics.counter(
+    'ytdl_subprocess_spawns_total', '起動した外部プロセスの数', ('program',)
+)
+stream_url_lookups = metrics.counter(
+    'ytdl_stream_url_cache_lookups_total', 'ストリームURLのキャッシュの参照結果', ('result',)
+)
 
-# ファイルハンドラーの追加
-file_handler = logging.FileHandler(log_file, encoding='utf-8')
-file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-logger.addHandler(file_handler)
+# メトリクスで個別に集計するパス（それ以外はotherにまとめる）
+METRICS_ENDPOINTS = ('/', '/ping', '/config', '/metrics')
 
-# コンソールハンドラーの追加
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-logger.addHandler(console_handler)
+# 設定ストア（メモリ上に保持し、ファイルが更新された場合のみ読み直す）
+config_store = ConfigStore(CONFIG_FILE)
 
 def load_config():
     """設定ファイルを読み込む"""
-    config_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config', 'config.json')
-    try:
-        if os.path.exists(config_path):
-            with open(config_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-    except Exception as e:
-        logger.error(f"設定ファイルの読み込みエラー: {str(e)}")
-    return {}
+    return config_store.get()
+
+# ログレベル（既定はINFO。調査時は"log_level": "DEBUG"やモジュールごとの"log_levels"で変更する）
+_log_config = load_config()
+log_pipeline.configure(
+    level=_log_config.get('log_level', 'INFO'),
+    module_levels=_log_config.get('log_levels', {}),
+    max_bytes=_log_config.get('log_max_bytes'),
+    backup_count=_log_config.get('log_backup_count'),
+    rotate_interval=_log_config.get('log_rotate_interval'),
+    max_message_chars=_log_config.get('log_max_message_chars')
+)
+
+# 外部ツールの検出結果（実行ファイルが更新された場合のみ再確認する）
+toolchain = ToolchainRegistry(
+    explicit_paths={
+        'yt-dlp': YTDLP_PATH
+    },
+    search_dirs=[
+        os.path.join(os.path.dirname(__file__), 'ffmpeg', 'ffmpeg-master-latest-win64-gpl', 'bin'),
+        os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'aria2c', 'aria2-1.36.0-win-64bit-build1'))
+    ]
+)
 
 def check_ffmpeg():
     """FFmpegが利用可能か確認"""
-    try:
-        result = subprocess.run(['ffmpeg', '-version'], 
-                               stdout=subprocess.PIPE, 
-                               stderr=subprocess.PIPE, 
-                               text=True)
-        if result.returncode == 0:
-            logging.info("FFmpegが利用可能です")
-            return True
-    except:
-        logging.warning("FFmpegが見つかりません。動画変換に問題が発生する可能性があります。")
+    if toolchain.get('ffmpeg').available:
+        logging.info("FFmpegが利用可能です")
+        return True
+    logging.warning("FFmpegが見つかりません。動画変換に問題が発生する可能性があります。")
     return False
 
 def check_aria2c():
     """aria2cが利用可能か確認"""
-    try:
-        result = subprocess.run(['aria2c', '--version'], 
-                               stdout=subprocess.PIPE, 
-                               stderr=subprocess.PIPE, 
-                               text=True)
-        if result.returncode == 0:
-            logging.info("aria2cが利用可能です")
-            return True
-    except:
-        logging.info("aria2cが見つかりません。標準ダウンローダーを使用します。")
+    if toolchain.get('aria2c').available:
+        logging.info("aria2cが利用可能です")
+        return True
+    logging.info("aria2cが見つかりません。標準ダウンローダーを使用します。")
     return False
 
 # ツール自動インストール関数
@@ -93,7 +126,7 @@ def install_ffmpeg():
             os.remove(zip_path)
             
             logging.info(f"FFmpegを {ffmpeg_bin} にインストールしました")
-            return True
+            return toolchain.get('ffmpeg', refresh=True).available
         else:
             logging.error("自動インストールはWindowsのみサポートしています")
             return False
@@ -107,7 +140,13 @@ class DownloadProcess:
         # 設定からダウンロードパスを取得（ユーザーディレクトリに変更）
         config = load_config()
         self.download_path = config.get('download_path') or os.path.expanduser('~')
-        self.yt_dlp_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'yt-dlp.exe'))
+        self.yt_dlp_path = YTDLP_PATH
+        # yt-dlpをライブラリとして使う情報取得プロセス（未インストールなら実行ファイルを使用）
+        self.extractor_pool = ExtractorPool(workers=config.get('extractor_workers', 1))
+        # 解決済みのストリームURL（URLのexpireまで再利用する）
+        self.stream_cache = StreamUrlCache()
+        # 同じ動画・解像度・フォーマットの同時リクエストは1回の取得にまとめる
+        self.resolutions = SingleFlight()
         logging.info(f"Download path: {self.download_path}")
         logging.info(f"yt-dlp path: {self.yt_dlp_path}")
         
@@ -132,8 +171,59 @@ class DownloadProcess:
             logging.error(f"yt-dlp.exeへのアクセス失敗: {str(e)}")
             raise
 
+    def start_extractor_pool(self):
+        """情報取得用の常駐プロセスを起動する"""
+        if load_config().get('extractor_engine', 'auto') == 'subprocess':
+            logging.info("設定により、実行ファイルで情報を取得します")
+            return
+        if not self.extractor_pool.available:
+            logging.info("yt-dlpのライブラリがないため、実行ファイルで情報を取得します")
+            return
+        try:
+            self.extractor_pool.start()
+        except EngineUnavailable as e:
+            logging.error(str(e))
+
+    def get_video_info(self, url, format_spec=None):
+        """動画情報を取得する（format_spec指定時は選択結果を含む。常駐プロセスが使えない場合は実行ファイルを起動）"""
+        with stage_duration.time(stage='info_probe'):
+            return self._get_video_info(url, format_spec)
+
+    def _get_video_info(self, url, format_spec):
+        if self.extractor_pool.running:
+            try:
+                return self.extractor_pool.extract_info(url, format_spec, fields=STREAM_FIELDS)
+            except (ExtractionFailed, EngineUnavailable) as e:
+                logging.warning(f"yt-dlpエンジンでの取得に失敗したため、実行ファイルで再試行します: {e}")
+        
+        # ストリームURLの解決に使う項目だけを1行のJSONとして出力させる（-Jの全体を保持しない）
+        info_cmd = [
+            self.yt_dlp_path,
+            '-O', info_template(STREAM_FIELDS),
+            '--no-warnings',
+            '--no-playlist',
+            url
+        ]
+        if format_spec:
+            info_cmd[1:1] = ['-f', format_spec]
+        
+        subprocess_spawns.inc(program='yt-dlp')
+        try:
+            return read_json(info_cmd, fields=STREAM_FIELDS)
+        except ExtractorOutputError as e:
+            logging.warning(f"動画情報の取得に失敗しました: {e}")
+            return None
+
     def download_video(self, url: str, resolution: str, fmt: str) -> Dict:
-        """動画のストリームURLを取得"""
+        """動画のストリームURLを取得（実行中の同じ取得があればその結果を待つ）"""
+        key = (canonical_video_key(url), resolution, fmt)
+        result, shared = self.resolutions.do(key, lambda: self._resolve_stream_urls(url, resolution, fmt))
+        if shared:
+            logging.info(f"同時に実行された取得の結果を共有しました: {key}")
+        return dict(result)
+
+    def _resolve_stream_urls(self, url: str, resolution: str, fmt: str) -> Dict:
+        """yt-dlpでストリームURLを解決する"""
         process = None
         try:
             logging.info(f"Getting stream URL: url={url}, resolution={resolution}, format={fmt}")
@@ -166,57 +256,33 @@ class DownloadProcess:
                         format_spec = f'bestvideo[height<={height}]+bestaudio/best[height<={height}]/best'
                 ext = fmt
             
-            # 動画情報を取得
-            info_cmd = [
-                self.yt_dlp_path,
-                '--dump-json',
-                '--no-warnings',
-                '--no-playlist',
-                url
-            ]
+            # 同じ動画・フォーマットのURLが有効期限内なら再利用する
+            cache_key = (canonical_video_key(url), format_spec, resolution)
+            cached = self.stream_cache.get(cache_key)
+            stream_url_lookups.inc(result='hit' if cached is not None else 'miss')
+            if cached is not None:
+                logging.info(f"ストリームURLのキャッシュを使用します: {cache_key}")
+                return dict(cached)
             
-            info_process = subprocess.run(
-                info_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                check=False
-            )
+            # 1回の-fで動画情報と選択されたフォーマットのURLをまとめて取得
+            try:
+                video_info = self.get_video_info(url, format_spec)
+            except json.JSONDecodeError:
+                video_info = None
             
-            if info_process.returncode != 0:
+            if video_info is None:
                 return {"success": False, "error": f"動画情報の取得に失敗しました"}
             
             # タイトル取得とサニタイズ
             try:
-                video_info = json.loads(info_process.stdout)
                 title = video_info.get('title', 'video')
                 title = re.sub(r'[\\/*?:"<>|]', '', title)
             except:
                 title = 'video'
             
-            # ストリームURLを取得
-            url_cmd = [
-                self.yt_dlp_path,
-                '-f', format_spec,
-                '--get-url',
-                '--no-warnings',
-                '--no-playlist',
-                url
-            ]
-            
-            url_process = subprocess.run(
-                url_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                check=False
-            )
-            
-            if url_process.returncode != 0:
-                return {"success": False, "error": f"ストリームURLの取得に失敗しました"}
-            
-            # 結果が複数行ある場合（映像と音声が別々）
-            stream_urls = url_process.stdout.strip().split('\n')
+            # 映像と音声が別々の場合はrequested_formatsに両方が含まれる
+            requested = video_info.get('requested_formats') or [video_info]
+            stream_urls = [f.get('url') for f in requested if f.get('url')]
             video_url = stream_urls[0] if stream_urls else None
             audio_url = stream_urls[1] if len(stream_urls) > 1 else None
             
@@ -225,7 +291,7 @@ class DownloadProcess:
             
             # 映像・音声両方のURLを返す場合
             if audio_url:
-                return {
+                result = {
                     "success": True, 
                     "video_url": video_url,
                     "audio_url": audio_url,
@@ -235,13 +301,15 @@ class DownloadProcess:
                 }
             else:
                 # 単一のURLの場合
-                return {
+                result = {
                     "success": True, 
                     "url": video_url, 
                     "title": title, 
                     "ext": ext,
                     "requires_merge": False
                 }
+            self.stream_cache.put(cache_key, result, stream_urls)
+            return result
             
         except Exception as e:
             logging.error(f"Error in get_stream_url: {str(e)}")
@@ -251,6 +319,22 @@ class DownloadProcess:
 class DownloadHandler(BaseHTTPRequestHandler):
     downloader = None
     
+    def handle_one_request(self):
+        """1件のリクエストを処理し、パスごとのリクエスト数・応答時間を記録する"""
+        started = time.perf_counter()
+        self.response_status = None
+        super().handle_one_request()
+        if self.response_status is None:
+            return
+        path = urlparse(self.path).path
+        endpoint = path if path in METRICS_ENDPOINTS else 'other'
+        http_requests.inc(endpoint=endpoint, method=self.command, status=self.response_status)
+        http_latency.observe(time.perf_counter() - started, endpoint=endpoint, method=self.command)
+    
+    def send_response(self, code, message=None):
+        self.response_status = code
+        super().send_response(code, message)
+    
     def send_error_response(self, status_code, message):
         self.send_response(status_code)
         self.send_header('Content-type', 'application/json')
@@ -274,6 +358,14 @@ class DownloadHandler(BaseHTTPRequestHandler):
             self.end_headers()
             self.wfile.write(json.dumps({"status": "ok"}).encode('utf-8'))
             return
+        elif self.path == '/metrics':
+            body = metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-type', METRICS_CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
         elif self.path == '/config':
             try:
                 config = load_config()
@@ -298,22 +390,22 @@ class DownloadHandler(BaseHTTPRequestHandler):
             
             if self.path == '/config':
                 try:
-                    config = load_config()
+                    changes = {}
                     if 'download_path' in data:
-                        config['download_path'] = data['download_path']
+                        changes['download_path'] = data['download_path']
                         if not os.path.exists(data['download_path']):
                             os.makedirs(data['download_path'])
                     
                     # 追加の設定パラメータの保存
                     if 'default_resolution' in data:
-                        config['default_resolution'] = data['default_resolution']
+                        changes['default_resolution'] = data['default_resolution']
                     if 'default_format' in data:
-                        config['default_format'] = data['default_format']
+                        changes['default_format'] = data['default_format']
                     
-                    config_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config', 'config.json')
-                    os.makedirs(os.path.dirname(config_path), exist_ok=True)
-                    with open(config_path, 'w', encoding='utf-8') as f:
-                        json.dump(config, f, indent=4, ensure_ascii=False)
+                    # 一時ファイルへの書き込みと置き換えで保存する
+                    if config_store.update(changes) is None:
+                        self.send_error_response(500, "設定の保存に失敗しました")
+                        return
                     
                     if self.downloader:
                         self.downloader.download_path = data.get('download_path', self.downloader.download_path)
@@ -376,6 +468,43 @@ class DownloadHandler(BaseHTTPRequestHandler):
             logging.error(f"Unexpected error in handler: {str(e)}")
             logging.error(traceback.format_exc())
 
+class BoundedThreadingHTTPServer(HTTPServer):
+    """リクエストを上限付きのスレッドプールで並行に処理するHTTPサーバー"""
+
+    def __init__(self, server_address, handler_class, max_workers=8):
+        super().__init__(server_address, handler_class)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='native-host')
+        self._counts_lock = threading.Lock()
+        self.queued = 0  # スレッドの空きを待っている接続
+        self.active = 0  # 処理中の接続
+
+    def process_request(self, request, client_address):
+        # 時間のかかる取得中でも/pingなどの他のリクエストに応答できるようにする
+        with self._counts_lock:
+            self.queued += 1
+        self.executor.submit(self._process_request_worker, request, client_address)
+
+    def _process_request_worker(self, request, client_address):
+        with self._counts_lock:
+            self.queued -= 1
+            self.active += 1
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self._counts_lock:
+                self.active -= 1
+
+    def connection_counts(self):
+        with self._counts_lock:
+            return {('queued',): self.queued, ('active',): self.active}
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
 def find_free_port():
     """利用可能なポート番号を取得"""
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
@@ -395,14 +524,25 @@ def main():
         logging.info("Starting HTTP server...")
         port = 8745  # 固定ポート番号を使用
         
-        # ポート番号をファイルに保存
-        port_file = os.path.join(os.path.dirname(__file__), 'server_port.txt')
-        with open(port_file, 'w') as f:
-            f.write(str(port))
+        if PORT_OVERRIDE:
+            port = int(PORT_OVERRIDE)
+        else:
+            # ポート番号をファイルに保存
+            port_file = os.path.join(os.path.dirname(__file__), 'server_port.txt')
+            with open(port_file, 'w') as f:
+                f.write(str(port))
         
         # サーバーの初期化とダウンローダーの設定
         DownloadHandler.downloader = DownloadProcess()
-        server = HTTPServer(('localhost', port), DownloadHandler)
+        DownloadHandler.downloader.start_extractor_pool()
+        server = BoundedThreadingHTTPServer(
+            ('localhost', port),
+            DownloadHandler,
+            max_workers=load_config().get('native_host_workers', 8)
+        )
+        metrics.gauge(
+            'ytdl_native_host_connections', '状態ごとの接続数', ('state',), collect=server.connection_counts
+        )
         logging.info(f"Server started on port {port}")
         print(f"SERVER_PORT={port}")  # この出力は必須（Chrome拡張機能が読み取ります）
         
@@ -0,0 +1,301 @@
+import os
+import time
+import signal
+import logging
+import threading
+import subprocess
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from worker_main import spawn_context
+
+logger = logging.getLogger(__name__)
+
+# 子プロセスのCPU時間の取得（Windowsでは利用できないため計測しない）
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# 後処理の種類（メトリクス・トレースの処理段階名と同じ）
+STAGE_MERGE = 'ffmpeg_merge'
+STAGE_AUDIO = 'audio_extract'
+
+# ffmpegのエラー出力を保持する行数
+STDERR_TAIL_LINES = 30
+
+# ワーカープロセスで実行中のffmpeg（終了を指示されたときに一緒に終了させる）
+_current_process = None
+
+
+# 後処理の失敗（ワーカープロセスから返すためメッセージのみ保持する）
+class PostprocessError(Exception):
+    pass
+
+
+def _children_cpu():
+    """終了した子プロセスのCPU時間の累計（ユーザー, システム）"""
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime, usage.ru_stime
+
+
+def _terminate(signum, frame):
+    if _current_process is not None and _current_process.poll() is None:
+        _current_process.kill()
+    os._exit(1)
+
+
+def _init_worker():
+    # プールを停止するときは実行中のffmpegも終了させる
+    if hasattr(signal, 'SIGTERM') and os.name != 'nt':
+        signal.signal(signal.SIGTERM, _terminate)
+
+
+def _run_command(cmd, temp_output=None, output=None):
+    """ワーカープロセス上でffmpegを実行し、所要時間とCPU時間を返す
+
+    ワーカーは1件ずつ処理し、子プロセスはこのffmpegだけなので、
+    RUSAGE_CHILDRENの差分がそのままこの処理のCPU時間になる。
+    temp_outputを指定した場合は成功したときだけoutputに置き換える。
+    """
+    global _current_process
+    started = time.perf_counter()
+    before = _children_cpu()
+    _current_process = subprocess.Popen(
+        cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+    stderr_tail = deque(_current_process.stderr, maxlen=STDERR_TAIL_LINES)
+    returncode = _current_process.wait()
+    _current_process = None
+    after = _children_cpu()
+    if returncode != 0:
+        if temp_output and os.path.exists(temp_output):
+            os.remove(temp_output)
+        message = b''.join(stderr_tail).decode('utf-8', errors='replace').strip()
+        raise PostprocessError(message or f"ffmpegが終了コード{returncode}で終了しました")
+    if temp_output:
+        os.replace(temp_output, output)
+    return {
+        "wall_seconds": time.perf_counter() - started,
+        "cpu_user_seconds": after[0] - before[0] if before else None,
+        "cpu_system_seconds": after[1] - before[1] if before else None
+    }
+
+
+# ffmpegのコマンドの組み立て
+def metadata_args(info):
+    """動画情報からffmpegの-metadataの引数を作る（yt-dlpの--add-metadataと同じ項目）"""
+    date = info.get('upload_date') or info.get('release_date')
+    fields = {
+        "title": info.get('title'),
+        "artist": info.get('artist') or info.get('uploader') or info.get('channel'),
+        "album": info.get('album'),
+        "date": date,
+        "description": info.get('description'),
+        "synopsis": info.get('description'),
+        "purl": info.get('webpage_url'),
+        "comment": info.get('webpage_url')
+    }
+    args = []
+    for key, value in fields.items():
+        if value:
+            args.extend(['-metadata', f"{key}={value}"])
+    return args
+
+
+def temp_path(output):
+    """書き込み中の出力先（拡張子はffmpegが形式を判断するためそのままにする）"""
+    base, ext = os.path.splitext(output)
+    return f"{base}.temp{ext}"
+
+
+def build_merge_command(ffmpeg, inputs, output, metadata=()):
+    """映像と音声（または1つのファイル）を再エンコードせずに1つのファイルにまとめる"""
+    cmd = [ffmpeg, '-y', '-loglevel', 'error', '-nostdin']
+    for path in inputs:
+        cmd += ['-i', path]
+    if len(inputs) > 1:
+        cmd += ['-map', '0:v:0', '-map', '1:a:0']
+    else:
+        cmd += ['-map', '0']
+    cmd += ['-c', 'copy', *metadata, output]
+    return cmd
+
+
+def build_audio_command(ffmpeg, source, output, metadata=(), thumbnail=None, quality='0'):
+    """音声をMP3に変換し、サムネイルがあればカバー画像として埋め込む"""
+    cmd = [ffmpeg, '-y', '-loglevel', 'error', '-nostdin', '-i', source]
+    if thumbnail:
+        cmd += ['-i', thumbnail, '-map', '0:a:0', '-map', '1:v:0', '-c:v', 'mjpeg',
+                '-disposition:v:0', 'attached_pic',
+                '-metadata:s:v', 'title=Album cover', '-metadata:s:v', 'comment=Cover (front)']
+    else:
+        cmd += ['-map', '0:a:0']
+    cmd += ['-c:a', 'libmp3lame', '-q:a', str(quality), '-id3v2_version', '3', *metadata, output]
+    return cmd
+
+
+class PostprocessPool:
+    """ffmpegによる後処理（結合・音声の変換）を実行するワーカープロセスのプール
+
+    ワーカー数は既定でCPUのコア数。待機中と実行中の合計がmax_pendingに達すると
+    submit()は空きができるまで待つため、後処理が追いつかない間はダウンロードも止まる。
+    """
+
+    def __init__(self, workers=None, max_pending=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 2
+        self._executor = None
+        self._lock = threading.Lock()
+        self._slots = threading.Condition(self._lock)
+        self._pending = 0  # 待機中・実行中の処理の数
+        self._stats = {
+            "completed": 0, "failed": 0, "restarts": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+            "backpressure_waits": 0, "backpressure_seconds": 0.0
+        }
+
+    @property
+    def running(self):
+        return self._executor is not None
+
+    def start(self, workers=None, max_pending=None):
+        """ワーカープロセスを起動する（起動済みでワーカー数が変わった場合は作り直す）"""
+        with self._lock:
+            workers = workers or os.cpu_count() or 1
+            self.max_pending = max_pending or workers * 2
+            self._slots.notify_all()
+            if self._executor is not None and workers == self.workers:
+                return
+            previous = self._executor
+            self.workers = workers
+            self._executor = self._create_executor()
+        if previous is not None:
+            # 実行中の後処理は古いプールで最後まで続ける
+            previous.shutdown(wait=False)
+        logger.info(f"後処理プールを起動しました: ワーカー {self.workers}, 待機の上限 {self.max_pending}")
+
+    def submit(self, cmd, temp_output=None, output=None, timeout=None):
+        """後処理を投入してFutureを返す（空きがなければtimeout秒まで待つ）
+
+        Futureの結果は所要時間とCPU時間の辞書。
+        """
+        waited = None
+        with self._slots:
+            if self._pending >= self.max_pending:
+                started = time.perf_counter()
+                if not self._slots.wait_for(lambda: self._pending < self.max_pending or self._executor is None, timeout):
+                    raise PostprocessError("後処理の待機数が上限に達しています")
+                waited = time.perf_counter() - started
+            executor = self._executor
+            if executor is None:
+                raise PostprocessError("後処理プールが起動していません")
+            self._pending += 1
+            if waited is not None:
+                self._stats['backpressure_waits'] += 1
+                self._stats['backpressure_seconds'] += waited
+        if waited is not None:
+            logger.info(f"後処理の空きを{waited:.1f}秒待ちました")
+        try:
+            try:
+                future = executor.submit(_run_command, cmd, temp_output, output)
+            except BrokenProcessPool:
+                # 待機中にワーカープロセスが異常終了していた場合は作り直したプールに投入する
+                executor = self._restart(executor)
+                if executor is None:
+                    raise PostprocessError("後処理プールが起動していません")
+                future = executor.submit(_run_command, cmd, temp_output, output)
+        except BrokenProcessPool as e:
+            self._release(None, executor)
+            raise PostprocessError(f"後処理のワーカープロセスが異常終了しました: {e}")
+        except Exception:
+            self._release(None, executor)
+            raise
+        future.add_done_callback(lambda future: self._release(future, executor))
+        return future
+
+    def shutdown(self, timeout=None):
+        """実行中の後処理をtimeout秒まで待ち、終わらなければワーカープロセスを終了させる"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._slots.notify_all()
+        if executor is None:
+            return
+        deadline = None if timeout is None else time.time() + timeout
+        with self._slots:
+            self._slots.wait_for(
+                lambda: self._pending == 0,
+                None if deadline is None else max(0, deadline - time.time())
+            )
+            remaining = self._pending
+        if remaining:
+            logger.info(f"実行中の後処理を中断します: {remaining}件")
+            # ProcessPoolExecutorには実行中の処理を止める手段がないため、ワーカープロセスを終了させる
+            for process in list((getattr(executor, '_processes', None) or {}).values()):
+                process.terminate()
+        executor.shutdown(wait=not remaining, cancel_futures=True)
+        logger.info("後処理プールを停止しました")
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                self._stats,
+                workers=self.workers,
+                max_pending=self.max_pending,
+                pending=self._pending,
+                running=self.running
+            )
+
+    def _create_executor(self):
+        # 起動済みのスレッドを引き継がないようにspawnでプロセスを生成する
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=spawn_context(),
+            initializer=_init_worker
+        )
+
+    def _release(self, future, executor):
+        broken = False
+        with self._slots:
+            self._pending -= 1
+            if future is not None and not future.cancelled():
+                error = future.exception()
+                broken = isinstance(error, BrokenProcessPool)
+                if error is None:
+                    result = future.result()
+                    self._stats['completed'] += 1
+                    self._stats['wall_seconds'] += result['wall_seconds']
+                    self._stats['cpu_seconds'] += (result['cpu_user_seconds'] or 0) + (result['cpu_system_seconds'] or 0)
+                else:
+                    self._stats['failed'] += 1
+            self._slots.notify_all()
+        if broken:
+            self._restart(executor)
+
+    def _restart(self, broken):
+        """異常終了したプロセスを含むプールを作り直し、現在のプールを返す（停止中・作り直し済みなら作り直さない）"""
+        with self._lock:
+            if self._executor is not broken:
+                return self._executor
+            self._executor = self._create_executor()
+            self._stats['restarts'] += 1
+            executor = self._executor
+        broken.shutdown(wait=False)
+        logger.warning("ワーカープロセスが異常終了したため後処理プールを作り直しました")
+        return executor
+
+
+def chain(future, func):
+    """完了したfutureをfuncに渡し、その戻り値（または例外）を結果とするFutureを返す"""
+    chained = Future()
+
+    def done(source):
+        try:
+            chained.set_result(func(source))
+        except BaseException as e:
+            chained.set_exception(e)
+
+    future.add_done_callback(done)
+    return chained
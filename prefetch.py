@@ -0,0 +1,222 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+logger = logging.getLogger(__name__)
+
+PREFETCH_QUEUED = 'queued'
+PREFETCH_RUNNING = 'running'
+PREFETCH_DONE = 'done'
+PREFETCH_FAILED = 'failed'
+PREFETCH_CANCELLED = 'cancelled'
+
+
+# ストリームURLの識別キー
+def stream_key(url):
+    """署名などが異なっても同じ動画・同じフォーマットのURLを同一視するキーを返す"""
+    parsed = urlparse(url)
+    if parsed.hostname and parsed.hostname.endswith('.googlevideo.com'):
+        query = parse_qs(parsed.query)
+        if 'id' in query and 'itag' in query:
+            return f"googlevideo:{query['id'][0]}:{query['itag'][0]}:{query.get('clen', [''])[0]}"
+    return url
+
+
+# 先読みが取り消された
+class PrefetchCancelled(Exception):
+    pass
+
+
+class PrefetchTask:
+    """1本の動画の先読み（メタデータ・フォーマット・ストリーム先頭）"""
+
+    def __init__(self, key, url, params):
+        self.key = key
+        self.url = url
+        self.params = params
+        self.state = PREFETCH_QUEUED
+        self.created_at = time.time()
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def check(self):
+        """取り消されていればPrefetchCancelledを送出する（各段階の合間に呼ぶ）"""
+        if self._cancelled.is_set():
+            raise PrefetchCancelled()
+
+    def to_dict(self):
+        return {
+            "key": self.key,
+            "url": self.url,
+            "state": self.state,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "result": self.result,
+            "error": self.error
+        }
+
+
+class PrefetchManager:
+    """ユーザーがダウンロードする前に、閲覧中の動画の情報を低優先度で取得しておく"""
+
+    def __init__(self, resolver, max_pending=4, head_budget=32 * 1024 * 1024, ttl=1800,
+                 busy=None, history_size=32):
+        self.resolver = resolver  # resolver(task, manager)が取得処理を行う
+        self.max_pending = max_pending
+        self.head_budget = head_budget  # 先読みしたストリーム先頭の合計バイト数の上限
+        self.ttl = ttl
+        self.busy = busy  # 他の処理が混んでいる間はTrueを返す（その間は先読みを始めない）
+        self.history_size = history_size
+        self._tasks = OrderedDict()
+        self._pending = OrderedDict()
+        self._heads = OrderedDict()
+        self._head_bytes = 0
+        self._condition = threading.Condition()
+        self._worker = None
+        self._stats = {"submitted": 0, "deduplicated": 0, "dropped": 0, "head_hits": 0, "head_misses": 0}
+
+    def configure(self, max_pending=None, head_budget=None, ttl=None):
+        with self._condition:
+            if max_pending is not None:
+                self.max_pending = max_pending
+            if head_budget is not None:
+                self.head_budget = head_budget
+                self._evict_heads_locked()
+            if ttl is not None:
+                self.ttl = ttl
+
+    def submit(self, key, url, params):
+        """先読みを予約する（同じキーが予約済み・取得済みならそのタスクを返す）"""
+        with self._condition:
+            task = self._tasks.get(key)
+            if task is not None and task.state in (PREFETCH_QUEUED, PREFETCH_RUNNING) or \
+               task is not None and task.state == PREFETCH_DONE and time.time() - task.finished_at < self.ttl:
+                self._stats["deduplicated"] += 1
+                return task
+
+            task = PrefetchTask(key, url, params)
+            self._tasks[key] = task
+            self._tasks.move_to_end(key)
+            self._pending[key] = task
+            self._stats["submitted"] += 1
+            # 予約数の上限を超えたら古い予約から捨てる（閲覧中の動画を優先する）
+            while len(self._pending) > self.max_pending:
+                _, dropped = self._pending.popitem(last=False)
+                dropped._cancelled.set()
+                dropped.state = PREFETCH_CANCELLED
+                self._stats["dropped"] += 1
+            self._trim_history_locked()
+            self._ensure_worker_locked()
+            self._condition.notify()
+            return task
+
+    def cancel(self, key):
+        """先読みを取り消す（実行中の場合は次の段階に進む前に中断する）"""
+        with self._condition:
+            task = self._tasks.get(key)
+            if task is None or task.state not in (PREFETCH_QUEUED, PREFETCH_RUNNING):
+                return False
+            task._cancelled.set()
+            if self._pending.pop(key, None) is not None:
+                task.state = PREFETCH_CANCELLED
+            return True
+
+    def get(self, key):
+        with self._condition:
+            return self._tasks.get(key)
+
+    def store_head(self, url, data, total):
+        """ストリームの先頭部分を保持する（上限を超える分は古いものから捨てる）"""
+        with self._condition:
+            if len(data) > self.head_budget:
+                return False
+            key = stream_key(url)
+            old = self._heads.pop(key, None)
+            if old is not None:
+                self._head_bytes -= len(old[0])
+            self._heads[key] = (data, total, time.time() + self.ttl)
+            self._head_bytes += len(data)
+            self._evict_heads_locked()
+            return True
+
+    def take_head(self, url):
+        """先読み済みのストリーム先頭を取り出す（(データ, 全体サイズ)、なければNone）"""
+        with self._condition:
+            entry = self._heads.pop(stream_key(url), None)
+            if entry is None:
+                self._stats["head_misses"] += 1
+                return None
+            data, total, expires_at = entry
+            self._head_bytes -= len(data)
+            if expires_at < time.time():
+                self._stats["head_misses"] += 1
+                return None
+            self._stats["head_hits"] += 1
+            return data, total
+
+    def stats(self):
+        with self._condition:
+            states = {}
+            for task in self._tasks.values():
+                states[task.state] = states.get(task.state, 0) + 1
+            return dict(
+                self._stats,
+                pending=len(self._pending),
+                tasks_by_state=states,
+                head_entries=len(self._heads),
+                head_bytes=self._head_bytes,
+                head_budget=self.head_budget
+            )
+
+    def _evict_heads_locked(self):
+        while self._head_bytes > self.head_budget and self._heads:
+            _, (data, _, _) = self._heads.popitem(last=False)
+            self._head_bytes -= len(data)
+
+    def _trim_history_locked(self):
+        for key in list(self._tasks):
+            if len(self._tasks) <= self.history_size:
+                break
+            if self._tasks[key].state not in (PREFETCH_QUEUED, PREFETCH_RUNNING):
+                del self._tasks[key]
+
+    def _ensure_worker_locked(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name='prefetch', daemon=True)
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                # 新しい予約（現在閲覧中の動画）から処理する
+                key, task = self._pending.popitem(last=True)
+                task.state = PREFETCH_RUNNING
+
+            # ダウンロードなどの処理が詰まっている間は待つ
+            while self.busy is not None and self.busy() and not task.cancelled:
+                time.sleep(0.5)
+
+            try:
+                task.check()
+                task.result = self.resolver(task, self)
+                state = PREFETCH_DONE
+                logger.info(f"先読みが完了しました: {key}")
+            except PrefetchCancelled:
+                state = PREFETCH_CANCELLED
+                logger.info(f"先読みを取り消しました: {key}")
+            except Exception as e:
+                state = PREFETCH_FAILED
+                task.error = str(e)
+                logger.warning(f"先読みに失敗しました: {key}: {e}")
+            task.finished_at = time.time()
+            task.state = state
@@ -8,27 +8,57 @@ import shutil
 import re
 import io
 import codecs
-import requests
 from datetime import datetime
-from flask import Flask, request, jsonify, send_file, abort
+from flask import Flask, Response, request, jsonify, send_file, abort, g
 from flask_cors import CORS
 import threading
 import time
 import atexit
+import tempfile
+import glob
+import signal
+import argparse
+from contextlib import contextmanager
+from concurrent.futures import CancelledError
+from concurrent.futures.process import BrokenProcessPool
+from metadata_cache import MetadataCache, canonical_video_key
+from format_index import FormatIndex
+from job_queue import JobQueue, JobError, JOB_FINISHED
+from download_progress import (
+    PROGRESS_TEMPLATE, POSTPROCESS_TEMPLATE, FILEPATH_TEMPLATE, parse_output_path, parse_output_paths, run_with_progress
+)
+from stream_fetch import StreamFetcher
+from stream_remux import RemuxError, remux_streaming, streaming_supported
+from toolchain import ToolchainRegistry
+from config_store import ConfigStore
+from aria2_rpc import Aria2Daemon, Aria2Error, aria2c_split_options
+from batch_download import BatchManager
+from ytdlp_engine import ExtractorPool, ExtractionFailed, EngineUnavailable
+from prefetch import PrefetchManager
+from serving import SERVER_BACKENDS, DEFAULT_SERVE_OPTIONS, create_server
+from media_library import MediaLibrary
+from job_journal import JobJournal
+from bandwidth import BandwidthScheduler, FixedRateFollower, LANES, LANE_INTERACTIVE, LANE_BULK
+from metrics import MetricsRegistry, ThroughputMeter, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from tracing import Tracer, RequestIdFilter, REQUEST_ID_HEADER, valid_request_id, format_waterfall
+from log_pipeline import LogPipeline, summarize_output
+from extractor_output import INFO_FIELDS, ExtractorOutputError, info_template, read_json
+from postprocess import (
+    PostprocessPool, PostprocessError, STAGE_AUDIO, STAGE_MERGE,
+    build_audio_command, build_merge_command, metadata_args, temp_path, chain
+)
 
 # コンソール出力のエンコーディングを設定
 sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
 sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
 
-# ロギング設定
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("server.log", encoding='utf-8'),
-        logging.StreamHandler(stream=sys.stdout)  # 明示的にstdoutを使用
-    ]
-)
+# ロギング設定（ファイル・stdoutへの書き込みはバックグラウンドのスレッドで行う。設定はon_startupで反映）
+log_pipeline = LogPipeline(
+    "server.log",
+    log_format='%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s',
+    # 各行にリクエストIDを付けて、同じリクエストのログをまとめて追えるようにする
+    filters=[RequestIdFilter()]
+).start()
 logger = logging.getLogger(__name__)
 
 # アプリケーション初期化
@@ -41,6 +71,12 @@ CONFIG_FILE = os.path.join(BASE_DIR, 'config.json')
 YTDLP_PATH = os.path.join(BASE_DIR, 'yt-dlp')
 if platform.system() == 'Windows':
     YTDLP_PATH += '.exe'
+CACHE_DIR = os.path.join(BASE_DIR, 'cache')
+
+# ベンチマークなどでは実行ファイル・設定・キャッシュの場所を環境変数で差し替える
+YTDLP_PATH = os.environ.get('YTDL_YTDLP_PATH') or YTDLP_PATH
+CONFIG_FILE = os.environ.get('YTDL_CONFIG_FILE') or CONFIG_FILE
+CACHE_DIR = os.environ.get('YTDL_CACHE_DIR') or CACHE_DIR
 
 # デフォルト設定 - ユーザーディレクトリに直接保存するよう変更
 DEFAULT_CONFIG = {
@@ -48,9 +84,233 @@ DEFAULT_CONFIG = {
     "default_resolution": "best",
     "default_format": "mp4",
     "auto_update": True,
-    "last_update_check": None
+    "last_update_check": None,
+    "metadata_cache_ttl": 1800,  # 秒（ストリームURLの有効期限より短くする）
+    "metadata_cache_size": 128,
+    "metadata_cache_disk": True,
+    "download_workers": 4,  # 全体の同時ダウンロード数
+    "download_host_limit": 3,  # ホスト（サイト）ごとの同時ダウンロード数
+    "progress_events_per_second": 4,
+    "event_stream_limit": 4,  # 同時に配信するイベントストリーム（SSE）の上限（--threadsより小さくし、超えた分は503でポーリングに切り替えさせる）
+    "merge_chunk_size": 1048576,  # 1 MiB
+    "merge_segment_size": 4194304,  # Rangeセグメントの初期サイズ（4 MiB）
+    "merge_connections": 4,  # 1ストリームあたりの同時接続数
+    "merge_streaming": True,  # 一時ファイルを使わずにffmpegへ直接流し込む
+    "use_aria2c": True,  # yt-dlpの外部ダウンローダーとしてaria2cを使用
+    "aria2c_connections": 16,  # サーバーあたりの接続数（最大16）
+    "aria2c_split": 16,  # 1ファイルの分割数
+    "aria2c_min_split_size": "1M",  # 分割する最小サイズ
+    "aria2c_rpc": False,  # /mergeの取得を常駐aria2c（JSON-RPC）で行う
+    "extractor_engine": "auto",  # auto: ライブラリがあれば常駐プロセスで取得 / subprocess: 常に実行ファイルを使用
+    "extractor_workers": 2,  # 情報取得用の常駐プロセス数
+    "reuse_info_json": True,  # 取得済みの動画情報をダウンロード時に再利用（--load-info-json）
+    "prefetch_enabled": True,  # 視聴中の動画の情報を事前に取得する（/prefetch）
+    "prefetch_max_pending": 4,  # 先読みの予約数の上限（超えたら古い予約から破棄）
+    "prefetch_head_bytes": 1048576,  # ストリームごとに先読みする先頭のバイト数（0で無効）
+    "prefetch_budget_bytes": 33554432,  # 先読みしたストリーム先頭の合計の上限（32 MiB）
+    "media_library": True,  # ダウンロード済みのファイルを記録し、同じ要求には再ダウンロードせずに返す
+    "job_journal": True,  # ジョブをジャーナルに記録し、再起動後に中断したダウンロードを再開する
+    "shutdown_drain_timeout": 10,  # 終了時に実行中のダウンロードの完了を待つ秒数（超えたら中断して次回再開）
+    "bandwidth_limit": 0,  # 全体の帯域の上限（バイト/秒、0で無制限）
+    "bandwidth_bulk_limit": 0,  # 時間帯の外での一括ダウンロードの合計の上限（バイト/秒、0で無制限）
+    "bandwidth_interactive_weight": 4,  # 待っている転送に一括ダウンロードの何倍の帯域を配分するか
+    "bandwidth_bulk_windows": [],  # 一括ダウンロードを全速で行う時間帯（例: ["01:00-07:00"]）
+    "trace_enabled": True,  # リクエストごとの処理段階の所要時間を記録する（/debug/trace/<request_id>）
+    "trace_export": True,  # 記録したスパンをJSON Linesでファイルに書き出す
+    "trace_file_max_bytes": 10485760,  # トレースのファイルの上限（超えたら.1に移す）
+    "log_level": "INFO",
+    "log_levels": {},  # モジュールごとのログレベル（例: {"werkzeug": "WARNING", "job_queue": "DEBUG"}）
+    "log_max_bytes": 10485760,  # server.logを切り替える大きさ
+    "log_backup_count": 5,  # 残す古いログファイルの数
+    "log_rotate_interval": 86400,  # server.logを切り替える間隔（秒、0で時間では切り替えない）
+    "log_max_message_chars": 4000,  # 1件のログメッセージの上限（超えた分は省略する）
+    "postprocess_pool": True,  # 結合・MP3への変換をダウンロードとは別のプロセスで行う（取得は後処理を待たずに次へ進む）
+    "postprocess_workers": 0,  # 後処理の同時実行数（0でCPUのコア数）
+    "postprocess_max_pending": 0  # 後処理の待機・実行中の上限（0でワーカー数の2倍。達するとダウンロードが待つ）
+}
+
+# 外部ツール（ffmpeg, ffprobe, aria2c, yt-dlp）の検出結果
+toolchain = ToolchainRegistry(
+    explicit_paths={'yt-dlp': YTDLP_PATH},
+    search_dirs=[
+        os.path.join(BASE_DIR, 'ffmpeg', 'ffmpeg-master-latest-win64-gpl', 'bin'),
+        os.path.join(BASE_DIR, 'aria2c', 'aria2-1.36.0-win-64bit-build1')
+    ]
+)
+
+# 動画メタデータのキャッシュディレクトリ
+METADATA_CACHE_DIR = os.path.join(CACHE_DIR, 'metadata')
+
+# 動画メタデータ(-J)のキャッシュ（設定はon_startupで反映）
+metadata_cache = MetadataCache(
+    max_entries=DEFAULT_CONFIG['metadata_cache_size'],
+    ttl=DEFAULT_CONFIG['metadata_cache_ttl']
+)
+
+# ダウンロード済みファイルのライブラリ
+MEDIA_LIBRARY_PATH = os.path.join(CACHE_DIR, 'library.sqlite3')
+media_library = MediaLibrary(MEDIA_LIBRARY_PATH)
+
+# リクエストごとのトレース（設定はon_startupで反映）
+TRACE_FILE_PATH = os.path.join(CACHE_DIR, 'traces.jsonl')
+tracer = Tracer()
+
+# ジョブのジャーナル（on_startupで開いて前回のジョブを復元する）
+JOB_JOURNAL_PATH = os.path.join(CACHE_DIR, 'jobs.journal.jsonl')
+job_journal = JobJournal(JOB_JOURNAL_PATH)
+
+# 転送の帯域の配分（設定はon_startupで反映）
+bandwidth_scheduler = BandwidthScheduler()
+
+# ダウンロードジョブのキュー（ワーカーはon_startupで起動）
+job_queue = JobQueue(
+    workers=DEFAULT_CONFIG['download_workers'],
+    host_limit=DEFAULT_CONFIG['download_host_limit']
+)
+
+# 複数URL・再生リストの一括ダウンロード
+batch_manager = BatchManager(job_queue, YTDLP_PATH, on_spawn=lambda program: subprocess_spawns.inc(program=program))
+
+# yt-dlpをライブラリとして使う情報取得プロセス（起動はon_startupで行う）
+extractor_pool = ExtractorPool(workers=DEFAULT_CONFIG['extractor_workers'])
+
+# ffmpegによる後処理のプロセス（起動はapply_configで行う）
+postprocess_pool = PostprocessPool()
+
+# 視聴中の動画の先読み（ダウンロードのジョブが待機している間は開始しない）
+prefetch_manager = PrefetchManager(
+    lambda task, manager: prefetch_video(task, manager),
+    max_pending=DEFAULT_CONFIG['prefetch_max_pending'],
+    head_budget=DEFAULT_CONFIG['prefetch_budget_bytes'],
+    ttl=DEFAULT_CONFIG['metadata_cache_ttl'],
+    busy=lambda: job_queue.stats()['queued'] > 0
+)
+
+# 常駐aria2c（aria2c_rpcが有効な場合に初回使用時に起動）
+aria2_daemon = None
+aria2_daemon_lock = threading.Lock()
+
+# メトリクス（/metricsでPrometheusのテキスト形式で公開する）
+metrics = MetricsRegistry()
+http_requests = metrics.counter(
+    'ytdl_http_requests_total', 'エンドポイントごとのリクエスト数', ('endpoint', 'method', 'status')
+)
+http_latency = metrics.histogram(
+    'ytdl_http_request_duration_seconds', 'エンドポイントごとの応答時間（秒）', ('endpoint', 'method')
+)
+stage_duration = metrics.histogram(
+    'ytdl_stage_duration_seconds', '処理段階ごとの所要時間（秒）', ('stage',)
+)
+subprocess_spawns = metrics.counter(
+    'ytdl_subprocess_spawns_total', '起動した外部プロセスの数', ('program',)
+)
+transfer_bytes = metrics.counter(
+    'ytdl_transfer_bytes_total', '転送したバイト数', ('source',)
+)
+transfer_meter = ThroughputMeter()
+metrics.gauge(
+    'ytdl_transfer_throughput_bytes_per_second', '直近の転送速度（バイト/秒）', collect=transfer_meter.rate
+)
+metrics.gauge(
+    'ytdl_jobs', '状態ごとのダウンロードジョブ数', ('state',),
+    collect=lambda: job_metrics()
+)
+metrics.gauge(
+    'ytdl_active_transfers', '帯域の割り当てを受けている転送の数', ('lane',),
+    collect=lambda: active_transfer_metrics()
+)
+metrics.gauge(
+    'ytdl_event_streams', '配信中のイベントストリーム（SSE）の数', collect=lambda: event_streams['active']
+)
+metrics.gauge(
+    'ytdl_prefetch_pending', '待機中の先読みの数', collect=lambda: prefetch_manager.stats()['pending']
+)
+postprocess_cpu = metrics.counter(
+    'ytdl_postprocess_cpu_seconds_total', '後処理プールで実行したffmpegのCPU時間（秒）', ('stage', 'mode')
+)
+postprocess_wait = metrics.histogram(
+    'ytdl_postprocess_submit_wait_seconds', '後処理プールの空きを待った時間（秒）'
+)
+metrics.gauge(
+    'ytdl_postprocess_pending', '後処理プールで待機・実行中の処理の数', collect=lambda: postprocess_pool.stats()['pending']
+)
+
+# yt-dlpの後処理名と処理段階の対応
+POSTPROCESS_STAGES = {
+    'FFmpegMerger': 'ffmpeg_merge',
+    'EmbedThumbnail': 'thumbnail_embed',
+    'FFmpegExtractAudio': 'audio_extract'
 }
 
+def job_metrics():
+    stats = job_queue.stats()
+    return {('queued',): stats['queued'], ('running',): stats['running']}
+
+def active_transfer_metrics():
+    allocations = bandwidth_scheduler.stats()['allocations']
+    return {(lane,): sum(1 for allocation in allocations if allocation['lane'] == lane) for lane in LANES}
+
+# 転送量の記録
+def record_transfer(source, nbytes):
+    if nbytes > 0:
+        transfer_bytes.inc(nbytes, source=source)
+        transfer_meter.record(nbytes)
+
+# プロセス内の転送の読み取り量を記録してから帯域の制限を適用する
+def metered_throttle(source, throttle):
+    def consume(nbytes):
+        record_transfer(source, nbytes)
+        throttle(nbytes)
+    return consume
+
+# yt-dlpの後処理の所要時間の記録
+def record_postprocess(name, seconds):
+    stage_name = POSTPROCESS_STAGES.get(name, f"postprocess_{name.lower()}")
+    stage_duration.observe(seconds, stage=stage_name)
+    tracer.record(stage_name, seconds, postprocessor=name)
+
+# 後処理プールで実行した処理の所要時間とCPU時間の記録
+def record_postprocess_usage(name, usage):
+    stage_duration.observe(usage['wall_seconds'], stage=name)
+    cpu = {}
+    for mode in ('user', 'system'):
+        seconds = usage[f'cpu_{mode}_seconds']
+        if seconds is not None:
+            postprocess_cpu.inc(seconds, stage=name, mode=mode)
+            cpu[f'cpu_{mode}'] = round(seconds, 3)
+    tracer.record(name, usage['wall_seconds'], engine='postprocess_pool', **cpu)
+
+# 後処理プールへの投入（空きがなければ待つ）
+def submit_postprocess_command(cmd, temp_output=None, output=None):
+    with postprocess_wait.time():
+        future = postprocess_pool.submit(cmd, temp_output, output)
+    subprocess_spawns.inc(program='ffmpeg')
+    return future
+
+# 後処理プールの結果の取得（ワーカープロセスの異常終了も後処理の失敗として扱う）
+def postprocess_usage(future):
+    try:
+        return future.result()
+    except (BrokenProcessPool, CancelledError) as e:
+        raise PostprocessError(f"後処理のワーカープロセスが終了しました: {e or type(e).__name__}")
+
+# 処理段階の計測（トレースのスパンとメトリクスの両方に記録する）
+@contextmanager
+def stage(name, **attributes):
+    with tracer.span(name, **attributes) as span, stage_duration.time(stage=name):
+        yield span
+
+# 外部プロセスの実行の計測
+@contextmanager
+def subprocess_span(program, **attributes):
+    subprocess_spawns.inc(program=program)
+    with tracer.span(f"subprocess:{program}", **attributes) as span:
+        yield span
+
+# yt-dlpによる情報取得の失敗
+class ExtractorError(Exception):
+    pass
+
 # ファイル名のサニタイズ関数
 def sanitize_filename(filename):
     """ファイル名から不正な文字を除去する"""
@@ -61,53 +321,48 @@ def sanitize_filename(filename):
     # 前後の空白を削除
     return sanitized.strip()
 
+# 設定ストア（メモリ上に保持し、ファイルが更新された場合のみ読み直す）
+config_store = ConfigStore(CONFIG_FILE, DEFAULT_CONFIG, create_if_missing=True)
+
 # 設定の読み込み
 def load_config():
-    try:
-        if os.path.exists(CONFIG_FILE):
-            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                config = json.load(f)
-                # デフォルト設定にある項目で、読み込んだ設定にないものはデフォルト値を使用
-                for key, value in DEFAULT_CONFIG.items():
-                    if key not in config:
-                        config[key] = value
-                return config
-        else:
-            # 設定ファイルがない場合はデフォルト設定を保存して返す
-            save_config(DEFAULT_CONFIG)
-            return DEFAULT_CONFIG.copy()
-    except Exception as e:
-        logger.error(f"設定ファイルの読み込み中にエラーが発生しました: {e}")
-        return DEFAULT_CONFIG.copy()
+    # デフォルト設定にある項目で、読み込んだ設定にないものはデフォルト値を使用
+    return config_store.get()
+
+# ダウンロードパスの存在確認と作成
+def ensure_download_path(config):
+    download_path = config.get('download_path', DEFAULT_CONFIG['download_path'])
+    if not os.path.exists(download_path):
+        os.makedirs(download_path, exist_ok=True)
+        logger.info(f"ダウンロードパスを作成しました: {download_path}")
 
 # 設定の保存
 def save_config(config):
     try:
         # 保存前にダウンロードパスの存在確認と作成
-        download_path = config.get('download_path', DEFAULT_CONFIG['download_path'])
-        if not os.path.exists(download_path):
-            os.makedirs(download_path, exist_ok=True)
-            logger.info(f"ダウンロードパスを作成しました: {download_path}")
-        
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False, indent=4)
-        return True
+        ensure_download_path(config)
+        return config_store.save(config)
     except Exception as e:
         logger.error(f"設定ファイルの保存中にエラーが発生しました: {e}")
         return False
 
+# 設定の一部を更新（読み込みから書き込みまでを排他的に行う）
+def update_config_values(changes):
+    try:
+        if 'download_path' in changes:
+            ensure_download_path(changes)
+        return config_store.update(changes)
+    except Exception as e:
+        logger.error(f"設定ファイルの保存中にエラーが発生しました: {e}")
+        return None
+
 # FFmpegが利用可能かチェックし、必要に応じてインストール
+@tracer.traced()
 def check_ffmpeg():
-    try:
-        result = subprocess.run(['ffmpeg', '-version'], 
-                               stdout=subprocess.PIPE, 
-                               stderr=subprocess.PIPE, 
-                               text=True)
-        if result.returncode == 0:
-            logger.info("FFmpegが利用可能です")
-            return True
-    except:
-        logger.warning("FFmpegが見つかりません。自動インストールを試みます...")
+    # 検出結果はキャッシュされ、実行ファイルが更新された場合のみ再確認する
+    if toolchain.get('ffmpeg').available:
+        return True
+    logger.warning("FFmpegが見つかりません。自動インストールを試みます...")
         
     try:
         # Windows用FFmpegのダウンロードと設置
@@ -134,7 +389,7 @@ def check_ffmpeg():
             os.remove(zip_path)
             
             logger.info("FFmpegのインストールが完了しました")
-            return True
+            return toolchain.get('ffmpeg', refresh=True).available
         else:
             logger.error("自動インストールはWindowsのみサポートしています")
             return False
@@ -144,16 +399,9 @@ def check_ffmpeg():
 
 # aria2cが利用可能かチェックし、必要に応じてインストール
 def check_aria2c():
-    try:
-        result = subprocess.run(['aria2c', '--version'], 
-                               stdout=subprocess.PIPE, 
-                               stderr=subprocess.PIPE, 
-                               text=True)
-        if result.returncode == 0:
-            logger.info("aria2cが利用可能です")
-            return True
-    except:
-        logger.warning("aria2cが見つかりません。自動インストールを試みます...")
+    if toolchain.get('aria2c').available:
+        return True
+    logger.warning("aria2cが見つかりません。自動インストールを試みます...")
         
     try:
         # Windows用aria2cのダウンロードと設置
@@ -180,7 +428,7 @@ def check_aria2c():
             os.remove(zip_path)
             
             logger.info("aria2cのインストールが完了しました")
-            return True
+            return toolchain.get('aria2c', refresh=True).available
         else:
             logger.error("自動インストールはWindowsのみサポートしています")
             return False
@@ -199,22 +447,22 @@ def check_and_update_ytdlp():
     if last_check is None or (current_time - last_check) > 86400:  # 86400秒 = 1日
         try:
             logger.info("yt-dlpの更新をチェックしています...")
-            update_result = subprocess.run(
-                [YTDLP_PATH, '-U'],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                check=False
-            )
+            with subprocess_span('yt-dlp', args='-U'):
+                update_result = subprocess.run(
+                    [YTDLP_PATH, '-U'],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    text=True,
+                    check=False
+                )
             
             if "up to date" in update_result.stdout or "up-to-date" in update_result.stdout:
                 logger.info("yt-dlpは最新です。")
             else:
-                logger.info(f"yt-dlpを更新しました。結果: {update_result.stdout}")
+                logger.info(f"yt-dlpを更新しました。結果: {summarize_output(update_result.stdout)}")
             
             # 最終更新確認時刻を更新
-            config['last_update_check'] = current_time
-            save_config(config)
+            update_config_values({'last_update_check': current_time})
             
             return True, update_result.stdout
         except Exception as e:
@@ -224,109 +472,186 @@ def check_and_update_ytdlp():
         logger.info("前回の更新確認から24時間経過していないため、スキップします。")
         return True, "前回の更新確認から24時間経過していないため、スキップします。"
 
-# 利用可能なフォーマットをチェック
-def list_available_formats(url):
-    """利用可能な解像度・フォーマットの一覧を取得"""
-    cmd = [
-        YTDLP_PATH,
-        '-F',
-        '--no-warnings',
-        url
-    ]
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    if result.returncode == 0:
-        logger.info(f"利用可能なフォーマット:\n{result.stdout}")
-    return result.stdout
+# 動画メタデータの取得（キャッシュ経由）
+@tracer.traced()
+def get_video_metadata(url):
+    """yt-dlpの動画情報（INFO_FIELDSの項目）をキャッシュ経由で取得する"""
+    key = canonical_video_key(url)
+    video_info = metadata_cache.get(key)
+    tracer.annotate(video=key, cache='hit' if video_info is not None else 'miss')
+    if video_info is not None:
+        logger.info(f"メタデータキャッシュを使用します: {key}")
+        return video_info
+
+    with stage('info_probe') as span:
+        video_info = None
+        if extractor_pool.running:
+            # 常駐プロセスの初期化済みYoutubeDLで取得（失敗した場合は実行ファイルで再試行）
+            span.set(engine='extractor_pool')
+            try:
+                video_info = extractor_pool.extract_info(url, fields=INFO_FIELDS)
+            except (ExtractionFailed, EngineUnavailable) as e:
+                logger.warning(f"yt-dlpエンジンでの取得に失敗したため、実行ファイルで再試行します: {e}")
+
+        if video_info is None:
+            span.set(engine='subprocess')
+            # 必要な項目だけをyt-dlpに1行のJSONとして出力させ、1行ずつ読み取る（-Jの全体を保持しない）
+            with subprocess_span('yt-dlp', args='-O') as process_span:
+                try:
+                    video_info = read_json(
+                        [YTDLP_PATH, '-O', info_template(INFO_FIELDS), '--no-warnings', '--no-playlist', url],
+                        fields=INFO_FIELDS
+                    )
+                except ExtractorOutputError as e:
+                    process_span.set(returncode=e.returncode)
+                    raise ExtractorError(str(e))
+                process_span.set(returncode=0)
+
+    metadata_cache.put(key, video_info)
+    logger.info(f"メタデータを取得しました: {key} (フォーマット数: {len(video_info.get('formats') or [])})")
+    return video_info
+
+# フォーマットインデックスの取得（動画情報ごとに一度だけ構築）
+def get_format_index(url):
+    """キャッシュされた-J結果からフォーマットインデックスを取得する"""
+    video_info = get_video_metadata(url)
+    
+    def build():
+        with stage('format_probe'):
+            return FormatIndex(video_info.get('formats'))
+    
+    return metadata_cache.get_derived(canonical_video_key(url), 'format_index', build)
 
 # 指定した解像度に最も近いフォーマットIDを選択する関数
-def select_format_id_by_resolution(formats_output, target_resolution, format_type):
+@tracer.traced()
+def select_format_id_by_resolution(format_index, target_resolution, format_type):
     """指定した解像度に最も近いフォーマットIDを選択"""
     if target_resolution == 'best':
         return None  # 'best'の場合はフォーマット文字列で指定するためNoneを返す
     
     # 解像度の数値部分を取得
     target_height = int(target_resolution.replace('p', ''))
-    best_format_id = None
-    best_height = 0
-    best_codec = None
-    
-    # 利用可能なフォーマットから解像度とフォーマットタイプに一致するものを探す
-    for line in formats_output.split('\n'):
-        # 不要な行はスキップ
-        if not re.match(r'^\d+\s', line):
-            continue
-        
-        # フォーマットIDと情報を抽出
-        parts = line.split()
-        if len(parts) < 3:
-            continue
-        
-        format_id = parts[0]
-        
-        # 拡張子が一致するか確認
-        format_ext = parts[1] if len(parts) > 1 else ""
-        if format_type == 'webm' and format_ext != 'webm':
-            continue
-        if format_type == 'mp4' and format_ext != 'mp4':
-            continue
-        
-        # 映像のみのフォーマットかチェック
-        if 'video only' not in line:
-            continue
-        
-        # 解像度を抽出 (例: 1920x1080, 640x360)
-        res_match = re.search(r'(\d+)x(\d+)', line)
-        if not res_match:
-            continue
-        
-        width = int(res_match.group(1))
-        height = int(res_match.group(2))
-        
-        # コーデック情報を抽出
-        codec_match = re.search(r'(av01|vp9|avc1)', line.lower())
-        codec = codec_match.group(1) if codec_match else "unknown"
-        
-        # 指定解像度以下で最大のものを選択
-        # AV1 > VP9 > H.264の優先順位で選択
-        if height <= target_height:
-            # 今までの最適な高さより大きい場合は更新
-            if height > best_height:
-                best_height = height
-                best_format_id = format_id
-                best_codec = codec
-            # 同じ高さの場合はコーデックの優先度で判定
-            elif height == best_height:
-                if (best_codec != "av01" and codec == "av01") or \
-                   (best_codec not in ["av01", "vp9"] and codec == "vp9"):
-                    best_format_id = format_id
-                    best_codec = codec
-    
-    if best_format_id:
-        logger.info(f"選択したフォーマットID: {best_format_id} (解像度: {best_height}p, コーデック: {best_codec})")
-        return best_format_id
+    
+    # 指定解像度以下で最大のもの、同じ高さならAV1 > VP9 > H.264の優先順位で選択
+    ext = format_type if format_type in ('mp4', 'webm') else None
+    entry = format_index.select(target_height, ext)
+    
+    if entry:
+        logger.info(f"選択したフォーマットID: {entry.format_id} (解像度: {entry.height}p, コーデック: {entry.codec})")
+        return entry.format_id
     
     logger.warning(f"指定解像度 {target_resolution} に適合するフォーマットが見つかりませんでした")
     return None
 
 # YouTubeビデオから利用可能な解像度のリストを取得
-def get_available_resolutions(formats_output):
+@tracer.traced()
+def get_available_resolutions(format_index):
     """YouTubeビデオから利用可能な解像度のリストを取得する"""
-    try:
-        # 出力から解像度を抽出
-        resolutions = set()
-        for line in formats_output.split('\n'):
-            # 解像度を含む行を探す (例: "137 mp4 1920x1080 1080p 4359k...")
-            match = re.search(r'(\d+)x(\d+)\s+(\d+)p', line)
-            if match:
-                resolutions.add(int(match.group(3)))  # 解像度値（例：1080）
-        
-        # 数値としてソート
-        res_list = sorted(list(resolutions), reverse=True)
-        logger.info(f"利用可能な解像度: {', '.join([f'{r}p' for r in res_list])}")
-        return res_list
-    except Exception as e:
-        logger.error(f"解像度リストの取得中にエラーが発生しました: {e}")
+    res_list = format_index.resolutions
+    logger.info(f"利用可能な解像度: {', '.join([f'{r}p' for r in res_list])}")
+    return res_list
+
+# 解像度・フォーマットに対応するストリームを選択
+def select_stream_entries(format_index, resolution, format_type):
+    """ダウンロード時に使われる映像・音声のフォーマットを返す"""
+    if format_type == 'mp3':
+        audio = format_index.best_audio()
+        return [audio] if audio else []
+    ext = format_type if format_type in ('mp4', 'webm') else None
+    target_height = int(resolution.replace('p', '')) if resolution != 'best' else sys.maxsize
+    video = format_index.select(target_height, ext)
+    if video is None:
         return []
+    # 同じコンテナの音声がなければ、再エンコードせずに格納できる他の形式の音声を使う
+    # （なければ空にして、yt-dlpのフォーマット指定と後処理に任せる）
+    audio = format_index.best_audio('m4a' if format_type == 'mp4' else format_type) or \
+        format_index.best_audio(container=format_type)
+    return [video, audio] if audio else []
+
+# ライブラリに記録するストリームの情報
+def describe_streams(format_index, resolution, format_type):
+    """ダウンロードされる映像・音声のコーデックとフォーマットIDを返す"""
+    streams = select_stream_entries(format_index, resolution, format_type)
+    codec = 'mp3' if format_type == 'mp3' else '+'.join(
+        entry.vcodec if entry.has_video else entry.acodec for entry in streams
+    )
+    return {
+        "codec": codec or None,
+        "format_id": '+'.join(entry.format_id for entry in streams) or None
+    }
+
+# 先読みのキー
+def prefetch_key(url, resolution, format_type):
+    return f"{canonical_video_key(url)}:{resolution}:{format_type}"
+
+# 動画の先読み（先読みスレッド上で実行）
+def prefetch_video(task, manager):
+    """メタデータ・フォーマットインデックス・ストリームの先頭を取得してキャッシュしておく"""
+    url = task.url
+    resolution = task.params['resolution']
+    format_type = task.params['format']
+    
+    # /info・/download・/formatsはこのキャッシュを使用する
+    video_info = get_video_metadata(url)
+    task.check()
+    format_index = get_format_index(url)
+    streams = select_stream_entries(format_index, resolution, format_type)
+    
+    # ストリームの先頭を取得しておき、/mergeの最初の書き込みをすぐに始められるようにする
+    config = load_config()
+    head_bytes = config.get('prefetch_head_bytes', DEFAULT_CONFIG['prefetch_head_bytes'])
+    prefetched = 0
+    if head_bytes > 0:
+        fetcher = StreamFetcher(connections=1)
+        for entry in streams:
+            task.check()
+            stream_url = entry.url
+            if not stream_url or entry.protocol not in ('http', 'https'):
+                continue
+            head = fetcher.fetch_head(stream_url, head_bytes)
+            if head is not None:
+                record_transfer('prefetch', len(head[0]))
+                if manager.store_head(stream_url, *head):
+                    prefetched += len(head[0])
+    
+    return {
+        "title": video_info.get('title'),
+        "available_resolutions": format_index.resolutions,
+        "format_ids": [entry.format_id for entry in streams],
+        "head_bytes": prefetched
+    }
+
+# エンドポイントごとのリクエスト数・応答時間の記録
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    # クライアントが指定したリクエストIDがあればそれをトレースのIDにする
+    request_id = request.headers.get(REQUEST_ID_HEADER)
+    rule = request.url_rule.rule if request.url_rule is not None else request.path
+    g.trace = tracer.start_trace(
+        f"{request.method} {rule}",
+        trace_id=request_id if valid_request_id(request_id) else None
+    )
+
+@app.after_request
+def record_request_metrics(response):
+    # URLのパラメータ（ジョブIDなど）ごとに系列が増えないようにルートの定義で集計する
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    http_requests.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    started = g.get('request_started')
+    if started is not None:
+        http_latency.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method)
+    trace = g.get('trace')
+    if trace is not None and trace.trace_id:
+        trace.set(status=response.status_code)
+        response.headers[REQUEST_ID_HEADER] = trace.trace_id
+    return response
+
+@app.teardown_request
+def finish_request_trace(error=None):
+    trace = g.pop('trace', None)
+    if trace is not None:
+        trace.finish(error=error)
 
 # メインのルート
 @app.route('/')
@@ -343,25 +668,19 @@ def ping():
 @app.route('/version')
 def get_version():
     try:
-        result = subprocess.run(
-            [YTDLP_PATH, '--version'],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            check=False
-        )
+        # yt-dlpの更新（-U）で実行ファイルが変わった場合のみ再確認される
+        tool = toolchain.get('yt-dlp')
         
-        if result.returncode == 0:
-            version = result.stdout.strip()
+        if tool.available:
             return jsonify({
                 "status": "success",
-                "yt_dlp_version": version,
+                "yt_dlp_version": tool.version,
                 "server_version": "1.0.0"
             })
         else:
             return jsonify({
                 "status": "error",
-                "message": f"yt-dlpバージョンの取得に失敗しました: {result.stderr}"
+                "message": f"yt-dlpバージョンの取得に失敗しました: {tool.path or YTDLP_PATH}"
             }), 500
     except Exception as e:
         logger.error(f"バージョン情報の取得中にエラーが発生しました: {e}")
@@ -405,21 +724,17 @@ def get_config():
 @app.route('/config', methods=['POST'])
 def update_config():
     try:
-        config = load_config()
         data = request.json
         
-        # 受け取ったデータでconfigを更新
-        if 'download_path' in data:
-            config['download_path'] = data['download_path']
-        if 'default_resolution' in data:
-            config['default_resolution'] = data['default_resolution']
-        if 'default_format' in data:
-            config['default_format'] = data['default_format']
-        if 'auto_update' in data:
-            config['auto_update'] = data['auto_update']
-        
-        # 設定を保存
-        if save_config(config):
+        # 受け取ったデータで更新する項目を抽出
+        changes = {}
+        for key in ('download_path', 'default_resolution', 'default_format', 'auto_update'):
+            if key in data:
+                changes[key] = data[key]
+        
+        # 設定を保存（同時リクエストでも更新が失われないよう排他的に反映）
+        config = update_config_values(changes)
+        if config is not None:
             return jsonify({
                 "status": "success",
                 "message": "設定を更新しました。",
@@ -450,60 +765,41 @@ def get_video_info():
                 "message": "URLが指定されていません。"
             }), 400
         
-        # yt-dlpで動画情報を取得
-        result = subprocess.run(
-            [YTDLP_PATH, '-J', '--no-warnings', url],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            check=False
-        )
-        
-        if result.returncode != 0:
-            logger.error(f"動画情報の取得に失敗しました: {result.stderr}")
+        # yt-dlpで動画情報を取得（キャッシュ経由）
+        try:
+            video_info = get_video_metadata(url)
+        except ExtractorError as e:
+            logger.error(f"動画情報の取得に失敗しました: {e}")
             return jsonify({
                 "status": "error",
-                "message": f"動画情報の取得に失敗しました: {result.stderr}"
+                "message": f"動画情報の取得に失敗しました: {e}"
             }), 500
-        
-        # 動画情報をJSONとしてパース
-        try:
-            video_info = json.loads(result.stdout)
-            
-            # 必要な情報だけを抽出
-            simplified_info = {
-                "title": video_info.get("title", "不明なタイトル"),
-                "description": video_info.get("description", ""),
-                "thumbnail": video_info.get("thumbnail", ""),
-                "duration": video_info.get("duration", 0),
-                "upload_date": video_info.get("upload_date", ""),
-                "uploader": video_info.get("uploader", "不明なアップローダー"),
-                "view_count": video_info.get("view_count", 0),
-                "available_formats": []
-            }
-            
-            # 利用可能なフォーマットを簡略化
-            formats = video_info.get("formats", [])
-            resolution_set = set()
-            
-            for fmt in formats:
-                if fmt.get("vcodec") != "none" and fmt.get("height") is not None:
-                    resolution = fmt.get("height")
-                    resolution_set.add(resolution)
-            
-            # 解像度を数値として並べ替え
-            simplified_info["available_resolutions"] = sorted(list(resolution_set), reverse=True)
-            
-            return jsonify({
-                "status": "success",
-                "video_info": simplified_info
-            })
         except json.JSONDecodeError as e:
             logger.error(f"動画情報のJSONパースに失敗しました: {e}")
             return jsonify({
                 "status": "error",
                 "message": f"動画情報のJSONパースに失敗しました: {str(e)}"
             }), 500
+        
+        # 必要な情報だけを抽出
+        simplified_info = {
+            "title": video_info.get("title", "不明なタイトル"),
+            "description": video_info.get("description", ""),
+            "thumbnail": video_info.get("thumbnail", ""),
+            "duration": video_info.get("duration", 0),
+            "upload_date": video_info.get("upload_date", ""),
+            "uploader": video_info.get("uploader", "不明なアップローダー"),
+            "view_count": video_info.get("view_count", 0),
+            "available_formats": []
+        }
+        
+        # 利用可能な解像度（数値の降順）
+        simplified_info["available_resolutions"] = get_format_index(url).resolutions
+        
+        return jsonify({
+            "status": "success",
+            "video_info": simplified_info
+        })
             
     except Exception as e:
         logger.error(f"動画情報の取得中にエラーが発生しました: {e}")
@@ -512,7 +808,577 @@ def get_video_info():
             "message": f"動画情報の取得中にエラーが発生しました: {str(e)}"
         }), 500
 
-# 動画のダウンロード - 修正バージョン（フォーマットIDを直接指定）
+# aria2cの分割ダウンロード設定
+def get_aria2c_options(config):
+    """設定から接続数・分割数・最小分割サイズを取得する"""
+    return aria2c_split_options(
+        config.get('aria2c_connections', DEFAULT_CONFIG['aria2c_connections']),
+        config.get('aria2c_split', DEFAULT_CONFIG['aria2c_split']),
+        config.get('aria2c_min_split_size', DEFAULT_CONFIG['aria2c_min_split_size'])
+    )
+
+# yt-dlpに外部ダウンローダーとしてaria2cを指定する引数
+def build_aria2c_args(config):
+    """aria2cが利用可能で有効な場合のみ、--downloaderの引数を返す"""
+    if not config.get('use_aria2c', DEFAULT_CONFIG['use_aria2c']):
+        return []
+    aria2c_path = toolchain.path('aria2c')
+    if not aria2c_path:
+        return []
+    options = get_aria2c_options(config)
+    downloader_args = ' '.join([
+        f"-x {options['max-connection-per-server']}",
+        f"-s {options['split']}",
+        f"-k {options['min-split-size']}"
+    ])
+    return [
+        '--downloader', aria2c_path,
+        '--downloader', 'm3u8:native',  # HLSはyt-dlp内蔵のダウンローダーを使用
+        '--downloader-args', f'aria2c:{downloader_args}'
+    ]
+
+# 帯域の割り当てに従って常駐aria2cで取得
+def aria2_fetcher(daemon, allocation):
+    """割り当ての変更をaria2c（aria2.changeOption）に反映しながら取得する関数を返す"""
+    def fetch_files(targets):
+        gids = []
+        
+        def apply_rate(rate):
+            # 割り当てを同時に取得するファイルで等分する
+            if not gids:
+                return
+            limit = str(rate // len(gids)) if rate else '0'
+            for gid in gids:
+                daemon.change_option(gid, {'max-download-limit': limit})
+        
+        options = {'max-download-limit': str(allocation.rate // len(targets)) if allocation.rate else '0'}
+        allocation.on_change(apply_rate)
+        result = daemon.download_files(targets, options, on_start=gids.extend)
+        # 転送中の量は取得できないため、完了したファイルの大きさを記録する
+        record_transfer('aria2c', sum(os.path.getsize(path) for _, path in targets if os.path.exists(path)))
+        return result
+    return fetch_files
+
+# 常駐aria2cを取得
+def get_aria2_daemon(config):
+    """JSON-RPCで制御する常駐aria2cを返す（未起動なら起動する）"""
+    global aria2_daemon
+    with aria2_daemon_lock:
+        if aria2_daemon is None:
+            aria2c_path = toolchain.path('aria2c')
+            if not aria2c_path:
+                raise Aria2Error("aria2cが見つかりません")
+            aria2_daemon = Aria2Daemon(aria2c_path, get_aria2c_options(config))
+        if aria2_daemon.running:
+            return aria2_daemon
+        with subprocess_span('aria2c', args='--enable-rpc'):
+            aria2_daemon.start()
+        return aria2_daemon
+
+# yt-dlpのダウンロードコマンドを構築
+@tracer.traced()
+def build_download_command(url, file_path, resolution, format_type, format_index, info_json=None, postprocess=None):
+    """解像度・フォーマットに応じたyt-dlpのコマンドを組み立てる（postprocess指定時は取得のみ）"""
+    if postprocess is not None:
+        # 結合・変換は後処理プールで行うため、選択したフォーマットを個別のファイルとして取得するだけにする
+        base = os.path.splitext(file_path)[0].replace('%', '%%')
+        cmd = [
+            YTDLP_PATH,
+            '-f', ','.join(postprocess['format_ids']),
+            '--no-playlist',
+            '--no-warnings',
+            '--write-thumbnail',  # サムネイルも保存（MP3では後処理で埋め込む）
+            '-o', f"{base}.f%(format_id)s.%(ext)s",
+            '-o', f"thumbnail:{base}.%(ext)s",
+            url
+        ]
+    # MP3の場合は音声のみ
+    elif format_type == 'mp3':
+        cmd = [
+            YTDLP_PATH,
+            '-f', 'bestaudio',
+            '-x', '--audio-format', 'mp3',
+            '--audio-quality', '0',
+            '--add-metadata',  # メタデータを追加
+            '--embed-thumbnail',  # サムネイルを埋め込む
+            '-o', file_path,
+            '--no-playlist',
+            '--no-warnings',
+            url
+        ]
+    else:
+        # 具体的なフォーマットIDを取得
+        format_id = select_format_id_by_resolution(format_index, resolution, format_type)
+        
+        if format_id and resolution != 'best':
+            # フォーマットIDが見つかった場合は直接指定
+            if format_type == 'mp4':
+                cmd = [
+                    YTDLP_PATH,
+                    '-f', f'{format_id}+bestaudio[ext=m4a]/bestaudio',
+                    '--merge-output-format', 'mp4',
+                    '--no-playlist',
+                    '--no-warnings',
+                    '--add-metadata',  # メタデータを追加
+                    '--write-thumbnail',  # サムネイルも保存
+                    '-o', file_path,
+                    url
+                ]
+            elif format_type == 'webm':
+                cmd = [
+                    YTDLP_PATH,
+                    '-f', f'{format_id}+bestaudio[ext=webm]/bestaudio',
+                    '--merge-output-format', 'webm',
+                    '--no-playlist',
+                    '--no-warnings',
+                    '--ignore-errors',  # エラーを無視して処理を続行
+                    '--add-metadata',  # メタデータを追加
+                    '--write-thumbnail',  # サムネイルも保存
+                    '-o', file_path,
+                    url
+                ]
+        else:
+            # フォーマットIDが見つからない場合やbestの場合は一般的なフォーマット指定
+            if format_type == 'mp4':
+                # 最高解像度のMP4
+                cmd = [
+                    YTDLP_PATH,
+                    '-f', 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
+                    '--merge-output-format', 'mp4',
+                    '--no-playlist',
+                    '--no-warnings',
+                    '--add-metadata',
+                    '--write-thumbnail',
+                    '-o', file_path,
+                    url
+                ]
+            elif format_type == 'webm':
+                # 最高解像度のWebM
+                cmd = [
+                    YTDLP_PATH,
+                    '-f', 'bestvideo[ext=webm]+bestaudio[ext=webm]/bestvideo+bestaudio/best',
+                    '--merge-output-format', 'webm',
+                    '--no-playlist',
+                    '--no-warnings',
+                    '--ignore-errors',
+                    '--add-metadata',
+                    '--write-thumbnail',
+                    '-o', file_path,
+                    url
+                ]
+    
+    # 進捗を1行ずつ機械可読な形式で出力させる
+    # 最終的な保存先も出力させる（--printは--quietを伴うため--progressで進捗を出力し続ける）
+    cmd[1:1] = [
+        '--newline', '--progress', '--progress-template', PROGRESS_TEMPLATE,
+        '--progress-template', POSTPROCESS_TEMPLATE,
+        '--print', FILEPATH_TEMPLATE
+    ]
+    
+    # 複数接続で取得するためにaria2cを外部ダウンローダーとして使用
+    cmd[1:1] = build_aria2c_args(load_config())
+    
+    # PATH外で検出したFFmpegもyt-dlpから使えるようにする
+    ffmpeg_path = toolchain.path('ffmpeg')
+    if ffmpeg_path:
+        cmd[1:1] = ['--ffmpeg-location', ffmpeg_path]
+    
+    # 取得済みの動画情報を渡して、yt-dlp側での情報の再取得を省略する
+    if info_json:
+        cmd[-1:] = ['--load-info-json', info_json]
+    return cmd
+
+# ダウンロード用に動画情報をファイルへ書き出す
+def write_info_json(video_info):
+    """--load-info-jsonに渡す一時ファイルを作成してパスを返す"""
+    fd, path = tempfile.mkstemp(prefix='ytdl-info-', suffix='.info.json')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(video_info, f, ensure_ascii=False)
+    return path
+
+# ダウンロードジョブの優先度
+def download_lane(params):
+    """指定がなければ一括ダウンロードのジョブはbulk、それ以外はinteractiveにする"""
+    lane = params.get('priority')
+    if lane in LANES:
+        return lane
+    return LANE_BULK if params.get('batch_id') else LANE_INTERACTIVE
+
+# 速度制限の指定
+def apply_rate_limit(cmd, rate):
+    """yt-dlpのコマンドに速度制限を設定する（aria2cを使う場合もyt-dlpから引き継がれる）"""
+    cmd = list(cmd)
+    if '--limit-rate' in cmd:
+        index = cmd.index('--limit-rate')
+        del cmd[index:index + 2]
+    if rate:
+        cmd[1:1] = ['--limit-rate', str(rate)]
+    return cmd
+
+# yt-dlpによるダウンロードの実行
+def run_ytdlp_download(job, cmd):
+    """帯域の割り当てを受けてyt-dlpを実行する
+
+    --limit-rateは起動後に変更できないため、割り当てが大きく変わったらyt-dlpを終了させ、
+    新しい割り当てで途中のファイルの続きから取得し直す（FixedRateFollower）。
+    """
+    downloaded = [0]
+    current = [None]
+    
+    def on_progress(progress):
+        # 転送量の増分をメトリクスに反映してからジョブの進捗を更新する
+        # （再起動後は途中のファイルの大きさから数え直されるため減った分は数えない）
+        record_transfer('ytdlp', max(0, progress['downloaded_bytes'] - downloaded[0]))
+        downloaded[0] = max(downloaded[0], progress['downloaded_bytes'])
+        job.update_progress(progress)
+    
+    def on_start(process):
+        current[0] = process
+        job.attach_process(process)
+    
+    def restart():
+        process = current[0]
+        if process is not None and process.poll() is None:
+            process.terminate()
+    
+    lane = download_lane(job.params)
+    stdout = []
+    with bandwidth_scheduler.allocate(lane, name=f"job:{job.id}") as allocation, \
+            stage('download', lane=lane) as download_span:
+        # 割り当ての登録までに合流したリクエストで優先度が上がっていれば反映する
+        bandwidth_scheduler.set_lane(allocation.name, download_lane(job.params))
+        follower = FixedRateFollower(allocation, restart)
+        try:
+            restarts = 0
+            while True:
+                rate = follower.start_rate()
+                with subprocess_span('yt-dlp', rate=rate) as span:
+                    result = run_with_progress(apply_rate_limit(cmd, rate), on_progress, on_start,
+                                               on_postprocess=record_postprocess)
+                    span.set(returncode=result[0], downloaded_bytes=result[3]['downloaded_bytes'])
+                stdout.append(result[1])
+                if result[0] == 0 or not follower.requested or job.interrupted:
+                    break
+                restarts += 1
+                if '--continue' not in cmd:
+                    cmd = [cmd[0], '--continue', *cmd[1:]]
+        finally:
+            follower.close()
+        download_span.set(restarts=restarts)
+    # 保存先の出力は再起動の前後に分かれるため、すべての実行の出力をまとめて返す
+    return result[0], ''.join(stdout), result[2], result[3]
+
+# 途中まで取得したファイル
+def find_partial_files(file_path):
+    """保存先に対応するyt-dlp・aria2cの途中のファイル（.part, .ytdl, .aria2）を返す"""
+    base = glob.escape(os.path.splitext(file_path)[0])
+    candidates = glob.glob(base + '.*')
+    return sorted(
+        path for path in candidates
+        if '.part' in os.path.basename(path) or path.endswith(('.ytdl', '.aria2'))
+    )
+
+# 中断したダウンロードの再開コマンド
+def build_resume_command(cmd, url):
+    """記録したコマンドを再開用にする（一時ファイルの動画情報は残っていないためURLから取得し直す）"""
+    cmd = list(cmd)
+    cmd[0] = YTDLP_PATH
+    if '--load-info-json' in cmd:
+        index = cmd.index('--load-info-json')
+        cmd[index:index + 2] = [url]
+    # 途中のファイルの続きから取得する（yt-dlpの既定だが明示しておく）
+    cmd[1:1] = ['--continue']
+    return cmd
+
+# ダウンロード結果
+def build_download_result(file_path, title, resolution, format_type, transfer, cached=False):
+    """/downloadとジョブの結果の形式にする"""
+    file_url = f"file:///{file_path.replace(os.sep, '/')}"
+    return {
+        "status": "success",
+        "url": file_url,
+        "title": title,
+        "ext": os.path.splitext(file_path)[1][1:],
+        "file_path": file_path,
+        "resolution": resolution,
+        "format": format_type,
+        "transfer": transfer,
+        "cached": cached  # ダウンロードせずにライブラリのファイルを返した
+    }
+
+# ライブラリに記録済みのファイルを探す
+@tracer.traced()
+def find_in_library(url, resolution, format_type):
+    """同じ動画・解像度・フォーマットのファイルが残っていれば結果を返す（なければNone）"""
+    if not load_config().get('media_library', DEFAULT_CONFIG['media_library']):
+        return None
+    entry = media_library.lookup(canonical_video_key(url), format_type, resolution)
+    if entry is None:
+        return None
+    logger.info(f"ダウンロード済みのファイルを返します: {entry['path']}")
+    return build_download_result(entry['path'], entry['title'], resolution, format_type, None, cached=True)
+
+# ダウンロードジョブの実行
+def run_download_job(job):
+    """ジョブキューのワーカー上でyt-dlpによるダウンロードを実行する"""
+    with tracer.span('download_job', job_id=job.id, resumed=job.resumed,
+                     queued_seconds=round(job.started_at - job.created_at, 3) if job.started_at else None):
+        return perform_download(job)
+
+def perform_download(job):
+    url = job.params['url']
+    resolution = job.params.get('resolution', 'best')
+    format_type = job.params.get('format', 'mp4')
+    
+    # ダウンロード済みであれば情報の取得もせずに返す
+    if not job.params.get('force'):
+        result = find_in_library(url, resolution, format_type)
+        if result is not None:
+            return result
+    
+    checkpoint = job.checkpoint_data
+    plan = checkpoint.get('postprocess')
+    if plan and plan.get('inputs') and all(os.path.exists(path) for path in plan['inputs']):
+        # 取得を終えて後処理の完了前に中断した場合は後処理だけをやり直す
+        logger.info(f"中断した後処理を再開します: {plan['output']}")
+        return submit_postprocess(job, plan, checkpoint['title'], checkpoint.get('library') or {}, None)
+    if checkpoint.get('command'):
+        # 前回中断したダウンロードを同じコマンド・同じ保存先で再開する（.partファイルの続きから取得）
+        file_path = checkpoint['file_path']
+        video_title = checkpoint['title']
+        library_info = checkpoint.get('library') or {}
+        cmd = build_resume_command(checkpoint['command'], url)
+        partial_bytes = sum(os.path.getsize(path) for path in find_partial_files(file_path))
+        logger.info(f"中断したダウンロードを再開します: {file_path}（取得済み: {partial_bytes} bytes）")
+        returncode, stdout, stderr, progress = run_ytdlp_download(job, cmd)
+    else:
+        # 動画情報（キャッシュ経由）からフォーマットとコーデック情報を取得
+        try:
+            video_info = get_video_metadata(url)
+        except ExtractorError as e:
+            raise JobError(f"動画情報の取得に失敗しました: {e}")
+        format_index = get_format_index(url)
+        
+        # 利用可能な解像度を取得して表示
+        available_resolutions = get_available_resolutions(format_index)
+        
+        # ユーザーのダウンロードディレクトリを取得
+        download_path = os.path.expanduser("~")
+        
+        # サニタイズされたファイル名を生成
+        video_title = sanitize_filename(video_info.get('title', 'video'))
+        file_path = os.path.join(download_path, f"{video_title}.{format_type}")
+        library_info = describe_streams(format_index, resolution, format_type)
+        plan = plan_postprocess(video_info, format_index, resolution, format_type, file_path)
+        
+        info_json = None
+        if load_config().get('reuse_info_json', DEFAULT_CONFIG['reuse_info_json']):
+            info_json = write_info_json(video_info)
+        try:
+            cmd = build_download_command(url, file_path, resolution, format_type, format_index, info_json, plan)
+            
+            # 中断しても同じコマンド・同じ保存先で再開できるようにジャーナルに記録
+            job.checkpoint(command=cmd, file_path=file_path, title=video_title, library=library_info, postprocess=plan)
+            
+            # コマンドを出力（デバッグ用）
+            logger.info(f"実行コマンド: {' '.join(cmd)}")
+            
+            # ダウンロードの実行（進捗を1行ずつ読み取ってジョブに反映）
+            returncode, stdout, stderr, progress = run_ytdlp_download(job, cmd)
+            if returncode != 0 and info_json and not job.interrupted:
+                # ストリームURLの期限切れなどで失敗した場合はURLから取得し直す
+                logger.warning(f"取得済みの動画情報でのダウンロードに失敗したため、URLから再試行します: {summarize_output(stderr)}")
+                cmd = build_download_command(url, file_path, resolution, format_type, format_index, postprocess=plan)
+                job.checkpoint(command=cmd)
+                returncode, stdout, stderr, progress = run_ytdlp_download(job, cmd)
+        finally:
+            if info_json:
+                os.remove(info_json)
+    if job.interrupted:
+        # 次回起動時に続きから取得できるよう、途中まで取得したファイルの場所を記録しておく
+        job.checkpoint(partial_files=find_partial_files(file_path))
+        raise JobError("ダウンロードを中断しました")
+    if returncode != 0:
+        logger.error(f"ダウンロードに失敗しました: {summarize_output(stderr)}")
+        raise JobError(f"ダウンロードに失敗しました: {stderr}")
+    
+    # ダウンロード結果を詳細に出力
+    logger.info(f"ダウンロード結果: {summarize_output(stdout)}")
+    logger.info(
+        f"転送量: {progress['downloaded_bytes']:.0f} bytes, "
+        f"所要時間: {progress['elapsed']:.1f}秒, 平均速度: {progress['average_speed'] / 1024:.0f} KiB/s"
+    )
+    
+    if plan is not None:
+        # 取得したファイルを後処理プールに渡し、このワーカーは次のダウンロードに進む
+        plan = dict(plan, inputs=find_fetched_files(stdout, plan), thumbnail=find_thumbnail(plan['output']))
+        job.checkpoint(postprocess=plan)
+        return submit_postprocess(job, plan, video_title, library_info, progress)
+    
+    # yt-dlpが出力した最終的な保存先を使用（出力されなかった場合は指定したパスから探す）
+    output_path = parse_output_path(stdout)
+    if output_path and os.path.exists(output_path):
+        file_path = output_path
+    elif not os.path.exists(file_path):
+        logger.warning(f"指定パス {file_path} にファイルが見つかりません。別の名前で保存された可能性があります。")
+        
+        # 拡張子違いのファイルを探す
+        dir_name = os.path.dirname(file_path)
+        base_name = os.path.splitext(os.path.basename(file_path))[0]
+        
+        # 拡張子リスト
+        extensions = ['mp4', 'webm', 'mkv', 'mp3', 'm4a']
+        
+        for ext in extensions:
+            alt_path = os.path.join(dir_name, f"{base_name}.{ext}")
+            if os.path.exists(alt_path):
+                logger.info(f"別の拡張子で見つかりました: {alt_path}")
+                file_path = alt_path
+                break
+        else:
+            raise JobError("ダウンロードファイルが見つかりません")
+    
+    return complete_download(url, file_path, video_title, resolution, format_type, library_info, progress)
+
+# ダウンロードの完了（ライブラリへの記録と結果の作成）
+def complete_download(url, file_path, video_title, resolution, format_type, library_info, progress):
+    # 次回以降の同じ要求に備えてライブラリに記録
+    if load_config().get('media_library', DEFAULT_CONFIG['media_library']):
+        try:
+            media_library.record(
+                canonical_video_key(url), format_type, resolution, file_path,
+                codec=library_info.get('codec'),
+                format_id=library_info.get('format_id'),
+                title=video_title
+            )
+        except Exception as e:
+            logger.warning(f"ライブラリへの記録に失敗しました: {e}")
+    
+    # ファイルURLを生成して結果を返す
+    return build_download_result(file_path, video_title, resolution, format_type, progress)
+
+# 後処理プールで行う後処理の内容
+def plan_postprocess(video_info, format_index, resolution, format_type, file_path):
+    """取得するフォーマットと後処理の内容を返す（yt-dlpに後処理まで任せる場合はNone）"""
+    if not postprocess_pool.running or not load_config().get('postprocess_pool', DEFAULT_CONFIG['postprocess_pool']):
+        return None
+    streams = select_stream_entries(format_index, resolution, format_type)
+    if not streams:
+        return None
+    return {
+        "stage": STAGE_AUDIO if format_type == 'mp3' else STAGE_MERGE,
+        "output": file_path,
+        "format_ids": [entry.format_id for entry in streams],
+        "metadata": metadata_args(video_info)
+    }
+
+# フォーマットごとに保存されたファイル
+def find_fetched_files(stdout, plan):
+    """yt-dlpが出力した保存先をフォーマットの指定順（映像・音声）に並べて返す"""
+    paths = parse_output_paths(stdout)
+    inputs = []
+    for format_id in plan['format_ids']:
+        path = next((path for path in paths if f".f{format_id}." in os.path.basename(path)), None)
+        if path is None or not os.path.exists(path):
+            raise JobError(f"ダウンロードファイルが見つかりません: {format_id}")
+        inputs.append(path)
+    return inputs
+
+# 保存されたサムネイル
+def find_thumbnail(file_path):
+    base = os.path.splitext(file_path)[0]
+    for ext in ('jpg', 'webp', 'png', 'jpeg'):
+        if os.path.exists(f"{base}.{ext}"):
+            return f"{base}.{ext}"
+    return None
+
+# 後処理プールへの後処理の投入
+def submit_postprocess(job, plan, video_title, library_info, progress):
+    """後処理をプールに投入し、完了したらジョブの結果を返すFutureを返す（空きがなければ空くまで待つ）"""
+    url = job.params['url']
+    resolution = job.params.get('resolution', 'best')
+    format_type = job.params.get('format', 'mp4')
+    ffmpeg = toolchain.path('ffmpeg') or 'ffmpeg'
+    output = plan['output']
+    temp_output = temp_path(output)
+    if plan['stage'] == STAGE_AUDIO:
+        cmd = build_audio_command(ffmpeg, plan['inputs'][0], temp_output, plan['metadata'], plan.get('thumbnail'))
+    else:
+        cmd = build_merge_command(ffmpeg, plan['inputs'], temp_output, plan['metadata'])
+    job.update_progress(dict(job.progress or {}, stage='postprocess'))
+    try:
+        future = submit_postprocess_command(cmd, temp_output, output)
+    except PostprocessError as e:
+        raise JobError(f"後処理を開始できませんでした: {e}")
+    logger.info(f"後処理を投入しました: {plan['stage']} {output}")
+    
+    def finish(future):
+        try:
+            usage = postprocess_usage(future)
+        except PostprocessError as e:
+            logger.error(f"後処理に失敗しました: {summarize_output(str(e))}")
+            raise JobError(f"後処理に失敗しました: {e}")
+        record_postprocess_usage(plan['stage'], usage)
+        logger.info(
+            f"後処理が完了しました: {output}（所要時間: {usage['wall_seconds']:.1f}秒, "
+            f"CPU時間: {(usage['cpu_user_seconds'] or 0) + (usage['cpu_system_seconds'] or 0):.1f}秒）"
+        )
+        # 取得したファイルを削除する（MP3に埋め込んだサムネイルも削除し、動画の場合は従来どおり残す）
+        leftovers = list(plan['inputs'])
+        if plan['stage'] == STAGE_AUDIO and plan.get('thumbnail'):
+            leftovers.append(plan['thumbnail'])
+        for path in leftovers:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        return complete_download(url, output, video_title, resolution, format_type, library_info, progress)
+    
+    # 完了時の処理も投入したリクエストのコンテキスト（ログのリクエストID・トレース）で行う
+    # （ワーカーがまだコンテキストに入っている間に完了する場合があるため複製して使う）
+    return chain(future, lambda future: job.context.copy().run(finish, future))
+
+# 同じ動画・解像度・フォーマットのダウンロードは1件にまとめる（同じファイルへの同時書き込みも防ぐ）
+def download_dedupe_key(params):
+    return (
+        canonical_video_key(params['url']),
+        params.get('resolution', 'best'),
+        params.get('format', 'mp4')
+    )
+
+# 合流したリクエストの優先度の反映
+def raise_download_priority(job, params):
+    """合流したリクエストの方が優先度が高ければ既存のジョブの優先度を引き上げる（LANESは優先度の高い順）"""
+    lane = download_lane(params)
+    if LANES.index(lane) >= LANES.index(download_lane(job.params)):
+        return
+    if not job_queue.update_params(job, priority=lane):
+        return
+    # 待機中のジョブは開始時に、実行中のジョブは帯域の割り当てから（yt-dlpの再起動で）反映する
+    bandwidth_scheduler.set_lane(f"job:{job.id}", lane)
+    logger.info(f"合流したリクエストに合わせてジョブの優先度を引き上げました: {job.id} ({lane})")
+
+# force=trueは再ダウンロードの指定のため合流しないが、同じファイルに同時に書き込まないよう
+# 実行中・待機中の同じダウンロードが完了してから実行する
+job_queue.register(
+    'download', run_download_job,
+    dedupe_key=download_dedupe_key,
+    on_duplicate=raise_download_priority,
+    rerun_duplicate=lambda params: bool(params.get('force'))
+)
+
+# ジョブの結果をレスポンスに変換
+def job_result_response(job):
+    """完了したジョブを従来の/downloadと同じ形式のレスポンスにする"""
+    if job.state == JOB_FINISHED:
+        return jsonify(dict(job.result, job_id=job.id))
+    return jsonify({
+        "status": "error",
+        "job_id": job.id,
+        "message": job.error or "ジョブがキャンセルされました"
+    }), 500
+
+# 動画のダウンロード（ジョブキューに投入して即座にジョブIDを返す）
 @app.route('/download', methods=['POST'])
 def download_video():
     try:
@@ -527,6 +1393,7 @@ def download_video():
         url = data.get('url')
         resolution = data.get('resolution', 'best')
         format_type = data.get('format', 'mp4')
+        priority = data.get('priority', LANE_INTERACTIVE)
         
         logger.info(f"リクエスト: URL={url}, 解像度={resolution}, フォーマット={format_type}")
         
@@ -536,152 +1403,37 @@ def download_video():
                 "message": "URLが指定されていません。"
             }), 400
         
-        # 利用可能なフォーマットとコーデック情報を取得
-        format_output = list_available_formats(url)
-        
-        # 利用可能な解像度を取得して表示
-        available_resolutions = get_available_resolutions(format_output)
-        
-        # ユーザーのダウンロードディレクトリを取得
-        download_path = os.path.expanduser("~")
-        
-        # サニタイズされたファイル名を生成
-        info_cmd = [YTDLP_PATH, '-j', '--no-warnings', url]
-        info_result = subprocess.run(info_cmd, capture_output=True, text=True)
-        if info_result.returncode != 0:
+        if format_type not in ('mp4', 'webm', 'mp3'):
             return jsonify({
                 "status": "error",
-                "message": f"動画情報の取得に失敗しました: {info_result.stderr}"
-            }), 500
-            
-        video_info = json.loads(info_result.stdout)
-        video_title = sanitize_filename(video_info.get('title', 'video'))
-        file_path = os.path.join(download_path, f"{video_title}.{format_type}")
+                "message": f"未対応のフォーマットです: {format_type}"
+            }), 400
         
-        # MP3の場合は音声のみ
-        if format_type == 'mp3':
-            cmd = [
-                YTDLP_PATH,
-                '-f', 'bestaudio',
-                '-x', '--audio-format', 'mp3',
-                '--audio-quality', '0',
-                '--add-metadata',  # メタデータを追加
-                '--embed-thumbnail',  # サムネイルを埋め込む
-                '-o', file_path,
-                '--no-playlist',
-                '--no-warnings',
-                url
-            ]
-        else:
-            # 具体的なフォーマットIDを取得
-            format_id = select_format_id_by_resolution(format_output, resolution, format_type)
-            
-            if format_id and resolution != 'best':
-                # フォーマットIDが見つかった場合は直接指定
-                if format_type == 'mp4':
-                    cmd = [
-                        YTDLP_PATH,
-                        '-f', f'{format_id}+bestaudio[ext=m4a]/bestaudio',
-                        '--merge-output-format', 'mp4',
-                        '--no-playlist',
-                        '--no-warnings',
-                        '--add-metadata',  # メタデータを追加
-                        '--write-thumbnail',  # サムネイルも保存
-                        '-o', file_path,
-                        url
-                    ]
-                elif format_type == 'webm':
-                    cmd = [
-                        YTDLP_PATH,
-                        '-f', f'{format_id}+bestaudio[ext=webm]/bestaudio',
-                        '--merge-output-format', 'webm',
-                        '--no-playlist',
-                        '--no-warnings',
-                        '--ignore-errors',  # エラーを無視して処理を続行
-                        '--add-metadata',  # メタデータを追加
-                        '--write-thumbnail',  # サムネイルも保存
-                        '-o', file_path,
-                        url
-                    ]
-            else:
-                # フォーマットIDが見つからない場合やbestの場合は一般的なフォーマット指定
-                if format_type == 'mp4':
-                    # 最高解像度のMP4
-                    cmd = [
-                        YTDLP_PATH,
-                        '-f', 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best',
-                        '--merge-output-format', 'mp4',
-                        '--no-playlist',
-                        '--no-warnings',
-                        '--add-metadata',
-                        '--write-thumbnail',
-                        '-o', file_path,
-                        url
-                    ]
-                elif format_type == 'webm':
-                    # 最高解像度のWebM
-                    cmd = [
-                        YTDLP_PATH,
-                        '-f', 'bestvideo[ext=webm]+bestaudio[ext=webm]/bestvideo+bestaudio/best',
-                        '--merge-output-format', 'webm',
-                        '--no-playlist',
-                        '--no-warnings',
-                        '--ignore-errors',
-                        '--add-metadata',
-                        '--write-thumbnail',
-                        '-o', file_path,
-                        url
-                    ]
-        
-        # コマンドを出力（デバッグ用）
-        logger.info(f"実行コマンド: {' '.join(cmd)}")
-        
-        # ダウンロードの実行
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        if result.returncode != 0:
-            logger.error(f"ダウンロードに失敗しました: {result.stderr}")
-            return jsonify({
-                "status": "error",
-                "message": f"ダウンロードに失敗しました: {result.stderr}"
-            }), 500
+        # ダウンロード済みのファイルが残っていればジョブを作らずに返す（force=trueで再ダウンロード）
+        if not data.get('force'):
+            result = find_in_library(url, resolution, format_type)
+            if result is not None:
+                return jsonify(result)
         
-        # ダウンロード結果を詳細に出力
-        logger.info(f"ダウンロード結果: {result.stdout}")
+        job = job_queue.submit('download', {
+            "url": url,
+            "resolution": resolution,
+            "format": format_type,
+            "force": bool(data.get('force')),
+            "priority": priority if priority in LANES else LANE_INTERACTIVE
+        })
         
-        # ファイルが存在するか確認
-        if not os.path.exists(file_path):
-            logger.warning(f"指定パス {file_path} にファイルが見つかりません。別の名前で保存された可能性があります。")
-            
-            # 拡張子違いのファイルを探す
-            dir_name = os.path.dirname(file_path)
-            base_name = os.path.splitext(os.path.basename(file_path))[0]
-            
-            # 拡張子リスト
-            extensions = ['mp4', 'webm', 'mkv', 'mp3', 'm4a']
-            
-            for ext in extensions:
-                alt_path = os.path.join(dir_name, f"{base_name}.{ext}")
-                if os.path.exists(alt_path):
-                    logger.info(f"別の拡張子で見つかりました: {alt_path}")
-                    file_path = alt_path
-                    break
-            else:
-                return jsonify({
-                    "status": "error",
-                    "message": "ダウンロードファイルが見つかりません"
-                }), 500
+        # wait=trueの場合は従来どおり完了まで待ってから結果を返す
+        if data.get('wait'):
+            job.wait()
+            return job_result_response(job)
         
-        # ファイルURLを生成してレスポンス
-        file_url = f"file:///{file_path.replace(os.sep, '/')}"
         return jsonify({
             "status": "success",
-            "url": file_url,
-            "title": video_title,
-            "ext": os.path.splitext(file_path)[1][1:],
-            "file_path": file_path,
-            "resolution": resolution,
-            "format": format_type
-        })
+            "job_id": job.id,
+            "state": job.state,
+            "attached": job.attached > 0  # 他のリクエストと同じジョブを共有している
+        }), 202
             
     except Exception as e:
         logger.error(f"ダウンロード処理中にエラーが発生しました: {e}")
@@ -692,42 +1444,224 @@ def download_video():
             "message": f"ダウンロード処理中にエラーが発生しました: {str(e)}"
         }), 500
 
-# 映像と音声を結合するエンドポイント
-@app.route('/merge', methods=['POST'])
-def merge_streams():
+# ジョブの状態を取得
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({
+            "status": "error",
+            "message": "指定されたジョブが見つかりません。"
+        }), 404
+    return jsonify({
+        "status": "success",
+        "job": job.to_dict()
+    })
+
+# 配信中のイベントストリーム（応答が続く間リクエスト処理のスレッドを使うため、スレッド数より少なく制限する）
+event_streams = {"active": 0, "threads": DEFAULT_SERVE_OPTIONS['threads']}
+event_streams_lock = threading.Lock()
+
+def acquire_event_stream():
+    limit = load_config().get('event_stream_limit', DEFAULT_CONFIG['event_stream_limit'])
+    # /pingや/statusに応答するスレッドを必ず残す
+    limit = max(1, min(int(limit), event_streams['threads'] - 1))
+    with event_streams_lock:
+        if event_streams['active'] >= limit:
+            return False
+        event_streams['active'] += 1
+        return True
+
+def release_event_stream():
+    with event_streams_lock:
+        event_streams['active'] -= 1
+
+# ジョブの進捗をServer-Sent Eventsで配信
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({
+            "status": "error",
+            "message": "指定されたジョブが見つかりません。"
+        }), 404
+    
+    # 上限を超えた場合、拡張機能は/jobs/<job_id>のポーリングに切り替える
+    if not acquire_event_stream():
+        return jsonify({
+            "status": "error",
+            "message": "イベントストリームの配信数が上限に達しています。/jobs/<job_id>で状態を確認してください。"
+        }), 503, {'Retry-After': '5'}
+    
+    # 購読者ごとに1秒あたりの送信数を制限する
+    rate = load_config().get('progress_events_per_second', DEFAULT_CONFIG['progress_events_per_second'])
+    min_interval = 1.0 / max(float(rate), 0.1)
+    
+    def generate():
+        for snapshot in job.watch(min_interval=min_interval):
+            if snapshot is None:
+                yield ": keep-alive\n\n"
+                continue
+            event = 'progress' if snapshot['state'] in ('queued', 'running') else 'done'
+            yield f"event: {event}\ndata: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+    
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    # 配信の終了（クライアントの切断を含む）でWSGIサーバーがclose()したときに枠を返す
+    response.call_on_close(release_event_stream)
+    return response
+
+# ジョブの一覧を取得（既定では実行中・待機中のみ）
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    include_finished = request.args.get('all') in ('1', 'true')
+    jobs = job_queue.list_jobs(include_finished=include_finished)
+    return jsonify({
+        "status": "success",
+        "jobs": [job.to_dict() for job in jobs],
+        "stats": job_queue.stats()
+    })
+
+# 複数URL・再生リスト・チャンネルの一括ダウンロード
+@app.route('/batch', methods=['POST'])
+def create_batch():
     try:
         data = request.json
-        video_url = data.get('video_url')
-        audio_url = data.get('audio_url')
-        title = data.get('title', 'video')
+        sources = data.get('urls') or []
+        if data.get('url'):
+            sources.append(data['url'])
+        resolution = data.get('resolution', 'best')
         format_type = data.get('format', 'mp4')
         
-        if not video_url or not audio_url:
+        if not sources or not all(isinstance(source, str) and source for source in sources):
             return jsonify({
                 "status": "error",
-                "message": "ビデオURLとオーディオURLの両方が必要です"
+                "message": "URLが指定されていません。"
             }), 400
         
-        # ユーザーのダウンロードディレクトリを取得
-        download_path = os.path.expanduser("~")
-        sanitized_title = sanitize_filename(title)
-        output_file = os.path.join(download_path, f"{sanitized_title}.{format_type}")
+        if format_type not in ('mp4', 'webm', 'mp3'):
+            return jsonify({
+                "status": "error",
+                "message": f"未対応のフォーマットです: {format_type}"
+            }), 400
         
-        # 一時ファイル名を生成
-        temp_video = os.path.join(download_path, f"temp_video_{int(time.time())}.{format_type}")
-        temp_audio = os.path.join(download_path, f"temp_audio_{int(time.time())}.m4a")
+        if not check_ffmpeg():
+            return jsonify({
+                "status": "error",
+                "message": "FFmpegがインストールされていないため、音声の変換ができません。"
+            }), 500
         
-        # 映像と音声を別々にダウンロード
-        for url, output in [(video_url, temp_video), (audio_url, temp_audio)]:
-            response = requests.get(url, stream=True)
-            response.raise_for_status()
-            with open(output, 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
+        # 再生リストの展開と各動画のジョブ投入はバックグラウンドで行う
+        batch = batch_manager.create(sources, {
+            "resolution": resolution,
+            "format": format_type
+        })
+        logger.info(f"バッチを受け付けました: {batch.id} ({len(sources)}件のURL)")
+        return jsonify({
+            "status": "success",
+            "batch_id": batch.id,
+            "state": batch.state
+        }), 202
+    except Exception as e:
+        logger.error(f"バッチの作成中にエラーが発生しました: {e}")
+        return jsonify({
+            "status": "error",
+            "message": f"バッチの作成中にエラーが発生しました: {str(e)}"
+        }), 500
+
+# バッチの状態を取得
+@app.route('/batch/<batch_id>', methods=['GET'])
+def get_batch(batch_id):
+    batch = batch_manager.get(batch_id)
+    if batch is None:
+        return jsonify({
+            "status": "error",
+            "message": "指定されたバッチが見つかりません。"
+        }), 404
+    return jsonify({
+        "status": "success",
+        "batch": batch.to_dict(job_queue, include_jobs=request.args.get('jobs') in ('1', 'true'))
+    })
+
+# 視聴中の動画の先読み（content.jsがページ表示時に呼び出す）
+@app.route('/prefetch', methods=['POST'])
+def prefetch():
+    data = request.json or {}
+    url = data.get('url')
+    if not url:
+        return jsonify({
+            "status": "error",
+            "message": "URLが指定されていません。"
+        }), 400
+    
+    config = load_config()
+    if not config.get('prefetch_enabled', DEFAULT_CONFIG['prefetch_enabled']):
+        return jsonify({"status": "success", "state": "disabled"})
+    
+    resolution = data.get('resolution') or config.get('default_resolution', DEFAULT_CONFIG['default_resolution'])
+    format_type = data.get('format') or config.get('default_format', DEFAULT_CONFIG['default_format'])
+    key = prefetch_key(url, resolution, format_type)
+    task = prefetch_manager.submit(key, url, {"resolution": resolution, "format": format_type})
+    return jsonify({
+        "status": "success",
+        "key": key,
+        "state": task.state
+    }), 202
+
+# 先読みの取り消し（別の動画に移動したときなど）
+@app.route('/prefetch/cancel', methods=['POST'])
+def cancel_prefetch():
+    data = request.json or {}
+    url = data.get('url')
+    if not url:
+        return jsonify({
+            "status": "error",
+            "message": "URLが指定されていません。"
+        }), 400
+    
+    config = load_config()
+    resolution = data.get('resolution') or config.get('default_resolution', DEFAULT_CONFIG['default_resolution'])
+    format_type = data.get('format') or config.get('default_format', DEFAULT_CONFIG['default_format'])
+    cancelled = prefetch_manager.cancel(prefetch_key(url, resolution, format_type))
+    return jsonify({"status": "success", "cancelled": cancelled})
+
+# 先読みの状態
+@app.route('/prefetch', methods=['GET'])
+def prefetch_status():
+    url = request.args.get('url')
+    if not url:
+        return jsonify({"status": "success", "prefetch": prefetch_manager.stats()})
+    
+    config = load_config()
+    resolution = request.args.get('resolution') or config.get('default_resolution', DEFAULT_CONFIG['default_resolution'])
+    format_type = request.args.get('format') or config.get('default_format', DEFAULT_CONFIG['default_format'])
+    task = prefetch_manager.get(prefetch_key(url, resolution, format_type))
+    if task is None:
+        return jsonify({
+            "status": "error",
+            "message": "指定された動画の先読みが見つかりません。"
+        }), 404
+    return jsonify({"status": "success", "prefetch": task.to_dict()})
+
+# 一時ファイルを経由した映像と音声の結合
+def merge_via_temp_files(fetch_files, video_url, audio_url, output_file, download_path, format_type):
+    """映像と音声を一時ファイルに保存してから結合する（失敗時はエラーメッセージを返す）"""
+    # 一時ファイル名を生成（同時実行でも衝突しない名前）
+    video_fd, temp_video = tempfile.mkstemp(prefix='temp_video_', suffix=f'.{format_type}', dir=download_path)
+    audio_fd, temp_audio = tempfile.mkstemp(prefix='temp_audio_', suffix='.m4a', dir=download_path)
+    os.close(video_fd)
+    os.close(audio_fd)
+    
+    try:
+        # 映像と音声を同時にダウンロード
+        with stage('merge_fetch'):
+            fetch_files([(video_url, temp_video), (audio_url, temp_audio)])
         
         # FFmpegで結合
         merge_cmd = [
-            'ffmpeg',
+            toolchain.path('ffmpeg') or 'ffmpeg',
             '-i', temp_video,
             '-i', temp_audio,
             '-c', 'copy',
@@ -737,20 +1671,94 @@ def merge_streams():
             output_file
         ]
         
-        result = subprocess.run(merge_cmd, capture_output=True, text=True)
+        if postprocess_pool.running and load_config().get('postprocess_pool', DEFAULT_CONFIG['postprocess_pool']):
+            # 後処理プールで結合する（同時に実行する結合の数をコア数までにし、CPU時間を記録する）
+            try:
+                record_postprocess_usage(STAGE_MERGE, postprocess_usage(submit_postprocess_command(merge_cmd)))
+            except PostprocessError as e:
+                return str(e)
+            return None
         
+        with stage('ffmpeg_merge'), subprocess_span('ffmpeg') as span:
+            result = subprocess.run(merge_cmd, capture_output=True, text=True)
+            span.set(returncode=result.returncode)
+        if result.returncode != 0:
+            return result.stderr
+        return None
+    finally:
         # 一時ファイルを削除
-        try:
-            os.remove(temp_video)
-            os.remove(temp_audio)
-        except:
-            pass
+        for path in (temp_video, temp_audio):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+# 映像と音声を結合するエンドポイント
+@app.route('/merge', methods=['POST'])
+def merge_streams():
+    try:
+        data = request.json
+        video_url = data.get('video_url')
+        audio_url = data.get('audio_url')
+        title = data.get('title', 'video')
+        format_type = data.get('format', 'mp4')
         
-        if result.returncode != 0:
+        if not video_url or not audio_url:
             return jsonify({
                 "status": "error",
-                "message": f"ファイルの結合に失敗しました: {result.stderr}"
-            }), 500
+                "message": "ビデオURLとオーディオURLの両方が必要です"
+            }), 400
+        
+        # ユーザーのダウンロードディレクトリを取得
+        download_path = os.path.expanduser("~")
+        sanitized_title = sanitize_filename(title)
+        output_file = os.path.join(download_path, f"{sanitized_title}.{format_type}")
+        
+        config = load_config()
+        
+        # ユーザーが完了を待っている転送として帯域の割り当てを受ける
+        allocation = bandwidth_scheduler.allocate(LANE_INTERACTIVE, name=f"merge:{sanitized_title}")
+        try:
+            fetcher = StreamFetcher(
+                chunk_size=config.get('merge_chunk_size', DEFAULT_CONFIG['merge_chunk_size']),
+                segment_size=config.get('merge_segment_size', DEFAULT_CONFIG['merge_segment_size']),
+                connections=config.get('merge_connections', DEFAULT_CONFIG['merge_connections']),
+                head_source=prefetch_manager.take_head,  # /prefetchで取得済みの先頭部分を使用
+                throttle=metered_throttle('merge', allocation.throttle)
+            )
+            
+            # 常駐aria2cが有効な場合は複数接続で一時ファイルに取得する
+            fetch_files = fetcher.fetch_all
+            use_daemon = False
+            if config.get('aria2c_rpc', DEFAULT_CONFIG['aria2c_rpc']):
+                try:
+                    fetch_files = aria2_fetcher(get_aria2_daemon(config), allocation)
+                    use_daemon = True
+                except Aria2Error as e:
+                    logger.warning(f"常駐aria2cを使用できないため内蔵の取得処理を使用します: {e}")
+            
+            # 一時ファイルを使わずにHTTPの応答をffmpegへ直接流し込む
+            merged = False
+            if not use_daemon and \
+               config.get('merge_streaming', DEFAULT_CONFIG['merge_streaming']) and streaming_supported():
+                try:
+                    # 取得と結合を同時に行うため、転送を含めた時間を記録する
+                    with stage('stream_merge'), subprocess_span('ffmpeg'):
+                        remux_streaming(fetcher, video_url, audio_url, output_file, ffmpeg=toolchain.path('ffmpeg') or 'ffmpeg')
+                    merged = True
+                except RemuxError as e:
+                    logger.warning(f"ストリーミング結合に失敗したため一時ファイル方式で再試行します: {e}")
+            
+            # シーク可能な入力が必要な場合は一時ファイルを経由して結合
+            if not merged:
+                error = merge_via_temp_files(fetch_files, video_url, audio_url, output_file, download_path, format_type)
+                if error:
+                    return jsonify({
+                        "status": "error",
+                        "message": f"ファイルの結合に失敗しました: {error}"
+                    }), 500
+        finally:
+            allocation.close()
         
         # 結合されたファイルのURLを返す
         file_url = f"file:///{output_file.replace(os.sep, '/')}"
@@ -780,52 +1788,19 @@ def get_format_ids():
                 "message": "URLが指定されていません。"
             }), 400
         
-        # フォーマット情報を取得
-        format_output = list_available_formats(url)
-        
-        # 各解像度のフォーマットIDを抽出
-        resolutions = {}
-        for line in format_output.split('\n'):
-            if not re.match(r'^\d+\s', line):
-                continue
-                
-            parts = line.split()
-            if len(parts) < 3:
-                continue
-                
-            format_id = parts[0]
-            format_ext = parts[1] if len(parts) > 1 else ""
-            
-            # 解像度を抽出
-            res_match = re.search(r'(\d+)x(\d+)', line)
-            if not res_match:
-                continue
-                
-            height = int(res_match.group(2))
-            
-            # 映像のみのフォーマットを対象
-            if 'video only' not in line:
-                continue
-                
-            # コーデック情報
-            codec_match = re.search(r'(av01|vp9|avc1)', line.lower())
-            codec = codec_match.group(1) if codec_match else "unknown"
-            
-            # 解像度ごとにフォーマット情報を保存
-            if height not in resolutions:
-                resolutions[height] = []
-                
-            resolutions[height].append({
-                "format_id": format_id,
-                "ext": format_ext,
-                "codec": codec,
-                "info": line
-            })
+        # フォーマット情報を取得（キャッシュ経由）
+        try:
+            format_index = get_format_index(url)
+        except ExtractorError as e:
+            return jsonify({
+                "status": "error",
+                "message": f"フォーマット情報の取得に失敗しました: {e}"
+            }), 500
         
-        # 解像度でソート
+        # 映像のみのフォーマットを解像度の降順でグループ化
         sorted_resolutions = {}
-        for height in sorted(resolutions.keys(), reverse=True):
-            sorted_resolutions[f"{height}p"] = resolutions[height]
+        for height, entries in format_index.group_by_height().items():
+            sorted_resolutions[f"{height}p"] = [entry.to_dict() for entry in entries]
         
         return jsonify({
             "status": "success",
@@ -845,9 +1820,119 @@ def server_status():
     return jsonify({
         "status": "running",
         "time": datetime.now().isoformat(),
-        "yt_dlp_exists": os.path.exists(YTDLP_PATH)
+        "yt_dlp_exists": os.path.exists(YTDLP_PATH),
+        "metadata_cache": metadata_cache.stats(),
+        "jobs": job_queue.stats(),
+        "toolchain": toolchain.status(),
+        "extractor_engine": extractor_pool.stats(),
+        "prefetch": prefetch_manager.stats(),
+        "library": media_library.stats(),
+        "bandwidth": bandwidth_scheduler.stats(),
+        "logging": log_pipeline.stats(),
+        "tracing": tracer.stats(),
+        "postprocess": postprocess_pool.stats()
     })
 
+# Prometheus形式のメトリクス
+@app.route('/metrics')
+def prometheus_metrics():
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+# 1件のリクエストの処理段階の表示（ウォーターフォール図、format=jsonでスパンの一覧）
+@app.route('/debug/trace/<request_id>')
+def debug_trace(request_id):
+    spans = tracer.get_trace(request_id)
+    if not spans:
+        return jsonify({
+            "status": "error",
+            "message": "指定されたリクエストのトレースが見つかりません。"
+        }), 404
+    if request.args.get('format') == 'json':
+        return jsonify({"status": "success", "request_id": request_id, "spans": spans})
+    return Response(format_waterfall(spans), mimetype='text/plain')
+
+# 外部ツールの再検出
+@app.route('/toolchain/refresh', methods=['POST'])
+def refresh_toolchain():
+    tools = toolchain.refresh()
+    return jsonify({
+        "status": "success",
+        "toolchain": {name: info.to_dict() for name, info in tools.items()}
+    })
+
+# 設定の再読み込み（サーバーを再起動せずに反映する）
+@app.route('/server/reload', methods=['POST'])
+def reload_server_settings():
+    try:
+        reload_settings()
+        return jsonify({"status": "success"})
+    except Exception as e:
+        logger.error(f"設定の再読み込み中にエラーが発生しました: {e}")
+        return jsonify({
+            "status": "error",
+            "message": f"設定の再読み込み中にエラーが発生しました: {str(e)}"
+        }), 500
+
+# 設定の反映（起動時と再読み込み時）
+def apply_config(config):
+    # ログレベル・ログファイルの切り替えの設定を反映
+    log_pipeline.configure(
+        level=config.get('log_level', DEFAULT_CONFIG['log_level']),
+        module_levels=config.get('log_levels', DEFAULT_CONFIG['log_levels']),
+        max_bytes=config.get('log_max_bytes', DEFAULT_CONFIG['log_max_bytes']),
+        backup_count=config.get('log_backup_count', DEFAULT_CONFIG['log_backup_count']),
+        rotate_interval=config.get('log_rotate_interval', DEFAULT_CONFIG['log_rotate_interval']),
+        max_message_chars=config.get('log_max_message_chars', DEFAULT_CONFIG['log_max_message_chars'])
+    )
+    
+    # メタデータキャッシュの設定を反映
+    metadata_cache.configure(
+        config.get('metadata_cache_size', DEFAULT_CONFIG['metadata_cache_size']),
+        config.get('metadata_cache_ttl', DEFAULT_CONFIG['metadata_cache_ttl']),
+        METADATA_CACHE_DIR if config.get('metadata_cache_disk', DEFAULT_CONFIG['metadata_cache_disk']) else None
+    )
+    
+    # 先読みの設定を反映
+    prefetch_manager.configure(
+        max_pending=config.get('prefetch_max_pending', DEFAULT_CONFIG['prefetch_max_pending']),
+        head_budget=config.get('prefetch_budget_bytes', DEFAULT_CONFIG['prefetch_budget_bytes']),
+        ttl=config.get('metadata_cache_ttl', DEFAULT_CONFIG['metadata_cache_ttl'])
+    )
+    
+    # 帯域の配分の設定を反映（実行中の転送の割り当ても更新される）
+    bandwidth_scheduler.configure(
+        limit=config.get('bandwidth_limit', DEFAULT_CONFIG['bandwidth_limit']),
+        bulk_limit=config.get('bandwidth_bulk_limit', DEFAULT_CONFIG['bandwidth_bulk_limit']),
+        interactive_weight=config.get('bandwidth_interactive_weight', DEFAULT_CONFIG['bandwidth_interactive_weight']),
+        bulk_windows=config.get('bandwidth_bulk_windows', DEFAULT_CONFIG['bandwidth_bulk_windows'])
+    )
+    
+    # トレースの設定を反映
+    tracer.configure(
+        enabled=config.get('trace_enabled', DEFAULT_CONFIG['trace_enabled']),
+        path=TRACE_FILE_PATH if config.get('trace_export', DEFAULT_CONFIG['trace_export']) else None,
+        max_file_bytes=config.get('trace_file_max_bytes', DEFAULT_CONFIG['trace_file_max_bytes'])
+    )
+    
+    # 後処理プールの起動（ワーカー数が変わった場合は作り直す）
+    if config.get('postprocess_pool', DEFAULT_CONFIG['postprocess_pool']):
+        postprocess_pool.start(
+            config.get('postprocess_workers', DEFAULT_CONFIG['postprocess_workers']),
+            config.get('postprocess_max_pending', DEFAULT_CONFIG['postprocess_max_pending'])
+        )
+    
+    # ダウンロードワーカーの起動
+    job_queue.start(
+        config.get('download_workers', DEFAULT_CONFIG['download_workers']),
+        config.get('download_host_limit', DEFAULT_CONFIG['download_host_limit'])
+    )
+
+# 設定の再読み込み（接続を切らずに反映する）
+def reload_settings():
+    config_store.reload()
+    apply_config(load_config())
+    logger.info("設定を再読み込みしました")
+
 # サーバー起動時の処理
 def on_startup():
     # 設定読み込みとダウンロードディレクトリの作成
@@ -861,30 +1946,125 @@ def on_startup():
         except Exception as e:
             logger.error(f"ダウンロードディレクトリの作成に失敗しました: {e}")
     
+    # キャッシュ・先読み・ダウンロードワーカーの設定を反映
+    apply_config(config)
+    
+    # 前回の終了時に完了していなかったジョブを再開
+    if config.get('job_journal', DEFAULT_CONFIG['job_journal']):
+        try:
+            job_queue.attach_journal(job_journal)
+        except Exception as e:
+            logger.error(f"ジョブのジャーナルを開けませんでした: {e}")
+    
     # FFmpegとaria2cの確認
     check_ffmpeg()
     check_aria2c()
     
+    # 情報取得用の常駐プロセスをバックグラウンドで起動（起動するまでは実行ファイルを使用）
+    if config.get('extractor_engine', DEFAULT_CONFIG['extractor_engine']) != 'subprocess':
+        if extractor_pool.available:
+            threading.Thread(target=start_extractor_pool, args=(
+                config.get('extractor_workers', DEFAULT_CONFIG['extractor_workers']),
+            ), daemon=True).start()
+        else:
+            logger.info("yt-dlpのライブラリがインストールされていないため、実行ファイルで情報を取得します")
+    
     # 自動更新が有効なら更新チェック
     if config.get('auto_update', DEFAULT_CONFIG['auto_update']):
         threading.Thread(target=check_and_update_ytdlp).start()
 
+# 情報取得用の常駐プロセスの起動
+def start_extractor_pool(workers):
+    try:
+        extractor_pool.start(workers)
+    except EngineUnavailable as e:
+        logger.error(f"{e}（実行ファイルで情報を取得します）")
+
+# 実行中のジョブの停止（配信の停止前とatexitの両方から呼ばれるため1回だけ実行する）
+_jobs_drained = False
+
+def drain_jobs():
+    global _jobs_drained
+    if _jobs_drained:
+        return
+    _jobs_drained = True
+    # 実行中のダウンロードは完了を待ち、終わらなければ中断して次回起動時に再開する
+    # （後処理プールで実行中のジョブも含む。中断した後処理は次回起動時に取得済みのファイルから再開する）
+    job_queue.shutdown(timeout=load_config().get('shutdown_drain_timeout', DEFAULT_CONFIG['shutdown_drain_timeout']))
+    postprocess_pool.shutdown(timeout=0)
+
 # サーバー終了時の処理
 def on_shutdown():
+    drain_jobs()
+    extractor_pool.shutdown()
+    if aria2_daemon is not None:
+        aria2_daemon.stop()
+    tracer.close()
     logger.info("サーバーを終了します。")
 
+# コマンドライン引数の解析
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='YouTube動画ダウンローダー サーバー')
+    parser.add_argument('port_arg', nargs='?', type=int, help='ポート番号（--portと同じ。従来の起動方法との互換用）')
+    parser.add_argument('--host', default='127.0.0.1', help='待ち受けるアドレス（既定: 127.0.0.1）')
+    parser.add_argument('--port', type=int, default=None, help='ポート番号（既定: 8745）')
+    parser.add_argument('--server', choices=SERVER_BACKENDS, default='auto',
+                        help='WSGIサーバー（auto: waitressがあれば使用し、なければWerkzeugのスレッドプール）')
+    parser.add_argument('--threads', type=int, default=DEFAULT_SERVE_OPTIONS['threads'],
+                        help='リクエストを処理するスレッド数')
+    parser.add_argument('--connection-limit', type=int, default=DEFAULT_SERVE_OPTIONS['connection_limit'],
+                        help='同時接続数の上限')
+    parser.add_argument('--keepalive-timeout', type=float, default=DEFAULT_SERVE_OPTIONS['keepalive_timeout'],
+                        help='待機中のkeep-alive接続を閉じるまでの秒数')
+    parser.add_argument('--request-timeout', type=float, default=DEFAULT_SERVE_OPTIONS['request_timeout'],
+                        help='リクエストの送受信が止まった接続を切断するまでの秒数')
+    parser.add_argument('--backlog', type=int, default=DEFAULT_SERVE_OPTIONS['backlog'],
+                        help='受け付け待ちの接続キューの長さ')
+    parser.add_argument('--dev', action='store_true', help='Flaskの開発用サーバーで起動する')
+    args = parser.parse_args(argv)
+    args.port = args.port or args.port_arg or 8745
+    return args
+
+# 終了シグナルで配信ループを抜ける（処理中のリクエストは完了させる）
+def _handle_stop_signal(signum, frame):
+    logger.info("終了シグナルを受信しました。処理中のリクエストの完了を待っています...")
+    raise KeyboardInterrupt()
+
 if __name__ == '__main__':
+    args = parse_args()
     on_startup()
     atexit.register(on_shutdown)
     
-    # コマンドライン引数でポート指定があれば使用
-    port = 8745  # デフォルトポート
-    if len(sys.argv) > 1 and sys.argv[1].isdigit():
-        port = int(sys.argv[1])
-    
     try:
-        logger.info(f"サーバーを開始します。ポート: {port}")
-        app.run(host='127.0.0.1', port=port, debug=False)
+        logger.info(f"サーバーを開始します。ポート: {args.port}")
+        if args.dev:
+            app.run(host=args.host, port=args.port, debug=False)
+            sys.exit(0)
+        
+        event_streams['threads'] = args.threads
+        server = create_server(
+            app, args.host, args.port,
+            backend=args.server,
+            threads=args.threads,
+            connection_limit=args.connection_limit,
+            keepalive_timeout=args.keepalive_timeout,
+            request_timeout=args.request_timeout,
+            backlog=args.backlog
+        )
     except Exception as e:
         logger.error(f"サーバー起動中にエラーが発生しました: {e}")
         sys.exit(1)
+    
+    signal.signal(signal.SIGTERM, _handle_stop_signal)
+    if hasattr(signal, 'SIGHUP'):
+        # SIGHUPで設定を再読み込みする（接続は維持したまま）
+        signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(target=reload_settings).start())
+    
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # ジョブを先に中断・記録してから接続を閉じる（SSEの購読はジョブの停止で応答を終える）
+        drain_jobs()
+        server.close()
@@ -0,0 +1,298 @@
+import time
+import socket
+import logging
+import selectors
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+logger = logging.getLogger(__name__)
+
+# 本番用のWSGIサーバー（未インストールの場合はWerkzeugのスレッドプール版を使用）
+try:
+    from waitress.server import create_server as create_waitress_server
+except ImportError:
+    create_waitress_server = None
+
+SERVER_BACKENDS = ('auto', 'waitress', 'werkzeug')
+
+DEFAULT_SERVE_OPTIONS = {
+    "threads": 8,  # リクエストを処理するスレッド数
+    "connection_limit": 100,  # 同時接続数の上限（超えた接続は受け付けを待たせる）
+    "keepalive_timeout": 30,  # 待機中のkeep-alive接続を閉じるまでの秒数
+    "request_timeout": 60,  # リクエストの受信・応答の送信が止まった場合に切断するまでの秒数
+    "backlog": 1024  # 受け付け待ちの接続キューの長さ
+}
+
+
+class _KeepAliveRequestHandler(WSGIRequestHandler):
+    """HTTP/1.1のkeep-aliveに対応したハンドラー（接続ごとに1つ作り、リクエストを1件ずつserve()で処理する）
+
+    リクエストの合間の待機中の接続はスレッドを使わずに_IdleConnectionsが監視する。
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def __init__(self, request, client_address, server):
+        # socketserverの既定と違い、構築時にはリクエストを処理しない
+        self.request = request
+        self.client_address = client_address
+        self.server = server
+        self.setup()
+
+    def setup(self):
+        super().setup()
+        # ヘッダーと本文の書き込みが分かれても遅延しないようにする（Nagleアルゴリズムの無効化）
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def serve(self):
+        """受信を始めたリクエストを1件処理する（接続を続けない場合はclose_connectionがTrueになる）"""
+        self.close_connection = True
+        # 受信を始めた後は処理中のタイムアウト（待機中のタイムアウトは_IdleConnectionsが扱う）
+        self.connection.settimeout(self.server.request_timeout)
+        try:
+            self.handle_one_request()
+        except (ConnectionError, socket.timeout) as e:
+            self.connection_dropped(e)
+            self.close_connection = True
+
+    def has_buffered_request(self):
+        """次のリクエストを受信済みか（パイプライン化されたリクエストはバッファに残っていて監視では検知できない）"""
+        self.connection.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        except (BlockingIOError, OSError):
+            return False
+        finally:
+            self.connection.settimeout(self.server.request_timeout)
+
+    def log_request(self, code='-', size='-'):
+        # アクセスログは高負荷時のボトルネックになるため出力しない
+        pass
+
+
+class _IdleConnections:
+    """リクエストを待っている接続を1つのスレッドで監視し、受信したらスレッドプールに渡す
+
+    接続を受け付けた直後とkeep-aliveの待機中はスレッドを使わないため、
+    待機中の接続がいくつあってもリクエストの処理が待たされない。
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._added = []
+        self._running = True
+        # 監視中のselect()を起こすためのソケット（Windowsでも使えるようにパイプではなくsocketpair）
+        self._wakeup, self._wakeup_writer = socket.socketpair()
+        self._wakeup.setblocking(False)
+        self._selector.register(self._wakeup, selectors.EVENT_READ, None)
+        self._thread = threading.Thread(target=self._run, name='http-idle', daemon=True)
+        self._thread.start()
+
+    def add(self, handler, timeout):
+        with self._lock:
+            if not self._running:
+                self.server.close_connection(handler)
+                return
+            self._added.append((handler, time.monotonic() + timeout))
+        self._wake()
+
+    def close(self):
+        """監視を終了し、待機中の接続をすべて閉じる"""
+        with self._lock:
+            self._running = False
+        self._wake()
+        self._thread.join()
+
+    def _wake(self):
+        try:
+            self._wakeup_writer.send(b'\0')
+        except OSError:
+            pass
+
+    def _run(self):
+        deadlines = {}  # handler -> 待機の期限
+        while True:
+            with self._lock:
+                running = self._running
+                added, self._added = self._added, []
+            if not running:
+                break
+            for handler, deadline in added:
+                self._selector.register(handler.connection, selectors.EVENT_READ, handler)
+                deadlines[handler] = deadline
+            timeout = max(0.0, min(deadlines.values()) - time.monotonic()) if deadlines else None
+            for key, _ in self._selector.select(timeout):
+                if key.data is None:
+                    try:
+                        while self._wakeup.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                    continue
+                self._selector.unregister(key.fileobj)
+                del deadlines[key.data]
+                self.server.dispatch(key.data)
+            now = time.monotonic()
+            for handler in [handler for handler, deadline in deadlines.items() if deadline <= now]:
+                # keep-aliveのタイムアウト（受け付けた直後に何も送られない接続も含む）
+                self._selector.unregister(handler.connection)
+                del deadlines[handler]
+                self.server.close_connection(handler)
+        with self._lock:
+            added, self._added = self._added, []
+        for handler in list(deadlines) + [handler for handler, _ in added]:
+            self.server.close_connection(handler)
+        self._selector.close()
+        self._wakeup.close()
+        self._wakeup_writer.close()
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """上限付きのスレッドプールでリクエストを処理するWerkzeugサーバー
+
+    スレッドを使うのはリクエストの処理中だけで、待機中の接続は_IdleConnectionsが監視する。
+    """
+
+    def __init__(self, host, port, app, threads, connection_limit, keepalive_timeout, request_timeout, backlog):
+        self.request_queue_size = backlog
+        self.keepalive_timeout = keepalive_timeout
+        self.request_timeout = request_timeout
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='http')
+        super().__init__(host, port, app, handler=_KeepAliveRequestHandler)
+        # 接続数が上限に達したら新しい接続の受け付けを止める（バックプレッシャー）
+        self._slots = threading.BoundedSemaphore(connection_limit)
+        self._connections = set()  # 受け付けた接続（終了時に期限を過ぎたものを切断する）
+        self._closed = threading.Condition()
+        self._idle = _IdleConnections(self)
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        try:
+            handler = self.RequestHandlerClass(request, client_address, self)
+        except Exception:
+            self.handle_error(request, client_address)
+            self.shutdown_request(request)
+            self._slots.release()
+            return
+        with self._closed:
+            self._connections.add(handler)
+        # 最初のリクエストが届くまではスレッドを使わずに待つ
+        self._idle.add(handler, self.request_timeout)
+
+    def dispatch(self, handler):
+        """リクエストを受信し始めた接続をスレッドプールで処理する"""
+        try:
+            self.executor.submit(self._serve, handler)
+        except RuntimeError:
+            self.close_connection(handler)
+
+    def _serve(self, handler):
+        while True:
+            try:
+                handler.serve()
+            except Exception:
+                self.handle_error(handler.request, handler.client_address)
+                handler.close_connection = True
+            if handler.close_connection:
+                self.close_connection(handler)
+                return
+            if not handler.has_buffered_request():
+                break
+        # 次のリクエストはスレッドを手放して待つ
+        self._idle.add(handler, self.keepalive_timeout)
+
+    def close_connection(self, handler):
+        try:
+            handler.finish()
+        except Exception:
+            pass
+        self.shutdown_request(handler.request)
+        with self._closed:
+            self._connections.discard(handler)
+            self._closed.notify_all()
+        self._slots.release()
+
+    def drain(self, timeout=5):
+        """待機中の接続を閉じ、処理中のリクエストはtimeout秒まで応答させる（残った接続は切断する）
+
+        serve_forever()を抜けるときにWerkzeugがserver_close()で受け付けを止めるため、
+        ここでは受け付け済みの接続だけを扱う。
+        """
+        self._idle.close()
+        self.executor.shutdown(wait=False)
+        with self._closed:
+            if not self._closed.wait_for(lambda: not self._connections, timeout):
+                logger.info(f"応答が終わらない接続を切断します: {len(self._connections)}件")
+                for handler in self._connections:
+                    try:
+                        handler.connection.shutdown(socket.SHUT_RDWR)
+                    except OSError:
+                        pass
+        self.executor.shutdown(wait=True)
+
+
+class AppServer:
+    """バックエンドの違いを吸収したサーバーのハンドル"""
+
+    def __init__(self, backend, server, host, port):
+        self.backend = backend
+        self._server = server
+        self.host = host
+        self.port = port
+
+    def serve_forever(self):
+        if self.backend == 'waitress':
+            self._server.run()
+        else:
+            self._server.serve_forever()
+
+    def close(self):
+        """新しい接続の受け付けを止め、処理中のリクエストの完了を待って終了する"""
+        if self.backend == 'waitress':
+            self._server.close()
+            self._server.task_dispatcher.shutdown(cancel_pending=False, timeout=5)
+        else:
+            self._server.server_close()
+            self._server.drain(timeout=5)
+
+
+# サーバーの作成
+def create_server(app, host, port, backend='auto', **options):
+    """WSGIアプリケーションを配信するサーバーを作成する"""
+    options = dict(DEFAULT_SERVE_OPTIONS, **{k: v for k, v in options.items() if v is not None})
+    if backend not in SERVER_BACKENDS:
+        raise ValueError(f"未対応のサーバーです: {backend}")
+    if backend == 'waitress' and create_waitress_server is None:
+        raise RuntimeError("waitressがインストールされていません（pip install waitress）")
+
+    if backend in ('auto', 'waitress') and create_waitress_server is not None:
+        # waitressは待機中・処理中を区別しないため、長い方を無通信タイムアウトとして使う
+        server = create_waitress_server(
+            app,
+            host=host,
+            port=port,
+            threads=options['threads'],
+            connection_limit=options['connection_limit'],
+            channel_timeout=max(options['keepalive_timeout'], options['request_timeout']),
+            backlog=options['backlog'],
+            ident='ytdl-server'
+        )
+        # 負荷が高いとキューの深さの警告がリクエストごとに出るため抑制する
+        logging.getLogger('waitress.queue').setLevel(logging.ERROR)
+        logger.info(f"waitressで配信します: スレッド {options['threads']}, 同時接続の上限 {options['connection_limit']}")
+        return AppServer('waitress', server, host, port)
+
+    server = PooledWSGIServer(
+        host, port, app,
+        threads=options['threads'],
+        connection_limit=options['connection_limit'],
+        keepalive_timeout=options['keepalive_timeout'],
+        request_timeout=options['request_timeout'],
+        backlog=options['backlog']
+    )
+    logger.info(f"Werkzeug（スレッドプール）で配信します: スレッド {options['threads']}, 同時接続の上限 {options['connection_limit']}")
+    return AppServer('werkzeug', server, host, server.server_port)
@@ -0,0 +1,230 @@
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# 既定値
+DEFAULT_CHUNK_SIZE = 1024 * 1024  # 1 MiB
+DEFAULT_SEGMENT_SIZE = 4 * 1024 * 1024  # 最初のRangeセグメント
+MIN_SEGMENT_SIZE = 1024 * 1024
+MAX_SEGMENT_SIZE = 64 * 1024 * 1024
+SEGMENT_TARGET_SECONDS = 2.0  # 1セグメントの取得にかける目標時間
+STREAM_SEGMENT_LIMIT = 8 * 1024 * 1024  # 順次配信時にメモリ上で先読みするセグメントの上限
+
+_session = None
+_session_lock = threading.Lock()
+
+
+# 接続プール付きの共有セッションを取得
+def get_session(pool_size=16):
+    """プロセス全体で共有するrequests.Sessionを返す"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+class _RangeCursor:
+    """未取得の範囲を先頭から順に切り出して各接続に割り当てる"""
+
+    def __init__(self, start, total):
+        self.position = start
+        self.total = total
+        self._lock = threading.Lock()
+
+    def take(self, size):
+        with self._lock:
+            if self.position >= self.total:
+                return None
+            start = self.position
+            end = min(start + size, self.total) - 1
+            self.position = end + 1
+            return start, end
+
+
+class StreamFetcher:
+    """HTTPストリームを接続プールと並列Rangeリクエストで取得する"""
+
+    def __init__(self, session=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 segment_size=DEFAULT_SEGMENT_SIZE, connections=4, timeout=30, head_source=None, throttle=None):
+        self.session = session or get_session()
+        self.chunk_size = chunk_size
+        self.segment_size = segment_size
+        self.connections = max(1, connections)
+        self.timeout = timeout
+        self.head_source = head_source  # 先読み済みのストリーム先頭を返す（URL -> (データ, 全体サイズ) / None）
+        self.throttle = throttle  # 受信したバイト数を渡すと帯域の上限に達するまで待つ（throttle(nbytes)）
+
+    def fetch_all(self, targets):
+        """(URL, 出力パス)のリストを同時に取得し、各ファイルの取得バイト数を返す"""
+        with ThreadPoolExecutor(max_workers=len(targets), thread_name_prefix='stream-fetch') as executor:
+            futures = [executor.submit(self.fetch, url, path) for url, path in targets]
+            return [future.result() for future in futures]
+
+    def fetch(self, url, output_path):
+        """1つのURLをファイルに保存する（Range対応なら並列セグメントで取得）"""
+        started = time.time()
+        first_end = self.segment_size - 1
+        response = self.session.get(
+            url,
+            headers={'Range': f'bytes=0-{first_end}'},
+            stream=True,
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+
+        total = self._total_size(response)
+        if response.status_code != 206 or total is None:
+            # Range非対応の場合は1本の接続で順に取得する
+            size = self._write_sequential(response, output_path)
+        else:
+            size = self._fetch_segmented(url, response, output_path, total)
+
+        elapsed = max(time.time() - started, 1e-6)
+        logger.info(f"ストリームを取得しました: {output_path} ({size} bytes, {size / elapsed / 1024 / 1024:.1f} MiB/s)")
+        return size
+
+    def iter_stream(self, url):
+        """URLの本文を先頭から順に返す（Range対応なら複数セグメントを並列に先読みする）"""
+        segment_size = min(self.segment_size, STREAM_SEGMENT_LIMIT)
+        head = self.head_source(url) if self.head_source else None
+        if head is not None:
+            # 先読み済みの先頭部分はリクエストせずにすぐ返す
+            data, total = head
+            yield data
+            position = len(data)
+        else:
+            response = self.session.get(
+                url,
+                headers={'Range': f'bytes=0-{segment_size - 1}'},
+                stream=True,
+                timeout=self.timeout
+            )
+            response.raise_for_status()
+
+            total = self._total_size(response)
+            with response:
+                for chunk in response.iter_content(chunk_size=self.chunk_size):
+                    self._throttle(len(chunk))
+                    yield chunk
+            if response.status_code != 206 or total is None:
+                return
+            position = segment_size
+
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.connections, thread_name_prefix='range-stream') as executor:
+            while position < total or pending:
+                # 接続数分のセグメントを先読みし、取得順ではなく位置順に返す
+                while position < total and len(pending) < self.connections:
+                    end = min(position + segment_size, total) - 1
+                    pending.append(executor.submit(self._get_range, url, position, end))
+                    position = end + 1
+                yield pending.popleft().result()
+
+    def fetch_head(self, url, size):
+        """ストリームの先頭sizeバイトを取得する（Range非対応の場合はNone）"""
+        response = self.session.get(url, headers={'Range': f'bytes=0-{size - 1}'}, timeout=self.timeout)
+        response.raise_for_status()
+        total = self._total_size(response)
+        if response.status_code != 206 or total is None:
+            return None
+        return response.content, total
+
+    def _get_range(self, url, start, end):
+        response = self.session.get(url, headers={'Range': f'bytes={start}-{end}'}, stream=True, timeout=self.timeout)
+        response.raise_for_status()
+        with response:
+            chunks = []
+            for chunk in response.iter_content(chunk_size=self.chunk_size):
+                self._throttle(len(chunk))
+                chunks.append(chunk)
+        content = b''.join(chunks)
+        if response.status_code != 206 or len(content) != end - start + 1:
+            raise IOError(f"セグメントの取得に失敗しました: {start}-{end} (HTTP {response.status_code})")
+        return content
+
+    def _throttle(self, nbytes):
+        if self.throttle is not None:
+            self.throttle(nbytes)
+
+    @staticmethod
+    def _total_size(response):
+        content_range = response.headers.get('Content-Range', '')
+        if '/' in content_range:
+            total = content_range.rsplit('/', 1)[1]
+            if total.isdigit():
+                return int(total)
+        return None
+
+    def _write_sequential(self, response, output_path):
+        size = 0
+        with response, open(output_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=self.chunk_size):
+                self._throttle(len(chunk))
+                f.write(chunk)
+                size += len(chunk)
+        return size
+
+    def _fetch_segmented(self, url, first_response, output_path, total):
+        # 出力ファイルを最終サイズで確保してから各セグメントを書き込む
+        with open(output_path, 'wb') as f:
+            f.truncate(total)
+        with first_response, open(output_path, 'r+b') as f:
+            first_size = self._copy_body(first_response, f, 0)
+
+        cursor = _RangeCursor(first_size, total)
+        workers = min(self.connections, max(1, -(-(total - first_size) // MIN_SEGMENT_SIZE)))
+        if cursor.position < total:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='range-fetch') as executor:
+                futures = [executor.submit(self._segment_worker, url, output_path, cursor)
+                           for _ in range(workers)]
+                for future in futures:
+                    future.result()
+        return total
+
+    def _segment_worker(self, url, output_path, cursor):
+        """カーソルから範囲を取り出して取得し続ける（範囲の大きさは実測スループットで調整）"""
+        segment_size = self.segment_size
+        with open(output_path, 'r+b') as f:
+            while True:
+                segment = cursor.take(segment_size)
+                if segment is None:
+                    return
+                start, end = segment
+                started = time.time()
+                response = self.session.get(
+                    url,
+                    headers={'Range': f'bytes={start}-{end}'},
+                    stream=True,
+                    timeout=self.timeout
+                )
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise IOError(f"Rangeリクエストが拒否されました: {response.status_code}")
+                with response:
+                    written = self._copy_body(response, f, start)
+                if written != end - start + 1:
+                    raise IOError(f"セグメントの取得が途中で終了しました: {start}-{end}")
+
+                throughput = written / max(time.time() - started, 1e-6)
+                segment_size = int(min(MAX_SEGMENT_SIZE, max(MIN_SEGMENT_SIZE, throughput * SEGMENT_TARGET_SECONDS)))
+
+    def _copy_body(self, response, f, offset):
+        f.seek(offset)
+        written = 0
+        for chunk in response.iter_content(chunk_size=self.chunk_size):
+            self._throttle(len(chunk))
+            f.write(chunk)
+            written += len(chunk)
+        return written
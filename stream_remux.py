@@ -0,0 +1,129 @@
+import os
+import uuid
+import logging
+import threading
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+# Windowsでは名前付きパイプ（pywin32）を使用する
+try:
+    import win32file
+    import win32pipe
+except ImportError:
+    win32file = None
+    win32pipe = None
+
+PIPE_BUFFER_SIZE = 1024 * 1024
+
+
+# ストリーミング結合が使えない、または失敗した場合のエラー
+class RemuxError(Exception):
+    pass
+
+
+# ストリーミング結合が利用可能か
+def streaming_supported():
+    """2本目の入力をパイプで渡せる環境かを判定する"""
+    return os.name != 'nt' or win32pipe is not None
+
+
+class _NamedPipeWriter:
+    """Windowsの名前付きパイプへの書き込み（ffmpegが接続するまで最初の書き込みで待つ）"""
+
+    def __init__(self):
+        self.path = rf'\\.\pipe\ytdl-remux-{os.getpid()}-{uuid.uuid4().hex}'
+        self._handle = win32pipe.CreateNamedPipe(
+            self.path,
+            win32pipe.PIPE_ACCESS_OUTBOUND,
+            win32pipe.PIPE_TYPE_BYTE | win32pipe.PIPE_WAIT,
+            1, PIPE_BUFFER_SIZE, PIPE_BUFFER_SIZE, 0, None
+        )
+        self._connected = False
+
+    def write(self, data):
+        if not self._connected:
+            win32pipe.ConnectNamedPipe(self._handle, None)
+            self._connected = True
+        win32file.WriteFile(self._handle, data)
+
+    def close(self):
+        win32file.CloseHandle(self._handle)
+
+
+def _pump(chunks, sink, errors):
+    """チャンクをパイプに書き込む（ffmpegが先に終了した場合は中断する）"""
+    try:
+        for chunk in chunks:
+            sink.write(chunk)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        try:
+            sink.close()
+        except Exception:
+            pass
+
+
+# HTTPの応答を直接ffmpegに流し込んで結合
+def remux_streaming(fetcher, video_url, audio_url, output_file, ffmpeg='ffmpeg'):
+    """映像は標準入力、音声は追加のパイプでffmpegに渡し、一時ファイルなしで結合する"""
+    if not streaming_supported():
+        raise RemuxError("この環境ではストリーミング結合を利用できません")
+
+    pass_fds = ()
+    if os.name == 'nt':
+        audio_sink = _NamedPipeWriter()
+        audio_input = audio_sink.path
+    else:
+        read_fd, write_fd = os.pipe()
+        audio_sink = os.fdopen(write_fd, 'wb', buffering=PIPE_BUFFER_SIZE)
+        audio_input = f'pipe:{read_fd}'
+        pass_fds = (read_fd,)
+
+    cmd = [
+        ffmpeg,
+        '-hide_banner',
+        '-i', 'pipe:0',
+        '-i', audio_input,
+        '-c', 'copy',
+        '-map', '0:v',
+        '-map', '1:a',
+        '-y',
+        output_file
+    ]
+    try:
+        process = subprocess.Popen(
+            cmd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            pass_fds=pass_fds
+        )
+    except OSError as e:
+        # ffmpegが見つからない場合など（呼び出し元は一時ファイルでの結合に切り替える）
+        audio_sink.close()
+        raise RemuxError(f"ffmpegを起動できませんでした: {e}") from e
+    finally:
+        for fd in pass_fds:
+            os.close(fd)
+
+    errors = []
+    pumps = [
+        threading.Thread(target=_pump, args=(fetcher.iter_stream(video_url), process.stdin, errors), daemon=True),
+        threading.Thread(target=_pump, args=(fetcher.iter_stream(audio_url), audio_sink, errors), daemon=True)
+    ]
+    for pump in pumps:
+        pump.start()
+
+    stderr = process.stderr.read().decode('utf-8', errors='replace')
+    returncode = process.wait()
+    # ffmpegが入力を開く前に終了した場合でも待ち続けないようにする
+    for pump in pumps:
+        pump.join(timeout=10)
+
+    if returncode != 0:
+        raise RemuxError(f"ffmpegによるストリーミング結合に失敗しました: {stderr[-2000:]}")
+    if errors:
+        raise RemuxError(f"ストリームの転送に失敗しました: {errors[0]}")
+    return stderr
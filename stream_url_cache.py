@@ -0,0 +1,81 @@
+import time
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+# 有効期限の手前で失効させる秒数（ダウンロード開始までの余裕）
+DEFAULT_EXPIRY_MARGIN = 300
+
+# URLに有効期限が含まれない場合の保持秒数
+DEFAULT_TTL = 600
+
+
+# ストリームURLの有効期限
+def url_expiry(url):
+    """URLのexpireパラメーター（UNIX時刻）を返す（ない場合はNone）"""
+    parsed = urlparse(url)
+    values = parse_qs(parsed.query).get('expire')
+    if not values:
+        # /expire/1700000000/ のようにパスに含まれる形式
+        parts = parsed.path.split('/')
+        if 'expire' in parts:
+            index = parts.index('expire')
+            values = parts[index + 1:index + 2]
+    try:
+        return int(values[0]) if values else None
+    except ValueError:
+        return None
+
+
+class StreamUrlCache:
+    """解決済みのストリームURLを、URL自体の有効期限まで保持するキャッシュ"""
+
+    def __init__(self, max_entries=256, margin=DEFAULT_EXPIRY_MARGIN, default_ttl=DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.margin = margin
+        self.default_ttl = default_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def put(self, key, value, urls):
+        """valueを保持する（期限はurlsのうち最も早く切れるものに合わせる）"""
+        now = time.time()
+        expiries = [expiry for expiry in (url_expiry(url) for url in urls if url) if expiry is not None]
+        expires_at = min(expiries) - self.margin if expiries else now + self.default_ttl
+        if expires_at <= now:
+            return False
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return True
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses
+            }
@@ -0,0 +1,166 @@
+import os
+import re
+import time
+import shutil
+import logging
+import threading
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+# 各ツールのバージョン確認オプション
+VERSION_ARGS = {
+    'ffmpeg': ['-version'],
+    'ffprobe': ['-version'],
+    'aria2c': ['--version'],
+    'yt-dlp': ['--version']
+}
+
+# 見つからなかったツールを再検索するまでの秒数
+MISSING_RECHECK_INTERVAL = 60
+
+
+class ToolInfo:
+    """検出したツールのパス・バージョン・機能"""
+
+    def __init__(self, name, path=None, version=None, capabilities=None, mtime=None):
+        self.name = name
+        self.path = path
+        self.version = version
+        self.capabilities = capabilities or []
+        self.mtime = mtime
+        self.checked_at = time.time()
+
+    @property
+    def available(self):
+        return self.path is not None and self.version is not None
+
+    def to_dict(self):
+        return {
+            "available": self.available,
+            "path": self.path,
+            "version": self.version,
+            "capabilities": self.capabilities,
+            "checked_at": self.checked_at
+        }
+
+
+def _parse_version(name, output):
+    first_line = output.strip().split('\n')[0] if output.strip() else ''
+    if name in ('ffmpeg', 'ffprobe'):
+        match = re.search(r'version\s+(\S+)', first_line)
+        return match.group(1) if match else first_line
+    if name == 'aria2c':
+        match = re.search(r'aria2 version\s+(\S+)', first_line)
+        return match.group(1) if match else first_line
+    return first_line
+
+
+def _parse_capabilities(name, output):
+    if name in ('ffmpeg', 'ffprobe'):
+        # ビルド構成の--enable-xxx（例: libmp3lame, libx264）
+        return sorted(set(re.findall(r'--enable-([\w-]+)', output)))
+    if name == 'aria2c':
+        match = re.search(r'Enabled Features:\s*(.+)', output)
+        return [feature.strip() for feature in match.group(1).split(',')] if match else []
+    return []
+
+
+class ToolchainRegistry:
+    """外部ツールを一度だけ検出し、実行ファイルが更新されたときだけ再確認する"""
+
+    def __init__(self, explicit_paths=None, search_dirs=None):
+        self.explicit_paths = dict(explicit_paths or {})
+        self.search_dirs = list(search_dirs or [])
+        self._tools = {}
+        self._probe_locks = {}  # ツールごとの確認用ロック（同じツールを同時に確認しない）
+        self._lock = threading.Lock()
+
+    def get(self, name, refresh=False):
+        """ツールの情報を返す（必要な場合のみバージョン確認のプロセスを起動する）
+
+        確認はロックの外で行い（他のツールの取得を待たせない）、結果だけをロック内で登録する。
+        """
+        with self._lock:
+            info = self._tools.get(name)
+            probe_lock = self._probe_locks.setdefault(name, threading.Lock())
+        if not refresh and info is not None and not self._is_stale(info):
+            return info
+        with probe_lock:
+            with self._lock:
+                current = self._tools.get(name)
+            if current is not info:
+                # 待っている間に他のスレッドが確認を終えた
+                return current
+            info = self._probe(name)
+            with self._lock:
+                self._tools[name] = info
+            return info
+
+    def path(self, name):
+        """ツールの実行パスを返す（見つからなければNone）"""
+        info = self.get(name)
+        return info.path if info.available else None
+
+    def refresh(self, name=None):
+        """ツールを強制的に再検出する"""
+        names = [name] if name else list(VERSION_ARGS)
+        return {tool: self.get(tool, refresh=True) for tool in names}
+
+    def status(self):
+        return {name: self.get(name).to_dict() for name in VERSION_ARGS}
+
+    def _resolve(self, name):
+        explicit = self.explicit_paths.get(name)
+        if explicit:
+            return explicit if os.path.exists(explicit) else None
+        found = shutil.which(name)
+        if found:
+            return found
+        for directory in self.search_dirs:
+            for candidate in (name, f"{name}.exe"):
+                path = os.path.join(directory, candidate)
+                if os.path.isfile(path):
+                    return path
+        return None
+
+    def _is_stale(self, info):
+        if info.path is None:
+            return time.time() - info.checked_at > MISSING_RECHECK_INTERVAL
+        try:
+            return os.path.getmtime(info.path) != info.mtime
+        except OSError:
+            return True
+
+    def _probe(self, name):
+        path = self._resolve(name)
+        if path is None:
+            logger.warning(f"{name}が見つかりません")
+            return ToolInfo(name)
+        mtime = None
+        try:
+            mtime = os.path.getmtime(path)
+            result = subprocess.run(
+                [path] + VERSION_ARGS[name],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                encoding='utf-8',
+                errors='replace',
+                timeout=30
+            )
+            if result.returncode != 0:
+                logger.warning(f"{name}のバージョン確認に失敗しました: {result.stderr.strip()}")
+                return ToolInfo(name, path=path, mtime=mtime)
+            info = ToolInfo(
+                name,
+                path=path,
+                version=_parse_version(name, result.stdout),
+                capabilities=_parse_capabilities(name, result.stdout),
+                mtime=mtime
+            )
+            logger.info(f"{name}を検出しました: {path} (バージョン: {info.version})")
+            return info
+        except Exception as e:
+            logger.warning(f"{name}の確認中にエラーが発生しました: {e}")
+            return ToolInfo(name, path=path, mtime=mtime)
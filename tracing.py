@@ -0,0 +1,344 @@
+import os
+import re
+import json
+import time
+import queue
+import atexit
+import uuid
+import logging
+import threading
+import functools
+import contextvars
+from collections import OrderedDict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# リクエストIDを受け取る・返すヘッダー
+REQUEST_ID_HEADER = 'X-Request-ID'
+REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+# ファイルへの書き込み待ちの上限（あふれたスパンはファイルには書かずに件数を記録する）
+DEFAULT_QUEUE_SIZE = 10000
+# 書き込みスレッドが1回にまとめて書き込むスパンの数
+WRITE_BATCH_SIZE = 500
+
+# 書き込みスレッドを終了させる印
+_STOP = object()
+
+# 実行中のスパン（スレッド・ジョブごとに引き継がれる）
+_current_span = contextvars.ContextVar('ytdl_current_span', default=None)
+
+
+def current_request_id():
+    """実行中のリクエストのID（リクエストの外ではNone）"""
+    span = _current_span.get()
+    return span.trace_id if span is not None else None
+
+
+def valid_request_id(value):
+    """クライアントが指定したリクエストIDを使えるか（ログ・ファイルを壊す文字を含まないか）"""
+    return bool(value) and REQUEST_ID_RE.match(value) is not None
+
+
+class RequestIdFilter(logging.Filter):
+    """ログにリクエストIDを付ける（%(request_id)sで出力する）"""
+
+    def filter(self, record):
+        record.request_id = current_request_id() or '-'
+        return True
+
+
+class Span:
+    """計測中の1区間（リクエスト全体・処理段階・外部プロセスなど）"""
+
+    def __init__(self, tracer, trace_id, name, parent_id=None, attributes=None):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.start = time.time()
+        self.duration = None
+        self.error = None
+        self._started = time.perf_counter()
+        self._token = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self, error=None):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._started
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}" if isinstance(error, BaseException) else str(error)
+        if self._token is not None:
+            try:
+                _current_span.reset(self._token)
+            except ValueError:
+                # 開始したときと別のコンテキストで終了した場合
+                pass
+            self._token = None
+        self.tracer._export(self)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration": self.duration,
+            "error": self.error,
+            "thread": threading.current_thread().name,
+            "attributes": dict(self.attributes)
+        }
+
+
+class _NullSpan:
+    """トレースの外・無効時に返す何もしないスパン"""
+    trace_id = None
+
+    def set(self, **attributes):
+        pass
+
+    def finish(self, error=None):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """リクエスト単位のトレース（入れ子のスパン）を記録する
+
+    完了したスパンは直近のトレースとしてメモリに保持し、
+    pathを指定した場合はJSON Linesでファイルにも書き出す。
+    ファイルへの書き込みはバックグラウンドのスレッドで行い、スパンを終了したスレッドを待たせない。
+    """
+
+    def __init__(self, path=None, enabled=True, max_traces=500, max_file_bytes=10 * 1024 * 1024,
+                 queue_size=DEFAULT_QUEUE_SIZE):
+        self.path = path
+        self.enabled = enabled
+        self.max_traces = max_traces
+        self.max_file_bytes = max_file_bytes  # これを超えたら.1に移して書き直す
+        self.dropped = 0  # 書き込みが追いつかずにファイルに書かなかったスパンの累計
+        self._traces = OrderedDict()  # trace_id -> スパンの辞書のリスト
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)  # (書き込み先, スパンの辞書)
+        self._writer = None
+        self._unreported = 0
+        self._atexit_registered = False
+
+    def configure(self, enabled=None, path=None, max_file_bytes=None):
+        with self._lock:
+            if enabled is not None:
+                self.enabled = enabled
+            if max_file_bytes is not None:
+                self.max_file_bytes = max_file_bytes
+            # 書き込み先の切り替えは書き込みスレッドが次のスパンで行う
+            self.path = path
+
+    def start_trace(self, name, trace_id=None, **attributes):
+        """リクエストのルートのスパンを開始する（finish()するまで以降のスパンはこのトレースに属する）"""
+        if not self.enabled:
+            return NULL_SPAN
+        span = Span(self, trace_id or uuid.uuid4().hex, name, attributes=attributes)
+        span._token = _current_span.set(span)
+        return span
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """実行中のトレースに子のスパンを追加する（トレースの外では何もしない）"""
+        parent = _current_span.get()
+        if parent is None or not self.enabled:
+            yield NULL_SPAN
+            return
+        span = Span(self, parent.trace_id, name, parent.span_id, attributes)
+        span._token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.finish(error=e)
+            raise
+        span.finish()
+
+    def traced(self, name=None):
+        """関数の実行をスパンとして記録するデコレーター"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name or func.__name__):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def annotate(self, **attributes):
+        """実行中のスパンに属性を追加する"""
+        span = _current_span.get()
+        if span is not None:
+            span.set(**attributes)
+
+    def record(self, name, duration, **attributes):
+        """終わったばかりの区間（外部プロセスが報告した後処理など）をスパンとして追加する"""
+        parent = _current_span.get()
+        if parent is None or not self.enabled:
+            return
+        span = Span(self, parent.trace_id, name, parent.span_id, attributes)
+        span.start -= duration
+        span._started -= duration
+        span.finish()
+
+    def get_trace(self, trace_id):
+        """トレースのスパンを開始順に返す（メモリになければファイルから探す）"""
+        with self._lock:
+            spans = list(self._traces.get(trace_id) or [])
+            path = self.path
+        if not spans and path:
+            spans = self._read_trace(path, trace_id)
+        return sorted(spans, key=lambda span: span['start'])
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "queued": self._queue.qsize(),
+            "dropped": self.dropped,
+            "file": os.path.abspath(self.path) if self.path else None
+        }
+
+    def close(self):
+        """書き込み待ちのスパンをファイルに書き出して書き込みスレッドを終了する"""
+        with self._lock:
+            writer, self._writer = self._writer, None
+        if writer is not None:
+            self._queue.put(_STOP)
+            writer.join()
+
+    def _export(self, span):
+        record = span.to_dict()
+        with self._lock:
+            spans = self._traces.get(span.trace_id)
+            if spans is None:
+                spans = self._traces[span.trace_id] = []
+                while len(self._traces) > self.max_traces:
+                    self._traces.popitem(last=False)
+            spans.append(record)
+            path = self.path
+            if path and self._writer is None:
+                self._start_writer_locked()
+        if not path:
+            return
+        try:
+            self._queue.put_nowait((path, record))
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+                self._unreported += 1
+            return
+        if self._unreported:
+            with self._lock:
+                unreported, self._unreported = self._unreported, 0
+            if unreported:
+                logger.warning(f"トレースの書き込みが追いつかないため{unreported}件をファイルに書きませんでした")
+
+    def _start_writer_locked(self):
+        self._writer = threading.Thread(target=self._write_loop, name='trace-writer', daemon=True)
+        self._writer.start()
+        if not self._atexit_registered:
+            atexit.register(self.close)
+            self._atexit_registered = True
+
+    def _write_loop(self):
+        """待ち行列のスパンをまとめてファイルに書き込む（ファイルは書き込みスレッドだけが扱う）"""
+        file = None
+        file_path = None
+        stopping = False
+        while not stopping:
+            items = [self._queue.get()]
+            while len(items) < WRITE_BATCH_SIZE:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                for item in items:
+                    if item is _STOP:
+                        stopping = True
+                        continue
+                    path, record = item
+                    if path != file_path and file is not None:
+                        file.close()
+                        file = None
+                    if file is None:
+                        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                        file = open(path, 'a', encoding='utf-8')
+                        file_path = path
+                    file.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+                if file is not None:
+                    file.flush()
+                    if self.max_file_bytes and file.tell() > self.max_file_bytes:
+                        file.close()
+                        file = None
+                        os.replace(file_path, file_path + '.1')
+            except OSError as e:
+                logger.warning(f"トレースの書き込みに失敗しました: {e}")
+                if file is not None:
+                    try:
+                        file.close()
+                    except OSError:
+                        pass
+                    file = None
+        if file is not None:
+            file.close()
+
+    @staticmethod
+    def _read_trace(path, trace_id):
+        spans = []
+        marker = f'"trace_id": "{trace_id}"'
+        for candidate in (path + '.1', path):
+            if not os.path.exists(candidate):
+                continue
+            with open(candidate, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if marker not in line:
+                        continue
+                    try:
+                        spans.append(json.loads(line))
+                    except ValueError:
+                        continue
+        return spans
+
+
+# トレースの表示
+def format_waterfall(spans, width=40):
+    """スパンの開始・所要時間をテキストのウォーターフォール図にする"""
+    if not spans:
+        return ''
+    origin = min(span['start'] for span in spans)
+    end = max(span['start'] + (span['duration'] or 0) for span in spans)
+    total = max(end - origin, 1e-6)
+    depths = {}
+    by_id = {span['span_id']: span for span in spans}
+
+    def depth(span):
+        if span['span_id'] not in depths:
+            parent = by_id.get(span['parent_id'])
+            depths[span['span_id']] = depth(parent) + 1 if parent is not None else 0
+        return depths[span['span_id']]
+
+    lines = [f"trace {spans[0]['trace_id']}  total {total * 1000:.1f}ms"]
+    for span in spans:
+        offset = span['start'] - origin
+        duration = span['duration'] or 0
+        left = int(offset / total * width)
+        bar = ' ' * left + '#' * max(1, int(duration / total * width))
+        attributes = ' '.join(f"{key}={value}" for key, value in span['attributes'].items())
+        error = f"  ERROR: {span['error']}" if span.get('error') else ''
+        lines.append(
+            f"{offset * 1000:9.1f}ms {duration * 1000:9.1f}ms |{bar[:width]:<{width}}| "
+            f"{'  ' * depth(span)}{span['name']} {attributes}".rstrip() + error
+        )
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,18 @@
+import sys
+import multiprocessing
+
+# spawnで起動するワーカープロセス（yt-dlpエンジン・後処理）で__main__の代わりに読み込ませるモジュール
+#
+# spawnのワーカーは親プロセスの__main__を__mp_main__として読み込み直すため、server.pyから起動すると
+# ワーカーごとにFlaskアプリ・ログの書き込みスレッド・SQLiteの接続まで作られる。
+# ワーカーが実行するのはytdlp_engine・postprocessの関数だけなので、代わりにこのモジュールを読み込ませる。
+# ワーカーの起動が遅くならないよう、このモジュールには標準ライブラリ以外のインポートや初期化処理を追加しないこと。
+
+
+def spawn_context():
+    """ワーカープロセスの生成に使うspawnのコンテキストを返す（ワーカーではこのモジュールだけを__main__として読み込ませる）"""
+    main = sys.modules.get('__main__')
+    # multiprocessingは__main__.__spec__が設定されていればファイルではなくそのモジュール名で読み込み直す
+    if main is not None and getattr(main.__spec__, 'name', None) != __spec__.name:
+        main.__spec__ = __spec__
+    return multiprocessing.get_context('spawn')
@@ -0,0 +1,182 @@
+import time
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from extractor_output import project_info
+from worker_main import spawn_context
+
+logger = logging.getLogger(__name__)
+
+# yt-dlpをライブラリとして使用する（未インストールの場合は実行ファイルのみ）
+try:
+    import yt_dlp
+except ImportError:
+    yt_dlp = None
+
+# 情報取得用のYoutubeDLの共通オプション
+EXTRACT_OPTIONS = {
+    'quiet': True,
+    'no_warnings': True,
+    'noplaylist': True,
+    'skip_download': True,
+    'noprogress': True
+}
+
+# ワーカープロセスごとに1つだけ保持するYoutubeDL
+_worker_ydl = None
+
+
+# ライブラリによる情報取得の失敗（ワーカープロセスから返すためメッセージのみ保持する）
+class ExtractionFailed(Exception):
+    pass
+
+
+# エンジンが利用できない（未インストール・未起動・プロセスの異常終了）
+class EngineUnavailable(Exception):
+    pass
+
+
+def _init_worker(options, warm_extractors):
+    """ワーカープロセスでYoutubeDLを生成し、よく使う抽出器を読み込んでおく"""
+    global _worker_ydl
+    _worker_ydl = yt_dlp.YoutubeDL(dict(options))
+    for ie_key in warm_extractors:
+        try:
+            _worker_ydl.get_info_extractor(ie_key)
+        except Exception:
+            pass
+
+
+def _ping():
+    return True
+
+
+def _extract(url, format_spec=None, fields=None):
+    """ワーカープロセス上で動画情報を取得し、-Jと同じ形式の辞書を返す（fields指定時はその項目だけ）"""
+    ydl = _worker_ydl
+    try:
+        # 同じインスタンスを使い回すため、フォーマット指定は呼び出しごとに差し替える
+        ydl.params['format'] = format_spec
+        ydl.format_selector = ydl.build_format_selector(format_spec) if format_spec else None
+        info = ydl.extract_info(url, download=False)
+        info = ydl.sanitize_info(info)
+        # 呼び出し元に送る前にワーカープロセス上で絞り込む（受け渡すデータを小さくする）
+        return project_info(info, fields) if fields else info
+    except Exception as e:
+        raise ExtractionFailed(str(e))
+
+
+class ExtractorPool:
+    """初期化済みのYoutubeDLを保持するワーカープロセスのプール"""
+
+    def __init__(self, workers=2, options=None, warm_extractors=('Youtube', 'YoutubeTab'), timeout=120):
+        self.workers = workers
+        self.options = dict(EXTRACT_OPTIONS, **(options or {}))
+        self.warm_extractors = tuple(warm_extractors)
+        self.timeout = timeout
+        self._executor = None
+        self._lock = threading.Lock()
+        self._stats = {"extractions": 0, "failures": 0, "restarts": 0, "total_time": 0.0}
+
+    @property
+    def available(self):
+        """yt-dlpのライブラリがインストールされているか"""
+        return yt_dlp is not None
+
+    @property
+    def running(self):
+        return self._executor is not None
+
+    @property
+    def version(self):
+        return yt_dlp.version.__version__ if yt_dlp is not None else None
+
+    def start(self, workers=None):
+        """ワーカープロセスを起動し、全プロセスの初期化が終わるまで待つ"""
+        if not self.available:
+            raise EngineUnavailable("yt-dlpのライブラリがインストールされていません")
+        with self._lock:
+            if workers is not None:
+                self.workers = workers
+            if self._executor is not None:
+                return
+            started = time.time()
+            # 起動済みのスレッドを引き継がないようにspawnでプロセスを生成する
+            executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=spawn_context(),
+                initializer=_init_worker,
+                initargs=(self.options, self.warm_extractors)
+            )
+            try:
+                for future in [executor.submit(_ping) for _ in range(self.workers)]:
+                    future.result(timeout=self.timeout)
+            except Exception as e:
+                executor.shutdown(wait=False)
+                raise EngineUnavailable(f"yt-dlpのワーカープロセスを起動できませんでした: {e}")
+            self._executor = executor
+            logger.info(
+                f"yt-dlpエンジンを起動しました: バージョン {self.version}, "
+                f"ワーカー {self.workers}, 起動時間 {time.time() - started:.1f}秒"
+            )
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+            logger.info("yt-dlpエンジンを停止しました")
+
+    def extract_info(self, url, format_spec=None, fields=None):
+        """動画情報を取得する（-J、または-J -f format_specと同じ結果。fields指定時はその項目だけ）"""
+        executor = self._executor
+        if executor is None:
+            raise EngineUnavailable("yt-dlpエンジンが起動していません")
+        started = time.time()
+        try:
+            info = executor.submit(_extract, url, format_spec, fields).result(timeout=self.timeout)
+        except ExtractionFailed:
+            self._stats["failures"] += 1
+            raise
+        except FutureTimeoutError:
+            self._stats["failures"] += 1
+            raise EngineUnavailable(f"yt-dlpエンジンの情報取得が{self.timeout}秒以内に終わりませんでした")
+        except BrokenProcessPool as e:
+            # 異常終了したプロセスを含むプールは作り直す
+            self._stats["failures"] += 1
+            self._restart(executor)
+            raise EngineUnavailable(f"yt-dlpのワーカープロセスが異常終了しました: {e}")
+        self._stats["extractions"] += 1
+        self._stats["total_time"] += time.time() - started
+        return info
+
+    def _restart(self, broken):
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = None
+            self._stats["restarts"] += 1
+        broken.shutdown(wait=False)
+        logger.warning("yt-dlpエンジンを再起動します")
+        threading.Thread(target=self._try_start, daemon=True).start()
+
+    def _try_start(self):
+        try:
+            self.start()
+        except EngineUnavailable as e:
+            logger.error(str(e))
+
+    def stats(self):
+        extractions = self._stats["extractions"]
+        return {
+            "available": self.available,
+            "running": self.running,
+            "version": self.version,
+            "workers": self.workers,
+            "extractions": extractions,
+            "failures": self._stats["failures"],
+            "restarts": self._stats["restarts"],
+            "average_time": self._stats["total_time"] / extractions if extractions else 0
+        }